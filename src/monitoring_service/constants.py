@@ -1,5 +1,6 @@
 import textwrap
 from datetime import timedelta
+from typing import Dict
 
 from raiden_common.utils.typing import BlockTimeout
 
@@ -19,6 +20,13 @@ DEFAULT_MIN_REWARD = 5 * 10**18
 # bursts of messages, this is only enforced as an average over 5 minutes.
 MATRIX_RATE_LIMIT_ALLOWED_BYTES = 5_000_000
 MATRIX_RATE_LIMIT_RESET_INTERVAL = timedelta(minutes=5)
+# Senders which haven't sent messages for a long time are forgotten
+MATRIX_RATE_LIMIT_MAX_SENDERS = 10_000
+# Type of the lines in a message payload which don't contain a message type
+MATRIX_UNKNOWN_MESSAGE_TYPE = "unknown"
+# Lines without a message type can't be deserialized, so there is no reason to
+# accept many of them
+MATRIX_RATE_LIMIT_MESSAGE_TYPE_BUDGETS: Dict[str, int] = {MATRIX_UNKNOWN_MESSAGE_TYPE: 100_000}
 
 # Number of blocks after the close, during which MRs are still being accepted
 CHANNEL_CLOSE_MARGIN: int = 10
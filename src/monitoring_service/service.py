@@ -175,6 +175,7 @@ class MonitoringService:
             blockchain_state=self.context.ms_state.blockchain_state,
             token_network_addresses=token_network_addresses,
             latest_confirmed_block=latest_confirmed_block,
+            handled_event_types=HANDLERS.keys(),
         )
 
         if events is None:
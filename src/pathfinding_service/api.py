@@ -1,7 +1,7 @@
 import collections
 from dataclasses import dataclass, field
 from datetime import MINYEAR, datetime
-from typing import Any, ClassVar, Dict, List, Optional, Tuple, Type, TypeVar, Union, cast
+from typing import Any, ClassVar, Dict, List, Optional, Sequence, Tuple, Type, TypeVar, Union, cast
 from uuid import UUID
 
 import marshmallow
@@ -38,16 +38,17 @@ from pathfinding_service.constants import (
     DEFAULT_INFO_MESSAGE,
     DEFAULT_MAX_PATHS,
     MAX_AGE_OF_IOU_REQUESTS,
+    MAX_PATH_QUERIES_PER_BATCH,
     MAX_PATHS_PER_REQUEST,
     MIN_IOU_EXPIRY,
 )
 from pathfinding_service.model import IOU
 from pathfinding_service.model.feedback import FeedbackToken
-from pathfinding_service.model.token_network import Path, TokenNetwork
+from pathfinding_service.model.token_network import Path, PathQuery, TokenNetwork
+from pathfinding_service.routing_pool import PathResult
 from pathfinding_service.service import PathfindingService
 from raiden_contracts.utils.type_aliases import Signature, TokenAmount
 from raiden_libs.api import ApiWithErrorHandler
-from raiden_libs.blockchain import get_pessimistic_udc_balance
 from raiden_libs.constants import UDC_SECURITY_MARGIN_FACTOR_PFS
 from raiden_libs.exceptions import ApiException
 from raiden_libs.marshmallow import ChecksumAddress, HexedBytes
@@ -110,6 +111,46 @@ class PathRequest:
     Schema: ClassVar[Type[marshmallow.Schema]]
 
 
+@add_schema
+@dataclass
+class BatchPathQuery:
+    """A single path request inside of a BatchPathRequest"""
+
+    from_: Address = field(
+        metadata=dict(marshmallow_field=ChecksumAddress(required=True, data_key="from"))
+    )
+    to: Address = field(metadata=dict(marshmallow_field=ChecksumAddress(required=True)))
+    value: PaymentAmount = field(metadata=dict(validate=marshmallow.validate.Range(min=1)))
+    max_paths: int = field(
+        default=DEFAULT_MAX_PATHS,
+        metadata=dict(validate=marshmallow.validate.Range(min=1, max=MAX_PATHS_PER_REQUEST)),
+    )
+    Schema: ClassVar[Type[marshmallow.Schema]]
+
+
+@add_schema
+@dataclass
+class BatchPathRequest:
+    """A HTTP request to BatchPathsResource"""
+
+    requests: List[BatchPathQuery] = field(
+        metadata=dict(validate=marshmallow.validate.Length(min=1, max=MAX_PATH_QUERIES_PER_BATCH))
+    )
+    iou: Optional[IOU] = None
+    diversity_penalty: Optional[float] = None
+    fee_penalty: Optional[float] = None
+    Schema: ClassVar[Type[marshmallow.Schema]]
+
+
+def error_to_dict(error: ApiException) -> dict:
+    """Same format as the error responses of `ApiWithErrorHandler`"""
+    return {
+        "errors": error.msg,
+        "error_code": error.error_code,
+        "error_details": error.error_details,
+    }
+
+
 class PathsResource(PathfinderResource):
     def __init__(self, debug_mode: bool, **kwargs: Any):
         super().__init__(**kwargs)
@@ -169,14 +210,28 @@ class PathsResource(PathfinderResource):
             if value is not None:
                 optional_args[arg] = value
 
-        paths = token_network.get_paths(
-            source=path_req.from_,
-            target=path_req.to,
-            value=path_req.value,
-            reachability_state=self.pathfinding_service.matrix_listener.user_manager,
-            max_paths=path_req.max_paths,
-            **optional_args,
-        )
+        # Search the paths in worker processes, if enabled
+        routing_pool = self.pathfinding_service.routing_pool
+        paths: Sequence[Union[Path, PathResult]]
+        if routing_pool is not None:
+            paths = routing_pool.get_paths(
+                token_network,
+                source=path_req.from_,
+                target=path_req.to,
+                value=path_req.value,
+                reachability_state=self.pathfinding_service.matrix_listener.user_manager,
+                max_paths=path_req.max_paths,
+                **optional_args,
+            )
+        else:
+            paths = token_network.get_paths(
+                source=path_req.from_,
+                target=path_req.to,
+                value=path_req.value,
+                reachability_state=self.pathfinding_service.matrix_listener.user_manager,
+                max_paths=path_req.max_paths,
+                **optional_args,
+            )
         # this is for assertion via the scenario player
         if len(paths) == 0:
             if self.debug_mode:
@@ -205,20 +260,125 @@ class PathsResource(PathfinderResource):
         )
 
 
+class BatchPathsResource(PathfinderResource):
+    def __init__(self, debug_mode: bool, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.debug_mode = debug_mode
+
+    def post(self, token_network_address: str) -> Tuple[dict, int]:
+        """Answers many path requests with a single payment
+
+        The payment must cover the service fee for each request in the batch.
+        The results are returned in the order of the requests. Failed requests
+        are reported as errors in place of the result and don't fail the batch.
+        """
+        token_network = self._validate_token_network_argument(token_network_address)
+        batch_req = self._parse_post(BatchPathRequest)
+        with opentracing.tracer.start_span("process_payment"):
+            process_payment(
+                iou=batch_req.iou,
+                pathfinding_service=self.pathfinding_service,
+                service_fee=TokenAmount(self.api.service_fee * len(batch_req.requests)),
+                one_to_n_address=self.api.one_to_n_address,
+            )
+
+        reachability_state = self.pathfinding_service.matrix_listener.user_manager
+        results: List[Optional[dict]] = [None] * len(batch_req.requests)
+        query_indexes: List[int] = []
+        queries: List[PathQuery] = []
+        for index, entry in enumerate(batch_req.requests):
+            # check for common error cases to provide clear error messages
+            error = token_network.check_path_request_errors(
+                source=entry.from_,
+                target=entry.to,
+                value=entry.value,
+                reachability_state=reachability_state,
+            )
+            if error:
+                results[index] = error_to_dict(
+                    exceptions.NoRouteFound(
+                        from_=to_checksum_address(entry.from_),
+                        to=to_checksum_address(entry.to),
+                        value=entry.value,
+                        msg=error,
+                    )
+                )
+            else:
+                query_indexes.append(index)
+                queries.append(
+                    PathQuery(
+                        source=entry.from_,
+                        target=entry.to,
+                        value=entry.value,
+                        max_paths=entry.max_paths,
+                    )
+                )
+
+        # only add optional args if not None, so we can use defaults
+        optional_args = {}
+        for arg in ["diversity_penalty", "fee_penalty"]:
+            value = getattr(batch_req, arg)
+            if value is not None:
+                optional_args[arg] = value
+
+        routing_pool = self.pathfinding_service.routing_pool
+        all_paths: Sequence[Sequence[Union[Path, PathResult]]]
+        if routing_pool is not None:
+            all_paths = routing_pool.get_paths_batch(
+                token_network, reachability_state, queries, **optional_args
+            )
+        else:
+            all_paths = token_network.get_paths_batch(
+                queries=queries, reachability_state=reachability_state, **optional_args
+            )
+
+        for index, query, paths in zip(query_indexes, queries, all_paths):
+            if len(paths) == 0:
+                results[index] = error_to_dict(
+                    exceptions.NoRouteFound(
+                        from_=to_checksum_address(query.source),
+                        to=to_checksum_address(query.target),
+                        value=query.value,
+                    )
+                )
+                continue
+
+            feedback_token = create_and_store_feedback_tokens(
+                pathfinding_service=self.pathfinding_service,
+                token_network_address=token_network.address,
+                routes=paths,
+            )
+            results[index] = {
+                "result": [p.to_dict() for p in paths],
+                "feedback_token": feedback_token.uuid.hex,
+            }
+
+        # this is for assertion via the scenario player
+        if self.debug_mode:
+            for entry, result in zip(batch_req.requests, results):
+                if result is not None and "errors" in result:
+                    last_failed_requests.append(
+                        dict(
+                            token_network_address=to_checksum_address(token_network_address),
+                            source=to_checksum_address(entry.from_),
+                            target=to_checksum_address(entry.to),
+                            routes=[],
+                        )
+                    )
+
+        return {"results": results}, 200
+
+
 def create_and_store_feedback_tokens(
     pathfinding_service: PathfindingService,
     token_network_address: TokenNetworkAddress,
-    routes: List[Path],
+    routes: Sequence[Union[Path, PathResult]],
 ) -> FeedbackToken:
     with opentracing.tracer.start_span("store_feedback_token"):
         feedback_token = FeedbackToken(token_network_address=token_network_address)
-
-        # TODO: use executemany here
-        for route in routes:
-            pathfinding_service.database.prepare_feedback(
-                token=feedback_token, route=route.nodes, estimated_fee=route.estimated_fee
-            )
-
+        pathfinding_service.store_feedback_token(
+            feedback_token, [(route.nodes, route.estimated_fee) for route in routes]
+        )
         return feedback_token
 
 
@@ -262,7 +422,7 @@ def process_payment(  # pylint: disable=too-many-branches
 
     # Compare with known IOU
     latest_block = pathfinding_service.blockchain_state.latest_committed_block
-    active_iou = pathfinding_service.database.get_iou(sender=iou.sender, claimed=False)
+    active_iou = pathfinding_service.iou_sessions.get_active(iou.sender)
 
     if active_iou:
         if active_iou.claimable_until != iou.claimable_until:
@@ -270,10 +430,7 @@ def process_payment(  # pylint: disable=too-many-branches
 
         expected_amount = active_iou.amount + service_fee
     else:
-        claimed_iou = pathfinding_service.database.get_iou(
-            sender=iou.sender, claimable_until=iou.claimable_until, claimed=True
-        )
-        if claimed_iou:
+        if pathfinding_service.iou_sessions.is_claimed(iou.sender, iou.claimable_until):
             raise exceptions.IOUAlreadyClaimed
 
         min_expiry = get_posix_utc_time_now() + MIN_IOU_EXPIRY
@@ -288,9 +445,7 @@ def process_payment(  # pylint: disable=too-many-branches
         )
 
     # Check client's deposit in UserDeposit contract
-    udc = pathfinding_service.user_deposit_contract
-    udc_balance = get_pessimistic_udc_balance(
-        udc=udc,
+    udc_balance = pathfinding_service.udc_balances.get_pessimistic_balance(
         address=iou.sender,
         from_block=BlockNumber(latest_block - pathfinding_service.required_confirmations),
         to_block=latest_block,
@@ -311,7 +466,7 @@ def process_payment(  # pylint: disable=too-many-branches
 
     # Save latest IOU
     iou.claimed = False
-    pathfinding_service.database.upsert_iou(iou)
+    pathfinding_service.iou_sessions.store(iou)
 
 
 @add_schema
@@ -349,9 +504,7 @@ class IOUResource(PathfinderResource):
             raise exceptions.RequestOutdated
 
         with opentracing.tracer.start_span("fetch_iou"):
-            last_iou = self.pathfinding_service.database.get_iou(
-                sender=iou_request.sender, claimed=False
-            )
+            last_iou = self.pathfinding_service.iou_sessions.get_active(iou_request.sender)
         if last_iou:
             last_iou = IOU.Schema(exclude=["claimed"]).dump(last_iou)
             return {"last_iou": last_iou}, 200
@@ -378,6 +531,8 @@ class FeedbackResource(PathfinderResource):
     ) -> Tuple[dict, int]:
         token_network = self._validate_token_network_argument(token_network_address)
         feedback_request = self._parse_post(FeedbackRequest)
+        # The token might still be buffered if the route has just been requested
+        self.pathfinding_service.flush_feedback()
         feedback_token = self.pathfinding_service.database.get_feedback_token(
             token_id=feedback_request.token,
             token_network_address=token_network.address,
@@ -574,6 +729,7 @@ class DebugPathResource(PathfinderResource):
         if target_address:
             decoded_target_address = to_canonical_address(target_address)
 
+        self.pathfinding_service.flush_feedback()
         feedback_routes = self.pathfinding_service.database.get_feedback_routes(
             TokenNetworkAddress(to_canonical_address(token_network_address)),
             to_canonical_address(source_address),
@@ -621,6 +777,7 @@ class DebugIOUResource(PathfinderResource):
 
 class DebugStatsResource(PathfinderResource):
     def get(self) -> Tuple[dict, int]:
+        self.pathfinding_service.flush_feedback()
         num_calculated_routes = self.pathfinding_service.database.get_num_routes_feedback()
         num_feedback_received = self.pathfinding_service.database.get_num_routes_feedback(
             only_with_feedback=True
@@ -699,6 +856,12 @@ class PFSApi:
                 dict(debug_mode=debug_mode),
                 "paths",
             ),
+            (
+                "/v1/<token_network_address>/paths/batch",
+                BatchPathsResource,
+                dict(debug_mode=debug_mode),
+                "paths_batch",
+            ),
             ("/v1/<token_network_address>/payment/iou", IOUResource, {}, "payments"),
             ("/v1/<token_network_address>/feedback", FeedbackResource, {}, "feedback"),
             (
@@ -1,13 +1,25 @@
+from gevent import monkey
+
+monkey.patch_all(subprocess=False, thread=False)
+
+# isort: split
+
 import sys
-from typing import Dict, Iterable, Tuple
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import click
+import gevent
 import structlog
-from raiden_common.utils.typing import BlockNumber, Timestamp
+from eth_utils import encode_hex
+from gevent.pool import Pool
+from raiden_common.utils.typing import Address, BlockNumber, Timestamp
 from web3 import Web3
-from web3.contract import Contract
-from web3.exceptions import TransactionNotFound
+from web3.contract import Contract, ContractFunction
+from web3.exceptions import ContractLogicError, TransactionNotFound
 from web3.gas_strategies.rpc import rpc_gas_price_strategy
+from web3.middleware import construct_sign_and_send_raw_middleware
+from web3.types import Nonce, TxParams, TxReceipt
 
 from pathfinding_service.database import PFSDatabase
 from pathfinding_service.model import IOU
@@ -15,11 +27,43 @@ from raiden_contracts.constants import CONTRACT_ONE_TO_N
 from raiden_contracts.contract_manager import gas_measurements
 from raiden_contracts.utils.type_aliases import ChainID, TokenAmount
 from raiden_libs.cli import blockchain_options, common_options
-from raiden_libs.utils import get_posix_utc_time_now, private_key_to_address
+from raiden_libs.utils import get_posix_utc_time_now, private_key_to_address, to_checksum_address
 
 log = structlog.get_logger(__name__)
 
 GAS_COST_SAFETY_MARGIN = 1.1
+# Number of concurrent eth_calls when checking IOUs and polling for receipts
+MAX_CONCURRENT_REQUESTS = 20
+# Receipts are polled with an exponential backoff between these intervals
+RECEIPT_POLL_MIN_INTERVAL = 0.5  # in seconds
+RECEIPT_POLL_MAX_INTERVAL = 15.0  # in seconds
+# Number of polls for a missing receipt after its nonce has been used, before
+# the claim is considered as failed. Gives lagging RPC nodes time to catch up.
+RECEIPT_MISSING_MAX_POLLS = 10
+
+
+@dataclass
+class PendingClaim:
+    iou: IOU
+    tx_hash: str
+    nonce: Nonce
+    missing_receipt_polls: int = 0
+
+
+class NonceManager:
+    """Assigns consecutive nonces to the transactions of `address`
+
+    Managing the nonces locally allows sending many transactions without
+    waiting for the previous ones to be mined.
+    """
+
+    def __init__(self, web3: Web3, address: Address):
+        self._next_nonce = web3.eth.get_transaction_count(to_checksum_address(address), "pending")
+
+    def next(self) -> Nonce:
+        nonce = Nonce(self._next_nonce)
+        self._next_nonce += 1
+        return nonce
 
 
 @blockchain_options(contracts=[CONTRACT_ONE_TO_N])
@@ -47,6 +91,7 @@ def main(
     expire_within: Timestamp,
 ) -> None:
     pfs_address = private_key_to_address(private_key)
+    web3.middleware_onion.add(construct_sign_and_send_raw_middleware(private_key))
     chain_id = ChainID(web3.eth.chain_id)
     database = PFSDatabase(
         filename=state_db, chain_id=chain_id, pfs_address=pfs_address, sync_start_block=start_block
@@ -63,7 +108,9 @@ def main(
         )
     )
     print(f"Found {len(ious)} claimable IOUs")
-    _, failures = claim_ious(ious, claim_cost_rdn, contracts[CONTRACT_ONE_TO_N], web3, database)
+    _, failures = claim_ious(
+        ious, claim_cost_rdn, contracts[CONTRACT_ONE_TO_N], web3, database, claimer=pfs_address
+    )
     if failures:
         sys.exit(1)
 
@@ -93,49 +140,182 @@ def get_claimable_ious(
     )
 
 
-def claim_ious(
+def claim_function(one_to_n_contract: Contract, iou: IOU) -> ContractFunction:
+    return one_to_n_contract.functions.claim(
+        sender=iou.sender,
+        receiver=iou.receiver,
+        amount=iou.amount,
+        claimable_until=iou.claimable_until,
+        signature=iou.signature,
+    )
+
+
+def claim_ious(  # pylint: disable=too-many-arguments
     ious: Iterable[IOU],
     claim_cost_rdn: TokenAmount,
     one_to_n_contract: Contract,
     web3: Web3,
     database: PFSDatabase,
+    claimer: Address,
 ) -> Tuple[int, int]:
-    unchecked_txs = []
+    """Claims the `ious` and waits until all claim transactions are mined
+
+    The claim transactions of an interrupted run are stored in the database
+    and waited for instead of claiming those IOUs again.
+
+    Returns the number of skipped and failed claims.
+    """
+    pending_claims = get_pending_claims(database)
+    if pending_claims:
+        print(f"Waiting for {len(pending_claims)} claims of a previous run")
+    pending_sessions = {(claim.iou.sender, claim.iou.claimable_until) for claim in pending_claims}
+    new_ious = [iou for iou in ious if (iou.sender, iou.claimable_until) not in pending_sessions]
+
+    claimable_ious = []
     skipped = 0
-    for iou in ious:
-        claim = one_to_n_contract.functions.claim(
-            sender=iou.sender,
-            receiver=iou.receiver,
-            amount=iou.amount,
-            claimable_until=iou.claimable_until,
-            signature=iou.signature,
-        )
-        transferrable = claim.call()
-        if transferrable < claim_cost_rdn:
+    transferrable_amounts = get_transferrable_amounts(new_ious, one_to_n_contract)
+    for iou, transferrable in zip(new_ious, transferrable_amounts):
+        if transferrable is None:
+            print("Can not claim", iou)
+            skipped += 1
+        elif transferrable < claim_cost_rdn:
             print("Not enough user deposit to claim profitably for", iou)
             skipped += 1
-            continue
-        tx_hash = claim.transact()
-        unchecked_txs.append((tx_hash, iou))
+        else:
+            claimable_ious.append(iou)
+
+    pending_claims += send_claims(claimable_ious, one_to_n_contract, web3, database, claimer)
+    failures = wait_for_claims(pending_claims, one_to_n_contract, web3, database, claimer)
+    return skipped, failures
+
+
+def get_pending_claims(database: PFSDatabase) -> List[PendingClaim]:
+    pending_claims = []
+    for sender, claimable_until, tx_hash, nonce in database.get_iou_claims():
+        iou = database.get_iou(sender=sender, claimable_until=claimable_until)
+        assert iou is not None, "Claimed IOU not in database"
+        pending_claims.append(PendingClaim(iou=iou, tx_hash=tx_hash, nonce=Nonce(nonce)))
+    return pending_claims
+
+
+def get_transferrable_amounts(
+    ious: List[IOU], one_to_n_contract: Contract
+) -> List[Optional[TokenAmount]]:
+    """Returns the amounts which would be transferred when claiming the `ious`
+
+    The eth_calls are done concurrently, since web3 doesn't support batched
+    JSON-RPC requests. `None` is returned for IOUs which can't be claimed,
+    e.g. because the session has been settled already.
+    """
+
+    def get_transferrable(iou: IOU) -> Optional[TokenAmount]:
+        try:
+            return TokenAmount(claim_function(one_to_n_contract, iou).call())
+        except ContractLogicError:
+            return None
+
+    return Pool(MAX_CONCURRENT_REQUESTS).map(get_transferrable, ious)
+
+
+def send_claims(
+    ious: List[IOU],
+    one_to_n_contract: Contract,
+    web3: Web3,
+    database: PFSDatabase,
+    claimer: Address,
+) -> List[PendingClaim]:
+    """Sends the claim transactions without waiting for them to be mined
+
+    All transactions use the same gas price, which is also the base for the
+    claim costs. Each transaction is stored before the next one is sent.
+    """
+    if not ious:
+        return []
+
+    nonces = NonceManager(web3, claimer)
+    gas_price = web3.eth.generate_gas_price()
+    pending_claims = []
+    for iou in ious:
+        nonce = nonces.next()
+        tx_params: TxParams = {"from": to_checksum_address(claimer), "nonce": nonce}
+        if gas_price is not None:
+            tx_params["gasPrice"] = gas_price
+        tx_hash = encode_hex(claim_function(one_to_n_contract, iou).transact(tx_params))
+        database.add_iou_claim(iou, tx_hash=tx_hash, nonce=nonce)
+        pending_claims.append(PendingClaim(iou=iou, tx_hash=tx_hash, nonce=nonce))
+    return pending_claims
+
+
+def wait_for_claims(
+    pending_claims: List[PendingClaim],
+    one_to_n_contract: Contract,
+    web3: Web3,
+    database: PFSDatabase,
+    claimer: Address,
+) -> int:
+    """Polls for the receipts of the claim transactions and stores the results
+
+    A claim without receipt whose nonce has been used is only considered as
+    failed if the receipt is still missing after `RECEIPT_MISSING_MAX_POLLS`
+    polls and the session has not been settled. This covers RPC nodes which
+    lag behind and replaced transactions. Until then, the claim stays in the
+    database, so that an interrupted run waits for it again.
+
+    Returns the number of failed claims.
+    """
+
+    def get_receipt(claim: PendingClaim) -> Optional[TxReceipt]:
+        try:
+            return web3.eth.get_transaction_receipt(claim.tx_hash)
+        except TransactionNotFound:
+            return None
+
+    def is_settled(iou: IOU) -> bool:
+        return bool(one_to_n_contract.functions.settled_sessions(iou.session_id).call())
 
     failures = 0
-    while unchecked_txs:
-        for tx_hash, iou in unchecked_txs.copy():
-            try:
-                receipt = web3.eth.get_transaction_receipt(tx_hash)
-            except TransactionNotFound:
+    poll_interval = RECEIPT_POLL_MIN_INTERVAL
+    while pending_claims:
+        # Fetched before the receipts, so that all transactions with a lower
+        # nonce are either mined or have been replaced
+        mined_tx_count = web3.eth.get_transaction_count(to_checksum_address(claimer))
+        receipts = Pool(MAX_CONCURRENT_REQUESTS).map(get_receipt, pending_claims)
+
+        remaining_claims = []
+        for claim, receipt in zip(pending_claims, receipts):
+            if receipt is None and claim.nonce >= mined_tx_count:
+                remaining_claims.append(claim)
+                continue
+
+            successful = receipt is not None and receipt["status"] == 1
+            if not successful and is_settled(claim.iou):
+                # Settled by a replacement transaction or a receipt which the
+                # RPC node doesn't know about yet
+                successful = True
+            elif receipt is None and claim.missing_receipt_polls < RECEIPT_MISSING_MAX_POLLS:
+                claim.missing_receipt_polls += 1
+                remaining_claims.append(claim)
                 continue
 
-            unchecked_txs.remove((tx_hash, iou))
-            if receipt["status"] == 1:
-                print(f"Successfully claimed {iou}.")
-                iou.claimed = True
-                database.upsert_iou(iou)
-            else:
-                print(f"Claiming {iou} failed!")
-                failures += 1
+            with database.transaction():
+                if successful:
+                    print(f"Successfully claimed {claim.iou}.")
+                    claim.iou.claimed = True
+                    database.upsert_iou(claim.iou)
+                else:
+                    print(f"Claiming {claim.iou} failed!")
+                    failures += 1
+                database.delete_iou_claim(claim.iou.sender, claim.iou.claimable_until)
 
-    return skipped, failures
+        if len(remaining_claims) < len(pending_claims):
+            poll_interval = RECEIPT_POLL_MIN_INTERVAL
+        else:
+            poll_interval = min(poll_interval * 2, RECEIPT_POLL_MAX_INTERVAL)
+        pending_claims = remaining_claims
+        if pending_claims:
+            gevent.sleep(poll_interval)
+
+    return failures
 
 
 if __name__ == "__main__":
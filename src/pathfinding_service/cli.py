@@ -4,13 +4,14 @@ monkey.patch_all(subprocess=False, thread=False)
 
 # isort: split
 
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import click
 import gevent
 import structlog
 from eth_utils import to_canonical_address
 from raiden_common.settings import DEFAULT_NUMBER_OF_BLOCK_CONFIRMATIONS
+from raiden_common.utils.cli import EnumChoiceType
 from raiden_common.utils.typing import BlockNumber, BlockTimeout
 from web3 import Web3
 from web3.contract import Contract
@@ -33,6 +34,7 @@ from raiden_libs.constants import (
     DEFAULT_API_PORT_PFS,
     DEFAULT_POLL_INTERVALL,
 )
+from raiden_libs.message_queue import OverflowPolicy
 from raiden_libs.utils import to_checksum_address
 
 log = structlog.get_logger(__name__)
@@ -82,6 +84,45 @@ log = structlog.get_logger(__name__)
     help="Bypass the experimental software disclaimer prompt",
     is_flag=True,
 )
+@click.option(
+    "--compact-graph",
+    is_flag=True,
+    help="Store the channel graphs in compact arrays instead of networkx graphs, "
+    "so that path searches don't have to copy the graph for each request.",
+)
+@click.option(
+    "--routing-workers",
+    default=0,
+    type=click.IntRange(min=0),
+    help="Number of worker processes used for path finding. "
+    "If 0, paths are searched in the main process.",
+)
+@click.option(
+    "--deserialization-workers",
+    default=0,
+    type=click.IntRange(min=0),
+    help="Number of worker processes used to deserialize incoming messages and recover "
+    "their signers. If 0, messages are deserialized in the main process.",
+)
+@click.option(
+    "--message-queue-size",
+    default=0,
+    type=click.IntRange(min=0),
+    help="Maximum number of received messages waiting to be handled. "
+    "If 0, messages are handled directly while syncing with the matrix server.",
+)
+@click.option(
+    "--message-overflow-policy",
+    default=OverflowPolicy.COALESCE.value,
+    show_default=True,
+    type=EnumChoiceType(OverflowPolicy),
+    help="How new messages are handled when the message queue is full.",
+)
+@click.option(
+    "--graph-snapshot",
+    type=click.Path(dir_okay=False, writable=True, resolve_path=True),
+    help="File used to store a snapshot of the channel graphs, which speeds up restarts.",
+)
 @click.option("--enable-debug", is_flag=True, hidden=True)
 # @click.option("--enable-tracing", is_flag=True, hidden=True)
 # @click.option("--tracing-sampler", default="const", hidden=True)
@@ -102,6 +143,12 @@ def main(  # pylint: disable=too-many-arguments,too-many-locals
     enable_debug: bool,
     matrix_server: List[str],
     accept_disclaimer: bool,
+    compact_graph: bool,
+    routing_workers: int,
+    deserialization_workers: int,
+    message_queue_size: int,
+    message_overflow_policy: OverflowPolicy,
+    graph_snapshot: Optional[str],
     # enable_tracing: bool,
     # tracing_sampler: str,
     # tracing_param: str,
@@ -158,6 +205,12 @@ def main(  # pylint: disable=too-many-arguments,too-many-locals
             poll_interval=DEFAULT_POLL_INTERVALL,
             db_filename=state_db,
             matrix_servers=matrix_server,
+            compact_graph=compact_graph,
+            routing_workers=routing_workers,
+            graph_snapshot_file=graph_snapshot,
+            deserialization_workers=deserialization_workers,
+            message_queue_size=message_queue_size,
+            message_overflow_policy=message_overflow_policy,
             # enable_tracing=enable_tracing,
         )
         service.start()
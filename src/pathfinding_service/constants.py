@@ -12,6 +12,25 @@ DIVERSITY_PEN_DEFAULT: int = 5
 FEE_PEN_DEFAULT: int = 100
 MAX_PATHS_PER_REQUEST: int = 25
 DEFAULT_MAX_PATHS: int = 5  # number of paths return when no `max_path` argument is given
+MAX_PATH_QUERIES_PER_BATCH: int = 500
+# Number of cached fee calculation results, see `pathfinding_service.model.fees`
+FEE_CACHE_SIZE: int = 50_000
+# Number of cached IOU signature recoveries, see `pathfinding_service.model.iou`
+IOU_SIGNATURE_CACHE_SIZE: int = 10_000
+# Number of cached routing results per token network
+ROUTE_CACHE_SIZE: int = 1_000
+# Cached routes are searched again after this time, even if they are still
+# valid, so that better routes after capacity and fee changes are found
+ROUTE_CACHE_MAX_AGE = timedelta(seconds=10)
+# Interval in which snapshots of the changed token networks are published to
+# the routing workers, see `pathfinding_service.routing_pool`
+ROUTING_SNAPSHOT_INTERVAL = timedelta(seconds=1)
+# Only the changes are published, until they add up to this fraction of the
+# full snapshot, their number exceeds the limit, or the full snapshot is older
+# than the max age. Then a new full snapshot is published.
+ROUTING_SNAPSHOT_MAX_DELTA_RATIO = 0.5
+ROUTING_SNAPSHOT_MAX_DELTAS = 100
+ROUTING_SNAPSHOT_MAX_AGE = timedelta(minutes=5)
 
 DEFAULT_REVEAL_TIMEOUT: BlockTimeout = BlockTimeout(50)
 
@@ -26,6 +45,23 @@ MIN_IOU_EXPIRY: int = 60 * 60 * 24 * 7  # one week
 MAX_AGE_OF_IOU_REQUESTS: timedelta = timedelta(hours=1)
 MAX_AGE_OF_FEEDBACK_REQUESTS: timedelta = timedelta(minutes=10)
 CACHE_TIMEOUT_SUGGEST_PARTNER = timedelta(minutes=1)
+# Number of nodes the distances are calculated from when estimating the
+# centrality of the nodes in a token network
+CENTRALITY_SAMPLES: int = 100
+CENTRALITY_UPDATE_INTERVAL = timedelta(minutes=1)
+# Channels changed by messages are written to the db in batches, see
+# `PathfindingService.flush_channels`
+CHANNEL_FLUSH_INTERVAL = timedelta(milliseconds=200)
+CHANNEL_FLUSH_MAX_CHANNELS: int = 1_000
+# Feedback tokens are written with the channels, unless more routes are waiting
+FEEDBACK_FLUSH_MAX_ROUTES: int = 10_000
+# Time between two snapshots of the channel graphs, see `pathfinding_service.graph_snapshot`
+GRAPH_SNAPSHOT_INTERVAL = timedelta(minutes=10)
+# Messages for channels which are not opened, yet, are kept until the channel
+# is opened or the TTL expires. This also covers a PFS catching up with the chain.
+WAITING_MESSAGE_TTL = timedelta(days=1)
+WAITING_MESSAGE_PRUNE_INTERVAL = timedelta(minutes=10)
+MAX_WAITING_MESSAGES_PER_CHANNEL: int = 20
 
 PFS_DISCLAIMER: str = textwrap.dedent(
     """\
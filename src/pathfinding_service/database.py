@@ -1,12 +1,12 @@
 import json
 import os
+import sqlite3
 from datetime import datetime
-from typing import Dict, Iterator, List, Optional, Tuple
+from typing import Any, Collection, Dict, Iterator, List, Optional, Tuple, Type
 from uuid import UUID
 
 import structlog
 from eth_utils import to_canonical_address
-from raiden_common.messages.path_finding_service import PFSCapacityUpdate
 from raiden_common.storage.serialization.serializer import JSONSerializer
 from raiden_common.utils.typing import (
     Address,
@@ -27,11 +27,18 @@ from raiden_libs.utils import to_checksum_address
 
 log = structlog.get_logger(__name__)
 
+# Latest capacities reported by a channel participant
+CapacityUpdateKey = Tuple[TokenNetworkAddress, ChannelID, Address]
+Capacities = Tuple[TokenAmount, TokenAmount]
+
 
 class PFSDatabase(BaseDatabase):
     """Store data that needs to persist between PFS restarts"""
 
     schema_filename = os.path.join(os.path.dirname(os.path.realpath(__file__)), "schema.sql")
+    schema_upgrade_filename = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), "schema_upgrade.sql"
+    )
 
     def __init__(
         self,
@@ -60,42 +67,43 @@ class PFSDatabase(BaseDatabase):
             **contract_addresses,
         )
 
-    def upsert_capacity_update(self, message: PFSCapacityUpdate) -> None:
-        capacity_update_dict = dict(
-            updating_participant=to_checksum_address(message.updating_participant),
-            token_network_address=to_checksum_address(
-                message.canonical_identifier.token_network_address
-            ),
-            channel_id=hex256(message.canonical_identifier.channel_identifier),
-            updating_capacity=hex256(message.updating_capacity),
-            other_capacity=hex256(message.other_capacity),
+        # `_setup` only creates the schema for new dbs, so that the existing
+        # dbs have to be upgraded separately
+        with open(self.schema_upgrade_filename, encoding="utf-8") as schema_file:
+            with self._cursor() as cursor:
+                cursor.executescript(schema_file.read())
+
+    def upsert_capacity_updates(
+        self, capacity_updates: Dict[CapacityUpdateKey, Capacities]
+    ) -> None:
+        self._upsert_many(
+            "capacity_update",
+            [
+                dict(
+                    updating_participant=to_checksum_address(updating_participant),
+                    token_network_address=to_checksum_address(token_network_address),
+                    channel_id=hex256(channel_id),
+                    updating_capacity=hex256(updating_capacity),
+                    other_capacity=hex256(other_capacity),
+                )
+                for (token_network_address, channel_id, updating_participant), (
+                    updating_capacity,
+                    other_capacity,
+                ) in capacity_updates.items()
+            ],
         )
-        self.upsert("capacity_update", capacity_update_dict)
 
-    def get_capacity_updates(
-        self,
-        updating_participant: Address,
-        token_network_address: TokenNetworkAddress,
-        channel_id: int,
-    ) -> Tuple[TokenAmount, TokenAmount]:
+    def get_capacity_updates(self) -> Dict[CapacityUpdateKey, Capacities]:
+        """Returns the latest capacities reported by each channel participant"""
         with self._cursor() as cursor:
-            capacity_list = cursor.execute(
-                """
-                SELECT updating_capacity, other_capacity
-                FROM capacity_update WHERE updating_participant=?
-                AND token_network_address=?
-                AND channel_id=?
-            """,
-                [
-                    to_checksum_address(updating_participant),
-                    to_checksum_address(token_network_address),
-                    hex256(channel_id),
-                ],
-            )
-            try:
-                return next(capacity_list)
-            except StopIteration:
-                return TokenAmount(0), TokenAmount(0)
+            return {
+                (
+                    TokenNetworkAddress(to_canonical_address(row["token_network_address"])),
+                    ChannelID(row["channel_id"]),
+                    Address(to_canonical_address(row["updating_participant"])),
+                ): (TokenAmount(row["updating_capacity"]), TokenAmount(row["other_capacity"]))
+                for row in cursor.execute("SELECT * FROM capacity_update")
+            }
 
     def get_latest_committed_block(self) -> BlockNumber:
         with self._cursor() as cursor:
@@ -109,11 +117,55 @@ class PFSDatabase(BaseDatabase):
             )
 
     def upsert_iou(self, iou: IOU) -> None:
+        self.upsert("iou", self._iou_to_dict(iou))
+
+    def upsert_unclaimed_ious(self, ious: Collection[IOU]) -> int:
+        """Stores multiple unclaimed IOUs in a single transaction
+
+        IOUs which have been marked as claimed in the meantime are not
+        changed, since claiming is done by a separate process. Returns the
+        number of stored IOUs.
+        """
+        rows = [self._iou_to_dict(iou) for iou in ious]
+        if not rows:
+            return 0
+
+        cols = ", ".join(rows[0].keys())
+        values = ", ".join(":" + col_name for col_name in rows[0])
+        with self.transaction(), self._cursor() as cursor:
+            cursor.executemany(
+                f"""
+                INSERT INTO iou({cols}) VALUES ({values})
+                ON CONFLICT(sender, claimable_until) DO UPDATE SET
+                    amount = excluded.amount,
+                    signature = excluded.signature
+                WHERE NOT iou.claimed
+                """,
+                rows,
+            )
+            return cursor.rowcount
+
+    @staticmethod
+    def _iou_to_dict(iou: IOU) -> Dict[str, Any]:
         iou_dict = IOU.Schema(exclude=["receiver", "chain_id"]).dump(iou)
         iou_dict["one_to_n_address"] = to_checksum_address(iou_dict["one_to_n_address"])
         for key in ("amount", "claimable_until"):
             iou_dict[key] = hex256(int(iou_dict[key]))
-        self.upsert("iou", iou_dict)
+        return iou_dict
+
+    def get_claimed_iou_sessions(
+        self, claimable_until_after: Timestamp
+    ) -> List[Tuple[Address, Timestamp]]:
+        """Returns sender and `claimable_until` of the claimed, unexpired IOUs"""
+        query = "SELECT sender, claimable_until FROM iou WHERE claimed AND claimable_until > ?"
+        with self._cursor() as cursor:
+            return [
+                (
+                    Address(to_canonical_address(row["sender"])),
+                    Timestamp(row["claimable_until"]),
+                )
+                for row in cursor.execute(query, [hex256(claimable_until_after)])
+            ]
 
     def get_ious(
         self,
@@ -167,6 +219,37 @@ class PFSDatabase(BaseDatabase):
             assert result.fetchone() is None
         return nof_claimed_ious["COUNT(*)"]
 
+    def add_iou_claim(self, iou: IOU, tx_hash: str, nonce: int) -> None:
+        self.upsert(
+            "iou_claim",
+            dict(
+                sender=to_checksum_address(iou.sender),
+                claimable_until=hex256(iou.claimable_until),
+                tx_hash=tx_hash,
+                nonce=nonce,
+            ),
+        )
+
+    def get_iou_claims(self) -> List[Tuple[Address, Timestamp, str, int]]:
+        """Returns the claim transactions which have been sent, but not confirmed"""
+        with self._cursor() as cursor:
+            return [
+                (
+                    Address(to_canonical_address(row["sender"])),
+                    Timestamp(row["claimable_until"]),
+                    row["tx_hash"],
+                    row["nonce"],
+                )
+                for row in cursor.execute("SELECT * FROM iou_claim ORDER BY nonce")
+            ]
+
+    def delete_iou_claim(self, sender: Address, claimable_until: Timestamp) -> None:
+        with self._cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM iou_claim WHERE sender = ? AND claimable_until = ?",
+                [to_checksum_address(sender), hex256(claimable_until)],
+            )
+
     def get_iou(
         self,
         sender: Address,
@@ -179,6 +262,25 @@ class PFSDatabase(BaseDatabase):
             return None
 
     def upsert_channel(self, channel: Channel) -> None:
+        self.upsert("channel", self._channel_to_dict(channel))
+
+    def upsert_channels(self, channels: Collection[Channel]) -> None:
+        """Stores multiple channels in a single transaction"""
+        self._upsert_many("channel", [self._channel_to_dict(channel) for channel in channels])
+
+    def _upsert_many(self, table_name: str, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+
+        cols = ", ".join(rows[0].keys())
+        values = ", ".join(":" + col_name for col_name in rows[0])
+        with self.transaction(), self._cursor() as cursor:
+            cursor.executemany(
+                f"INSERT OR REPLACE INTO {table_name}({cols}) VALUES ({values})", rows
+            )
+
+    @staticmethod
+    def _channel_to_dict(channel: Channel) -> Dict[str, Any]:
         channel_dict = Channel.Schema().dump(channel)
         for key in (
             "channel_id",
@@ -192,15 +294,30 @@ class PFSDatabase(BaseDatabase):
             channel_dict[key] = hex256(int(channel_dict[key]))
         channel_dict["fee_schedule1"] = json.dumps(channel_dict["fee_schedule1"])
         channel_dict["fee_schedule2"] = json.dumps(channel_dict["fee_schedule2"])
-        self.upsert("channel", channel_dict)
+        return channel_dict
 
     def get_channels(self) -> Iterator[Channel]:
+        for row in self.get_channel_rows():
+            yield self.channel_from_row(row)
+
+    def get_channel_rows(
+        self, token_network_address: Optional[TokenNetworkAddress] = None
+    ) -> Iterator[sqlite3.Row]:
+        """Returns the channel rows without deserializing them into `Channel` objects"""
+        query = "SELECT * FROM channel"
+        args: list = []
+        if token_network_address is not None:
+            query += " WHERE token_network_address = ?"
+            args.append(to_checksum_address(token_network_address))
         with self._cursor() as cursor:
-            for row in cursor.execute("SELECT * FROM channel"):
-                channel_dict = dict(zip(row.keys(), row))
-                channel_dict["fee_schedule1"] = json.loads(channel_dict["fee_schedule1"])
-                channel_dict["fee_schedule2"] = json.loads(channel_dict["fee_schedule2"])
-                yield Channel.Schema().load(channel_dict)
+            yield from cursor.execute(query, args)
+
+    @staticmethod
+    def channel_from_row(row: sqlite3.Row) -> Channel:
+        channel_dict = dict(zip(row.keys(), row))
+        channel_dict["fee_schedule1"] = json.loads(channel_dict["fee_schedule1"])
+        channel_dict["fee_schedule2"] = json.loads(channel_dict["fee_schedule2"])
+        return Channel.Schema().load(channel_dict)
 
     def delete_channel(
         self, token_network_address: TokenNetworkAddress, channel_id: ChannelID
@@ -222,10 +339,12 @@ class PFSDatabase(BaseDatabase):
 
             return cursor.rowcount == 1
 
-    def get_token_networks(self) -> Iterator[TokenNetwork]:
+    def get_token_networks(
+        self, token_network_class: Type[TokenNetwork] = TokenNetwork
+    ) -> Iterator[TokenNetwork]:
         with self._cursor() as cursor:
             for row in cursor.execute("SELECT address, settle_timeout FROM token_network"):
-                yield TokenNetwork(
+                yield token_network_class(
                     token_network_address=TokenNetworkAddress(to_canonical_address(row[0])),
                     settle_timeout=row[1],
                 )
@@ -233,17 +352,33 @@ class PFSDatabase(BaseDatabase):
     def prepare_feedback(
         self, token: FeedbackToken, route: List[Address], estimated_fee: FeeAmount
     ) -> None:
-        hexed_route = [to_checksum_address(e) for e in route]
-        token_dict = dict(
-            token_id=token.uuid.hex,
-            creation_time=token.creation_time,
-            token_network_address=to_checksum_address(token.token_network_address),
-            route=json.dumps(hexed_route),
-            estimated_fee=hex256(estimated_fee),
-            source_address=hexed_route[0],
-            target_address=hexed_route[-1],
-        )
-        self.insert("feedback", token_dict)
+        self.prepare_feedbacks([(token, route, estimated_fee)])
+
+    def prepare_feedbacks(
+        self, feedbacks: Collection[Tuple[FeedbackToken, List[Address], FeeAmount]]
+    ) -> None:
+        """Stores the routes of feedback tokens in a single transaction"""
+        rows = []
+        for token, route, estimated_fee in feedbacks:
+            hexed_route = [to_checksum_address(e) for e in route]
+            rows.append(
+                dict(
+                    token_id=token.uuid.hex,
+                    creation_time=token.creation_time,
+                    token_network_address=to_checksum_address(token.token_network_address),
+                    route=json.dumps(hexed_route),
+                    estimated_fee=hex256(estimated_fee),
+                    source_address=hexed_route[0],
+                    target_address=hexed_route[-1],
+                )
+            )
+        if not rows:
+            return
+
+        cols = ", ".join(rows[0].keys())
+        values = ", ".join(":" + col_name for col_name in rows[0])
+        with self.transaction(), self._cursor() as cursor:
+            cursor.executemany(f"INSERT INTO feedback({cols}) VALUES ({values})", rows)
 
     def update_feedback(self, token: FeedbackToken, route: List[Address], successful: bool) -> int:
         hexed_route = [to_checksum_address(e) for e in route]
@@ -346,36 +481,80 @@ class PFSDatabase(BaseDatabase):
         with self._cursor() as cursor:
             return cursor.execute(f"SELECT COUNT(*) FROM feedback {where_clause};").fetchone()[0]
 
-    def insert_waiting_message(self, message: DeferableMessage) -> None:
-        self.insert(
-            "waiting_message",
-            dict(
-                token_network_address=to_checksum_address(
-                    message.canonical_identifier.token_network_address
-                ),
-                channel_id=hex256(message.canonical_identifier.channel_identifier),
-                message=JSONSerializer.serialize(message),
-            ),
-        )
+    def insert_waiting_messages(
+        self, messages: List[Tuple[datetime, DeferableMessage]], max_per_channel: int
+    ) -> None:
+        """Stores messages together with the time they have been received
+
+        Only the newest `max_per_channel` messages are kept for each channel.
+        """
+        channels = {
+            (
+                to_checksum_address(message.canonical_identifier.token_network_address),
+                hex256(message.canonical_identifier.channel_identifier),
+            )
+            for _, message in messages
+        }
+        with self.transaction(), self._cursor() as cursor:
+            cursor.executemany(
+                """
+                INSERT INTO waiting_message(token_network_address, channel_id, message, added_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                [
+                    (
+                        to_checksum_address(message.canonical_identifier.token_network_address),
+                        hex256(message.canonical_identifier.channel_identifier),
+                        JSONSerializer.serialize(message),
+                        added_at,
+                    )
+                    for added_at, message in messages
+                ],
+            )
+            cursor.executemany(
+                """
+                DELETE FROM waiting_message WHERE rowid IN (
+                    SELECT rowid FROM waiting_message
+                    WHERE token_network_address = ? AND channel_id = ?
+                    ORDER BY added_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                [
+                    (token_network_address, channel_id, max_per_channel)
+                    for token_network_address, channel_id in channels
+                ],
+            )
 
     def pop_waiting_messages(
-        self, token_network_address: TokenNetworkAddress, channel_id: ChannelID
-    ) -> Iterator[DeferableMessage]:
-        """Return all waiting messages for the given channel and delete them from the db"""
-        # Return messages
+        self,
+        token_network_address: TokenNetworkAddress,
+        channel_id: ChannelID,
+        added_after: Optional[datetime] = None,
+    ) -> List[DeferableMessage]:
+        """Return all waiting messages for the given channel and delete them from the db
+
+        Messages which have been added before `added_after` are expired and
+        only deleted.
+        """
+        channel = [to_checksum_address(token_network_address), hex256(channel_id)]
         with self._cursor() as cursor:
-            for row in cursor.execute(
+            rows = cursor.execute(
                 """
                 SELECT message FROM waiting_message
-                WHERE token_network_address = ? AND channel_id = ?
+                WHERE token_network_address = ? AND channel_id = ? AND added_at > ?
+                ORDER BY added_at
                 """,
-                [to_checksum_address(token_network_address), hex256(channel_id)],
-            ):
-                yield JSONSerializer.deserialize(row["message"])
-
-        with self._cursor() as cursor:
-            # Delete returned messages
+                channel + [added_after or datetime.min],
+            ).fetchall()
             cursor.execute(
                 "DELETE FROM waiting_message WHERE token_network_address = ? AND channel_id = ?",
-                [to_checksum_address(token_network_address), hex256(channel_id)],
+                channel,
             )
+        return [JSONSerializer.deserialize(row["message"]) for row in rows]
+
+    def delete_expired_waiting_messages(self, added_before: datetime) -> int:
+        """Deletes the waiting messages for channels which have not been opened in time"""
+        with self._cursor() as cursor:
+            cursor.execute("DELETE FROM waiting_message WHERE added_at <= ?", [added_before])
+            return cursor.rowcount
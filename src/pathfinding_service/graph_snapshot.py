@@ -0,0 +1,140 @@
+"""Binary snapshots of the channel graphs for a fast PFS startup
+
+Deserializing all channels from the database (JSON decoding of the fee
+schedules and loading the `Channel` schema) takes minutes for large token
+networks. A snapshot stores the deserialized channels together with the
+database row they were created from. On startup, the database rows are
+compared with the rows in the snapshot and only the channels which have
+changed since the snapshot was written are deserialized again. This way the
+database stays the single source of truth, while an outdated or unrelated
+snapshot only makes the startup slower.
+
+Snapshots are pickled, so they must only be loaded from trusted locations.
+"""
+import os
+import pickle
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Sequence
+
+import structlog
+from raiden_common.utils.typing import Address, BlockNumber, ChannelID
+
+from pathfinding_service.database import PFSDatabase
+from pathfinding_service.model.channel import Channel
+from pathfinding_service.model.token_network import TokenNetwork
+from raiden_contracts.utils.type_aliases import ChainID
+
+log = structlog.get_logger(__name__)
+
+# Must be increased whenever the pickled classes or the database rows change
+GRAPH_SNAPSHOT_FORMAT_VERSION = 2
+
+ChannelRow = tuple
+
+
+@dataclass(frozen=True)
+class GraphSnapshotHeader:
+    format_version: int
+    chain_id: ChainID
+    token_network_registry_address: Address
+    latest_committed_block: BlockNumber
+    num_token_networks: int
+
+
+def write_graph_snapshot(
+    filename: str,
+    database: PFSDatabase,
+    token_networks: Sequence[TokenNetwork],
+    chain_id: ChainID,
+    token_network_registry_address: Address,
+    latest_committed_block: BlockNumber,
+    yield_func: Optional[Callable[[], None]] = None,
+) -> None:
+    """Writes the channels of `token_networks` together with their database rows
+
+    The channels changed by messages must be flushed to the database before,
+    so that the in memory channels are consistent with the database rows. Each
+    token network is pickled separately and `yield_func` is called in between,
+    so it must flush the channels again if they can be changed meanwhile.
+    """
+    tmp_filename = filename + ".tmp"
+    num_channels = 0
+    with open(tmp_filename, "wb") as f:
+        header = GraphSnapshotHeader(
+            format_version=GRAPH_SNAPSHOT_FORMAT_VERSION,
+            chain_id=chain_id,
+            token_network_registry_address=token_network_registry_address,
+            latest_committed_block=latest_committed_block,
+            num_token_networks=len(token_networks),
+        )
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        for token_network in token_networks:
+            if yield_func is not None:
+                yield_func()
+            channels = _get_snapshot_channels(database, token_network)
+            pickle.dump(channels, f, protocol=pickle.HIGHEST_PROTOCOL)
+            num_channels += len(channels)
+    # Replacing the file is atomic, so a crash never leaves a partial snapshot
+    os.replace(tmp_filename, filename)
+    log.info(
+        "Wrote graph snapshot",
+        filename=filename,
+        latest_committed_block=latest_committed_block,
+        num_channels=num_channels,
+    )
+
+
+def _get_snapshot_channels(
+    database: PFSDatabase, token_network: TokenNetwork
+) -> Dict[ChannelRow, Channel]:
+    channels_by_id: Dict[ChannelID, Channel] = {}
+    for channel_id, participants in token_network.channel_id_to_addresses.items():
+        channel_view = token_network.G[participants[0]][participants[1]]["view"]
+        channels_by_id[channel_id] = channel_view.channel
+
+    channels: Dict[ChannelRow, Channel] = {}
+    for row in database.get_channel_rows(token_network.address):
+        channel = channels_by_id.get(row["channel_id"])
+        if channel is not None:
+            channels[tuple(row)] = channel
+    return channels
+
+
+def read_graph_snapshot(
+    filename: str, chain_id: ChainID, token_network_registry_address: Address
+) -> Dict[ChannelRow, Channel]:
+    """Returns the channels of a snapshot, keyed by their database row
+
+    Returns an empty dict if there is no usable snapshot.
+    """
+    if not os.path.exists(filename):
+        return {}
+
+    try:
+        with open(filename, "rb") as f:
+            header = pickle.load(f)
+            if not isinstance(header, GraphSnapshotHeader) or (
+                header.format_version,
+                header.chain_id,
+                header.token_network_registry_address,
+            ) != (
+                GRAPH_SNAPSHOT_FORMAT_VERSION,
+                chain_id,
+                token_network_registry_address,
+            ):
+                log.warning("Ignoring incompatible graph snapshot", filename=filename)
+                return {}
+            channels: Dict[ChannelRow, Channel] = {}
+            for _ in range(header.num_token_networks):
+                channels.update(pickle.load(f))
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as exc:
+        log.warning("Could not read graph snapshot", filename=filename, exc=exc)
+        return {}
+
+    log.info(
+        "Read graph snapshot",
+        filename=filename,
+        latest_committed_block=header.latest_committed_block,
+        num_channels=len(channels),
+    )
+    return channels
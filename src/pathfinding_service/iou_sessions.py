@@ -0,0 +1,64 @@
+from collections import defaultdict
+from typing import Dict, Optional, Set
+
+from raiden_common.utils.typing import Address, Timestamp
+
+from pathfinding_service import exceptions
+from pathfinding_service.database import PFSDatabase
+from pathfinding_service.model import IOU
+from raiden_libs.utils import get_posix_utc_time_now
+
+
+class IOUSessions:
+    """In memory index of the IOU sessions, so that payments need no db reads
+
+    Each sender has at most one active (unclaimed) session. Claimed sessions
+    are only remembered until they expire, since expired IOUs are rejected
+    anyway. New IOUs are written to the db immediately, so that no payment
+    is lost if the PFS crashes. Only the reads are served from memory.
+
+    IOUs are claimed by the separate `claim_fees` script, so `refresh_claimed`
+    must be called regularly to stop accepting payments for claimed sessions.
+    """
+
+    def __init__(self, database: PFSDatabase):
+        self.database = database
+        self._active: Dict[Address, IOU] = {
+            iou.sender: iou for iou in database.get_ious(claimed=False)
+        }
+        self._claimed: Dict[Address, Set[Timestamp]] = {}
+        self.refresh_claimed()
+
+    def get_active(self, sender: Address) -> Optional[IOU]:
+        return self._active.get(sender)
+
+    def is_claimed(self, sender: Address, claimable_until: Timestamp) -> bool:
+        return claimable_until in self._claimed.get(sender, ())
+
+    def store(self, iou: IOU) -> None:
+        """Makes `iou` the active session of its sender
+
+        Raises `IOUAlreadyClaimed` if the session has been claimed since the
+        last `refresh_claimed`.
+        """
+        assert not iou.claimed
+        if self.database.upsert_unclaimed_ious([iou]) == 0:
+            active_iou = self._active.get(iou.sender)
+            if active_iou is not None and active_iou.claimable_until == iou.claimable_until:
+                del self._active[iou.sender]
+            self._claimed.setdefault(iou.sender, set()).add(iou.claimable_until)
+            raise exceptions.IOUAlreadyClaimed
+        self._active[iou.sender] = iou
+
+    def refresh_claimed(self) -> None:
+        claimed: Dict[Address, Set[Timestamp]] = defaultdict(set)
+        for sender, claimable_until in self.database.get_claimed_iou_sessions(
+            claimable_until_after=get_posix_utc_time_now()
+        ):
+            claimed[sender].add(claimable_until)
+
+        for sender, claimable_untils in claimed.items():
+            active_iou = self._active.get(sender)
+            if active_iou is not None and active_iou.claimable_until in claimable_untils:
+                del self._active[sender]
+        self._claimed = claimed
@@ -1,4 +1,4 @@
-from prometheus_client import Gauge
+from prometheus_client import Counter, Gauge
 
 from raiden_libs.metrics import (  # noqa: F401, pylint: disable=unused-import
     ERRORS_LOGGED,
@@ -34,3 +34,16 @@ IOU_CLAIMS_TOKEN = Gauge(
     labelnames=[IouStatus.label_name()],
     registry=REGISTRY,
 )
+
+
+class CacheResult(MetricsEnum):
+    HIT = "hit"
+    MISS = "miss"
+
+
+ROUTE_CACHE_REQUESTS = Counter(
+    "routing_cache_requests_total",
+    "The number of path requests answered with or without the route cache",
+    labelnames=[CacheResult.label_name()],
+    registry=REGISTRY,
+)
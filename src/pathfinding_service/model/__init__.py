@@ -1,6 +1,6 @@
 from .channel import ChannelView
 from .feedback import FeedbackToken
 from .iou import IOU
-from .token_network import TokenNetwork
+from .token_network import CompactTokenNetwork, TokenNetwork
 
-__all__ = ["ChannelView", "TokenNetwork", "IOU", "FeedbackToken"]
+__all__ = ["ChannelView", "TokenNetwork", "CompactTokenNetwork", "IOU", "FeedbackToken"]
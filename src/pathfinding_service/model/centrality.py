@@ -0,0 +1,75 @@
+import random
+from collections import defaultdict, deque
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from raiden_common.utils.typing import Address
+
+
+def _hop_distances(neighbors: Dict[Address, Set[Address]], source: Address) -> Dict[Address, int]:
+    distance = {source: 0}
+    queue = deque([source])
+    while queue:
+        current = queue.popleft()
+        for next_node in neighbors[current]:
+            if next_node not in distance:
+                distance[next_node] = distance[current] + 1
+                queue.append(next_node)
+    return distance
+
+
+def approximate_closeness_centrality(
+    channels: Iterable[Tuple[Address, Address]],
+    samples: int,
+    rng: Optional[random.Random] = None,
+    yield_func: Optional[Callable[[], None]] = None,
+) -> Dict[Address, float]:
+    """Estimates the closeness centrality of all channel participants
+
+    Instead of searching from every node, the hop distances are only
+    calculated from `samples` randomly chosen pivot nodes. The average
+    distance of a node to the pivots in its component is used as estimate for
+    the average distance to all nodes of the component (see Eppstein and Wang,
+    "Fast Approximation of Centrality"). Nodes without another pivot in their
+    component are searched from directly. If `samples` is at least the number
+    of nodes, the result equals networkx' `closeness_centrality` with
+    `wf_improved=True`.
+
+    `yield_func` is called after each search, which allows running this in
+    the background.
+    """
+    neighbors: Dict[Address, Set[Address]] = defaultdict(set)
+    for participant1, participant2 in channels:
+        neighbors[participant1].add(participant2)
+        neighbors[participant2].add(participant1)
+    nodes = list(neighbors)
+    num_nodes = len(nodes)
+    pivots = nodes if samples >= num_nodes else (rng or random).sample(nodes, samples)
+
+    distance_sum: Dict[Address, int] = defaultdict(int)
+    pivot_count: Dict[Address, int] = defaultdict(int)
+    component_size: Dict[Address, int] = {}
+    for pivot in pivots:
+        distances = _hop_distances(neighbors, pivot)
+        for node, distance in distances.items():
+            component_size[node] = len(distances)
+            if node != pivot:
+                distance_sum[node] += distance
+                pivot_count[node] += 1
+        if yield_func is not None:
+            yield_func()
+
+    centrality: Dict[Address, float] = {}
+    for node in nodes:
+        if pivot_count[node] == 0:
+            distances = _hop_distances(neighbors, node)
+            component_size[node] = len(distances)
+            distance_sum[node] = sum(distances.values())
+            pivot_count[node] = len(distances) - 1
+
+        if distance_sum[node] == 0 or num_nodes < 2:
+            centrality[node] = 0.0
+            continue
+        num_reachable = component_size[node] - 1
+        average_distance = distance_sum[node] / pivot_count[node]
+        centrality[node] = (1 / average_distance) * num_reachable / (num_nodes - 1)
+    return centrality
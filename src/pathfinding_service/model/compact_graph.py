@@ -0,0 +1,398 @@
+from array import array
+from collections import deque
+from heapq import heappop, heappush
+from itertools import count
+from typing import AbstractSet, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from raiden_common.utils.typing import Address
+
+from pathfinding_service.model.channel import ChannelView
+
+NO_EDGE = -1
+
+
+def _edge_key(source: int, target: int) -> int:
+    return (source << 32) | target
+
+
+class _Neighbors:  # pylint: disable=too-few-public-methods
+    """Read-only ``G[node]`` adapter
+
+    Allows networkx style ``G[node1][node2]["view"]`` lookups, which are used
+    by `Path` and the channel update handlers.
+    """
+
+    __slots__ = ("graph", "node")
+
+    def __init__(self, graph: "CompactGraph", node: Address):
+        self.graph = graph
+        self.node = node
+
+    def __getitem__(self, partner: Address) -> Dict[str, ChannelView]:
+        return {"view": self.graph.get_view(self.node, partner)}
+
+
+class _PathBuffer:
+    """Candidate paths for Yen's algorithm, ordered by length and insertion"""
+
+    def __init__(self) -> None:
+        self.paths: Set[Tuple[int, ...]] = set()
+        self.sorted_paths: List[Tuple[float, int, List[int]]] = []
+        self.counter = count()
+
+    def __len__(self) -> int:
+        return len(self.sorted_paths)
+
+    def push(self, cost: float, path: List[int]) -> None:
+        hashable_path = tuple(path)
+        if hashable_path not in self.paths:
+            heappush(self.sorted_paths, (cost, next(self.counter), path))
+            self.paths.add(hashable_path)
+
+    def pop(self) -> List[int]:
+        _, _, path = heappop(self.sorted_paths)
+        self.paths.remove(tuple(path))
+        return path
+
+
+class CompactGraph:
+    """Directed channel graph stored in flat arrays
+
+    Nodes are addressed by consecutive integer ids and edges by slots in the
+    edge columns. Every edge slot holds the source and target node id, the
+    slot of the edge in the opposite direction and the `ChannelView`. Slots of
+    removed edges are reused for new edges.
+
+    The adjacency is kept in CSR form (an offsets array per node into an
+    array of edge slots), which is rebuilt lazily after the topology changed.
+    Capacity and fee updates don't change the topology and are therefore
+    free. Capacities and fees are read from the `ChannelView`s, which are
+    shared with the rest of the PFS.
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-public-methods
+
+    def __init__(self) -> None:
+        self.index_of: Dict[Address, int] = {}
+        self.addresses: List[Address] = []
+
+        self.edge_source = array("l")
+        self.edge_target = array("l")
+        self.edge_reverse = array("l")
+        self.views: List[Optional[ChannelView]] = []
+        self._edge_of: Dict[int, int] = {}
+        self._free_slots: List[int] = []
+
+        self._csr_valid = False
+        self._out_offsets = array("l")
+        self._out_edges = array("l")
+        self._in_offsets = array("l")
+        self._in_edges = array("l")
+
+    @property
+    def nodes(self) -> List[Address]:
+        return self.addresses
+
+    def number_of_nodes(self) -> int:
+        return len(self.addresses)
+
+    def number_of_edges(self) -> int:
+        return len(self._edge_of)
+
+    @property
+    def number_of_slots(self) -> int:
+        return len(self.views)
+
+    def __getitem__(self, node: Address) -> _Neighbors:
+        if node not in self.index_of:
+            raise KeyError(node)
+        return _Neighbors(self, node)
+
+    def __contains__(self, node: Address) -> bool:
+        return node in self.index_of
+
+    def node_id(self, node: Address) -> int:
+        """Returns the id of `node`, adding it to the graph if necessary"""
+        node_id = self.index_of.get(node)
+        if node_id is None:
+            node_id = len(self.addresses)
+            self.index_of[node] = node_id
+            self.addresses.append(node)
+            self._csr_valid = False
+        return node_id
+
+    def edge_slot(self, source: Address, target: Address) -> int:
+        """Returns the slot of the edge from `source` to `target` or `NO_EDGE`"""
+        try:
+            return self._edge_of.get(
+                _edge_key(self.index_of[source], self.index_of[target]), NO_EDGE
+            )
+        except KeyError:
+            return NO_EDGE
+
+    def edge_slot_by_id(self, source: int, target: int) -> int:
+        return self._edge_of.get(_edge_key(source, target), NO_EDGE)
+
+    def get_view(self, source: Address, target: Address) -> ChannelView:
+        slot = self.edge_slot(source, target)
+        if slot == NO_EDGE:
+            raise KeyError((source, target))
+        view = self.views[slot]
+        assert view is not None
+        return view
+
+    def has_edge(self, source: Address, target: Address) -> bool:
+        return self.edge_slot(source, target) != NO_EDGE
+
+    def add_edge(self, source: Address, target: Address, view: ChannelView) -> None:
+        """Adds the edge or replaces the view of an existing edge"""
+        source_id = self.node_id(source)
+        target_id = self.node_id(target)
+        key = _edge_key(source_id, target_id)
+        slot = self._edge_of.get(key)
+        if slot is not None:
+            self.views[slot] = view
+            return
+
+        reverse = self._edge_of.get(_edge_key(target_id, source_id), NO_EDGE)
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self.edge_source[slot] = source_id
+            self.edge_target[slot] = target_id
+            self.edge_reverse[slot] = reverse
+            self.views[slot] = view
+        else:
+            slot = len(self.views)
+            self.edge_source.append(source_id)
+            self.edge_target.append(target_id)
+            self.edge_reverse.append(reverse)
+            self.views.append(view)
+        if reverse != NO_EDGE:
+            self.edge_reverse[reverse] = slot
+        self._edge_of[key] = slot
+        self._csr_valid = False
+
+    def remove_edge(self, source: Address, target: Address) -> None:
+        slot = self.edge_slot(source, target)
+        if slot == NO_EDGE:
+            raise KeyError((source, target))
+        del self._edge_of[_edge_key(self.edge_source[slot], self.edge_target[slot])]
+        reverse = self.edge_reverse[slot]
+        if reverse != NO_EDGE:
+            self.edge_reverse[reverse] = NO_EDGE
+        self.edge_source[slot] = NO_EDGE
+        self.edge_target[slot] = NO_EDGE
+        self.edge_reverse[slot] = NO_EDGE
+        self.views[slot] = None
+        self._free_slots.append(slot)
+        self._csr_valid = False
+
+    def _build_csr(self) -> None:
+        num_nodes = len(self.addresses)
+        out_offsets = array("l", [0]) * (num_nodes + 1)
+        in_offsets = array("l", [0]) * (num_nodes + 1)
+        live_slots = [slot for slot, view in enumerate(self.views) if view is not None]
+        for slot in live_slots:
+            out_offsets[self.edge_source[slot] + 1] += 1
+            in_offsets[self.edge_target[slot] + 1] += 1
+        for node_id in range(num_nodes):
+            out_offsets[node_id + 1] += out_offsets[node_id]
+            in_offsets[node_id + 1] += in_offsets[node_id]
+
+        out_edges = array("l", [0]) * len(live_slots)
+        in_edges = array("l", [0]) * len(live_slots)
+        out_fill = array("l", out_offsets[:-1])
+        in_fill = array("l", in_offsets[:-1])
+        for slot in live_slots:
+            source_id = self.edge_source[slot]
+            out_edges[out_fill[source_id]] = slot
+            out_fill[source_id] += 1
+            target_id = self.edge_target[slot]
+            in_edges[in_fill[target_id]] = slot
+            in_fill[target_id] += 1
+
+        self._out_offsets, self._out_edges = out_offsets, out_edges
+        self._in_offsets, self._in_edges = in_offsets, in_edges
+        self._csr_valid = True
+
+    def out_slots(self, node_id: int) -> Sequence[int]:
+        if not self._csr_valid:
+            self._build_csr()
+        return self._out_edges[self._out_offsets[node_id] : self._out_offsets[node_id + 1]]
+
+    def in_slots(self, node_id: int) -> Sequence[int]:
+        if not self._csr_valid:
+            self._build_csr()
+        return self._in_edges[self._in_offsets[node_id] : self._in_offsets[node_id + 1]]
+
+    def out_views(self, node: Address) -> List[ChannelView]:
+        node_id = self.index_of.get(node)
+        if node_id is None:
+            return []
+        return [self.views[slot] for slot in self.out_slots(node_id)]
+
+    def in_views(self, node: Address) -> List[ChannelView]:
+        node_id = self.index_of.get(node)
+        if node_id is None:
+            return []
+        return [self.views[slot] for slot in self.in_slots(node_id)]
+
+    def live_slots(self) -> Iterator[int]:
+        return (slot for slot, view in enumerate(self.views) if view is not None)
+
+    def has_path(self, source: Address, target: Address) -> bool:
+        """Breadth first search from `source` to `target`"""
+        source_id = self.index_of.get(source)
+        target_id = self.index_of.get(target)
+        if source_id is None or target_id is None:
+            return False
+        seen = {source_id}
+        queue = deque([source_id])
+        while queue:
+            node_id = queue.popleft()
+            if node_id == target_id:
+                return True
+            for slot in self.out_slots(node_id):
+                next_id = self.edge_target[slot]
+                if next_id not in seen:
+                    seen.add(next_id)
+                    queue.append(next_id)
+        return False
+
+    def closeness_centrality(self) -> Dict[Address, float]:
+        """Closeness centrality based on hop distances
+
+        Uses the same definition as networkx' `closeness_centrality` with
+        `wf_improved=True`, including the scaling for unconnected graphs.
+        Like networkx, the incoming distance is used for directed graphs.
+        """
+        num_nodes = len(self.addresses)
+        centrality: Dict[Address, float] = {}
+        for node_id, address in enumerate(self.addresses):
+            distance = {node_id: 0}
+            queue = deque([node_id])
+            while queue:
+                current = queue.popleft()
+                for slot in self.in_slots(current):
+                    next_id = self.edge_source[slot]
+                    if next_id not in distance:
+                        distance[next_id] = distance[current] + 1
+                        queue.append(next_id)
+
+            total_distance = sum(distance.values())
+            closeness = 0.0
+            if total_distance > 0 and num_nodes > 1:
+                num_reachable = len(distance) - 1
+                closeness = num_reachable / total_distance
+                closeness *= num_reachable / (num_nodes - 1)
+            centrality[address] = closeness
+        return centrality
+
+    def dijkstra(  # pylint: disable=too-many-arguments, too-many-locals
+        self,
+        source: int,
+        target: int,
+        weights: Sequence[float],
+        usable_edges: Sequence[int],
+        ignore_nodes: AbstractSet[int] = frozenset(),
+        ignore_edges: AbstractSet[int] = frozenset(),
+    ) -> Optional[Tuple[float, List[int]]]:
+        """Shortest path from `source` to `target`
+
+        `weights` is indexed by edge slot and only edges with a truthy entry in
+        `usable_edges` are used. Returns ``(length, node_ids)`` or ``None`` if
+        there is no path.
+        """
+        if not self._csr_valid:
+            self._build_csr()
+        out_offsets, out_edges, edge_target = self._out_offsets, self._out_edges, self.edge_target
+
+        distance: Dict[int, float] = {source: 0.0}
+        predecessor: Dict[int, int] = {}
+        done: Set[int] = set()
+        heap: List[Tuple[float, int]] = [(0.0, source)]
+        while heap:
+            node_distance, node_id = heappop(heap)
+            if node_id in done:
+                continue
+            if node_id == target:
+                path = [target]
+                while path[-1] != source:
+                    path.append(predecessor[path[-1]])
+                path.reverse()
+                return node_distance, path
+            done.add(node_id)
+
+            for i in range(out_offsets[node_id], out_offsets[node_id + 1]):
+                slot = out_edges[i]
+                next_id = edge_target[slot]
+                if (
+                    not usable_edges[slot]
+                    or next_id in done
+                    or next_id in ignore_nodes
+                    or slot in ignore_edges
+                ):
+                    continue
+                next_distance = node_distance + weights[slot]
+                if next_id not in distance or next_distance < distance[next_id]:
+                    distance[next_id] = next_distance
+                    predecessor[next_id] = node_id
+                    heappush(heap, (next_distance, next_id))
+        return None
+
+    def path_length(self, path: List[int], weights: Sequence[float]) -> float:
+        return sum(
+            weights[self.edge_slot_by_id(node1, node2)] for node1, node2 in zip(path, path[1:])
+        )
+
+    def shortest_simple_paths(
+        self, source: int, target: int, weights: Sequence[float], usable_edges: Sequence[int]
+    ) -> Iterable[List[int]]:
+        """Generates loopless paths ordered by length, using Yen's algorithm
+
+        Mirrors `networkx.shortest_simple_paths`, but works on node ids and
+        edge slot indexed weights and usable flags.
+        """
+        found_paths: List[List[int]] = []
+        candidates = _PathBuffer()
+        result = self.dijkstra(source, target, weights, usable_edges)
+        if result is not None:
+            candidates.push(*result)
+
+        while candidates:
+            path = candidates.pop()
+            yield path
+            found_paths.append(path)
+            self._push_spur_paths(
+                candidates=candidates,
+                found_paths=found_paths,
+                target=target,
+                weights=weights,
+                usable_edges=usable_edges,
+            )
+
+    def _push_spur_paths(  # pylint: disable=too-many-arguments, too-many-locals
+        self,
+        candidates: _PathBuffer,
+        found_paths: List[List[int]],
+        target: int,
+        weights: Sequence[float],
+        usable_edges: Sequence[int],
+    ) -> None:
+        """Adds the deviations from the last found path to the candidates"""
+        prev_path = found_paths[-1]
+        ignore_nodes: Set[int] = set()
+        ignore_edges: Set[int] = set()
+        for i in range(1, len(prev_path)):
+            root = prev_path[:i]
+            root_length = self.path_length(root, weights)
+            for path in found_paths:
+                if path[:i] == root:
+                    ignore_edges.add(self.edge_slot_by_id(path[i - 1], path[i]))
+            result = self.dijkstra(
+                root[-1], target, weights, usable_edges, ignore_nodes, ignore_edges
+            )
+            if result is not None:
+                length, spur = result
+                candidates.push(root_length + length, root[:-1] + spur)
+            ignore_nodes.add(root[-1])
@@ -0,0 +1,103 @@
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set
+
+from raiden_common.utils.typing import Address
+
+
+class ComponentIndex:
+    """Connected components of the channel graph of a token network
+
+    Channels can always be used in both directions (ignoring capacities), so
+    each node is labeled with the component it belongs to. Adding a channel
+    merges two components by relabeling the nodes of the smaller one. When a
+    channel is removed, searches from both participants check whether they
+    are still connected. Only if the component has been split, the nodes of
+    the smaller part get a new label.
+    """
+
+    def __init__(self) -> None:
+        self._component_of: Dict[Address, int] = {}
+        self._members: Dict[int, Set[Address]] = {}
+        self._next_label = 0
+
+    def _add_component(self, nodes: Set[Address]) -> None:
+        label = self._next_label
+        self._next_label += 1
+        self._members[label] = nodes
+        for node in nodes:
+            self._component_of[node] = label
+
+    def _discard_node(self, node: Address) -> None:
+        label = self._component_of.pop(node)
+        self._members[label].discard(node)
+        if not self._members[label]:
+            del self._members[label]
+
+    def add_channel(self, participant1: Address, participant2: Address) -> None:
+        for participant in (participant1, participant2):
+            if participant not in self._component_of:
+                self._add_component({participant})
+
+        label1 = self._component_of[participant1]
+        label2 = self._component_of[participant2]
+        if label1 == label2:
+            return
+        if len(self._members[label1]) > len(self._members[label2]):
+            label1, label2 = label2, label1
+        members = self._members.pop(label1)
+        for node in members:
+            self._component_of[node] = label2
+        self._members[label2] |= members
+
+    def remove_channel(
+        self,
+        participant1: Address,
+        participant2: Address,
+        channel_partners: Callable[[Address], Iterable[Address]],
+    ) -> None:
+        """Splits the component if the channel was the only connection between its participants
+
+        Must be called after the channel has been removed from the graph, for
+        which `channel_partners` returns the partners of a node.
+        """
+        split_off = _find_split_off_nodes(participant1, participant2, channel_partners)
+        if split_off is not None:
+            label = self._component_of[participant1]
+            self._members[label] -= split_off
+            self._add_component(split_off)
+
+        # Nodes without channels are not part of any component
+        for participant in (participant1, participant2):
+            if next(iter(channel_partners(participant)), None) is None:
+                self._discard_node(participant)
+
+    def connected(self, source: Address, target: Address) -> bool:
+        label = self._component_of.get(source)
+        return label is not None and label == self._component_of.get(target)
+
+
+def _find_split_off_nodes(
+    participant1: Address,
+    participant2: Address,
+    channel_partners: Callable[[Address], Iterable[Address]],
+) -> Optional[Set[Address]]:
+    """Returns the nodes reachable from one participant, if it can't reach the other one
+
+    Both sides are searched alternately, so that the search ends as soon as
+    the two searches meet or the smaller of the two parts has been visited
+    completely. Returns `None` if the participants are still connected.
+    """
+    visited: List[Set[Address]] = [{participant1}, {participant2}]
+    queues: List[Deque[Address]] = [deque([participant1]), deque([participant2])]
+    while True:
+        side = 0 if len(visited[0]) <= len(visited[1]) else 1
+        if not queues[side]:
+            return visited[side]
+
+        node = queues[side].popleft()
+        for partner in channel_partners(node):
+            if partner in visited[1 - side]:
+                return None
+            if partner not in visited[side]:
+                visited[side].add(partner)
+                queues[side].append(partner)
@@ -0,0 +1,115 @@
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from raiden_common.tests.utils.mediation_fees import get_amount_with_fees
+from raiden_common.transfer.mediated_transfer.mediation_fee import FeeScheduleState
+from raiden_common.utils.typing import (
+    Balance,
+    FeeAmount,
+    PaymentWithFeeAmount,
+    ProportionalFeeAmount,
+    TokenAmount,
+)
+
+from pathfinding_service.constants import FEE_CACHE_SIZE
+
+FeeScheduleKey = Tuple[bool, int, int, Optional[Tuple[Tuple[int, int], ...]]]
+
+
+def fee_schedule_key(
+    schedule: FeeScheduleState, cap_fees: Optional[bool] = None
+) -> FeeScheduleKey:
+    """Returns a hashable representation of everything the fee calculation uses
+
+    `cap_fees` overrides the schedule's setting, so that callers don't have to
+    copy the schedule to change it.
+    """
+    return (
+        schedule.cap_fees if cap_fees is None else cap_fees,
+        schedule.flat,
+        schedule.proportional,
+        tuple((x, y) for x, y in schedule.imbalance_penalty)
+        if schedule.imbalance_penalty
+        else None,
+    )
+
+
+def _has_no_fees(schedule: FeeScheduleState) -> bool:
+    # Even an imbalance penalty of zero limits the balances a payment can be
+    # mediated with, so only schedules without any penalty are fee free
+    return schedule.flat == 0 and schedule.proportional == 0 and not schedule.imbalance_penalty
+
+
+@lru_cache(maxsize=FEE_CACHE_SIZE)
+def _cached_amount_with_fees(  # pylint: disable=too-many-arguments
+    amount_without_fees: PaymentWithFeeAmount,
+    balance_in: Balance,
+    balance_out: Balance,
+    schedule_in: FeeScheduleKey,
+    schedule_out: FeeScheduleKey,
+    receivable_amount: TokenAmount,
+) -> Optional[PaymentWithFeeAmount]:
+    def to_schedule(key: FeeScheduleKey) -> FeeScheduleState:
+        cap_fees, flat, proportional, imbalance_penalty = key
+        return FeeScheduleState(
+            cap_fees=cap_fees,
+            flat=FeeAmount(flat),
+            proportional=ProportionalFeeAmount(proportional),
+            imbalance_penalty=[(TokenAmount(x), FeeAmount(y)) for x, y in imbalance_penalty]
+            if imbalance_penalty
+            else None,
+        )
+
+    return get_amount_with_fees(
+        amount_without_fees=amount_without_fees,
+        balance_in=balance_in,
+        balance_out=balance_out,
+        schedule_in=to_schedule(schedule_in),
+        schedule_out=to_schedule(schedule_out),
+        receivable_amount=receivable_amount,
+    )
+
+
+def calculate_amount_with_fees(  # pylint: disable=too-many-arguments
+    amount_without_fees: PaymentWithFeeAmount,
+    balance_in: Balance,
+    balance_out: Balance,
+    schedule_in: FeeScheduleState,
+    schedule_out: FeeScheduleState,
+    receivable_amount: TokenAmount,
+    cap_fees: Optional[bool] = None,
+) -> Optional[PaymentWithFeeAmount]:
+    """Same result as `get_amount_with_fees`, but cheaper for repeated inputs
+
+    Path requests evaluate the fees of all channels of a token network, mostly
+    with the same few fee schedules and payment amounts. Channels without any
+    fees are handled by an exact shortcut, all other results are cached by
+    their inputs. The fee calculation works on exact fractions of arbitrarily
+    large token amounts, so the cached scalar calculation is used instead of
+    a fixed width vectorized one.
+
+    `cap_fees` overrides the setting of both schedules.
+    """
+    cap_in = schedule_in.cap_fees if cap_fees is None else cap_fees
+    cap_out = schedule_out.cap_fees if cap_fees is None else cap_fees
+    if (
+        cap_in == cap_out
+        and amount_without_fees > 0
+        and min(balance_in, balance_out, receivable_amount) >= 0
+        and _has_no_fees(schedule_in)
+        and _has_no_fees(schedule_out)
+    ):
+        # Without fees, the amount can be mediated unchanged as long as both
+        # channels have enough capacity.
+        if amount_without_fees <= min(balance_out, receivable_amount):
+            return amount_without_fees
+        return None
+
+    return _cached_amount_with_fees(
+        amount_without_fees=amount_without_fees,
+        balance_in=balance_in,
+        balance_out=balance_out,
+        schedule_in=fee_schedule_key(schedule_in, cap_fees=cap_fees),
+        schedule_out=fee_schedule_key(schedule_out, cap_fees=cap_fees),
+        receivable_amount=receivable_amount,
+    )
@@ -1,19 +1,30 @@
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import ClassVar, Optional, Type
 
 import marshmallow
 from eth_abi import encode_single
 from eth_utils import encode_hex, is_same_address, keccak
 from marshmallow_dataclass import add_schema
-
 from raiden_common.exceptions import InvalidSignature
 from raiden_common.utils.signer import recover
 from raiden_common.utils.typing import Address, Timestamp
+
+from pathfinding_service.constants import IOU_SIGNATURE_CACHE_SIZE
 from raiden_contracts.constants import MessageTypeId
 from raiden_contracts.utils.type_aliases import ChainID, Signature, TokenAmount
 from raiden_libs.marshmallow import ChecksumAddress, HexedBytes
 
 
+@lru_cache(maxsize=IOU_SIGNATURE_CACHE_SIZE)
+def _recover_signer(data: bytes, signature: Signature) -> Optional[Address]:
+    """Clients send the same IOU repeatedly, e.g. when retrying requests"""
+    try:
+        return recover(data, signature)
+    except InvalidSignature:
+        return None
+
+
 @add_schema
 @dataclass
 class IOU:
@@ -40,9 +51,8 @@ class IOU:
         )
 
     def is_signature_valid(self) -> bool:
-        try:
-            recovered_address = recover(self.packed_data(), self.signature)
-        except InvalidSignature:
+        recovered_address = _recover_signer(self.packed_data(), self.signature)
+        if recovered_address is None:
             return False
         return is_same_address(recovered_address, self.sender)
 
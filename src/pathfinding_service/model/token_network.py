@@ -1,8 +1,25 @@
-from collections import defaultdict
-from copy import copy
+import time
+import weakref
+from array import array
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field, fields
 from datetime import datetime, timedelta
 from itertools import islice
-from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import networkx as nx
 import opentracing
@@ -12,7 +29,6 @@ from networkx.exception import NetworkXNoPath, NodeNotFound
 from raiden_common.messages.path_finding_service import PFSCapacityUpdate, PFSFeeUpdate
 from raiden_common.network.transport.matrix import UserPresence
 from raiden_common.network.transport.matrix.utils import AddressReachability
-from raiden_common.tests.utils.mediation_fees import get_amount_with_fees
 from raiden_common.utils.typing import (
     Address,
     Balance,
@@ -24,15 +40,55 @@ from raiden_common.utils.typing import (
     TokenNetworkAddress,
 )
 
-from pathfinding_service.constants import DIVERSITY_PEN_DEFAULT, FEE_PEN_DEFAULT
+from pathfinding_service import metrics
+from pathfinding_service.constants import (
+    CENTRALITY_SAMPLES,
+    DIVERSITY_PEN_DEFAULT,
+    FEE_PEN_DEFAULT,
+    ROUTE_CACHE_MAX_AGE,
+    ROUTE_CACHE_SIZE,
+)
 from pathfinding_service.exceptions import InconsistentInternalState, InvalidFeeUpdate
+from pathfinding_service.model.centrality import approximate_closeness_centrality
 from pathfinding_service.model.channel import Channel, ChannelView, FeeSchedule
+from pathfinding_service.model.compact_graph import CompactGraph
+from pathfinding_service.model.components import ComponentIndex
+from pathfinding_service.model.fees import calculate_amount_with_fees
 from pathfinding_service.typing import AddressReachabilityProtocol
 from raiden_contracts.utils.type_aliases import ChannelID, TokenAmount
 from raiden_libs.utils import to_checksum_address
 
 log = structlog.get_logger(__name__)
 
+T = TypeVar("T")
+
+# source, target, value, max_paths, diversity_penalty, fee_penalty
+RouteCacheKey = Tuple[Address, Address, PaymentAmount, int, float, float]
+# Topology version, monotonic time and nodes of the found paths
+RouteCacheEntry = Tuple[int, float, List[List[Address]]]
+
+# Request independent parts of the path search (like the pruned graph and the
+# weight terms for an amount), shared between the path requests of a batch
+SearchCache = Dict[Hashable, Any]
+
+
+class PathQuery(NamedTuple):
+    """A single path request of a batch, see `TokenNetwork.get_paths_batch`"""
+
+    source: Address
+    target: Address
+    value: PaymentAmount
+    max_paths: int
+
+
+def cached(search_cache: Optional[SearchCache], key: Hashable, compute: Callable[[], T]) -> T:
+    """Returns `compute()`, which is only called once per key for a given cache"""
+    if search_cache is None:
+        return compute()
+    if key not in search_cache:
+        search_cache[key] = compute()
+    return search_cache[key]
+
 
 def window(seq: Sequence, n: int = 2) -> Iterable[tuple]:
     """Returns a sliding window (of width n) over data from the iterable
@@ -107,7 +163,7 @@ class Path:
                     receivable_amount=view_in.capacity,
                 )
 
-                amount_with_fees = get_amount_with_fees(
+                amount_with_fees = calculate_amount_with_fees(
                     amount_without_fees=total,
                     balance_in=Balance(view_in.capacity_partner),
                     balance_out=Balance(view_out.capacity),
@@ -233,6 +289,14 @@ class Path:
             raise InconsistentInternalState()
 
 
+@dataclass
+class RoutingChanges:
+    """Changed channels and addresses, see `TokenNetwork.pop_routing_changes`"""
+
+    channels: Set[ChannelID] = field(default_factory=set)
+    addresses: Set[Address] = field(default_factory=set)
+
+
 class TokenNetwork:
     """Manages a token network for pathfinding."""
 
@@ -244,12 +308,83 @@ class TokenNetwork:
         self.settle_timeout = settle_timeout
         self.G = DiGraph()
 
+        # Channels between reachable participants, kept up to date for the
+        # reachability state passed to `track_reachability`
+        self.online_graph = DiGraph()
+        self._tracked_reachability_state: Optional[weakref.ref] = None
+
+        # Incremented on every change which can influence the routing results
+        self.version = 0
+        # Incremented when channels are added or removed and when a node which
+        # can be an intermediate hop comes online. Cached routes are only used
+        # if they were found for the current topology version and are not older
+        # than `ROUTE_CACHE_MAX_AGE`. Capacities, fees and the address metadata
+        # are checked again for each cache hit, since they change much more
+        # often. Other reachability changes only drop the cached routes from,
+        # to or through the node, see `_reachability_changed`.
+        self.topology_version = 0
+        # Only recorded after the first call of `pop_routing_changes`
+        self._routing_changes: Optional[RoutingChanges] = None
+        self._route_cache: "OrderedDict[RouteCacheKey, RouteCacheEntry]" = OrderedDict()
+        # Keys of the cached routes from, to or through each node
+        self._route_cache_keys: Dict[Address, Set[RouteCacheKey]] = defaultdict(set)
+
+        # Used by `check_path_request_errors` to reject impossible requests
+        # without searching the graph. The highest capacity of the outgoing
+        # (or incoming) channels of a node is calculated on first use and
+        # dropped when one of the channels changes.
+        self.components = ComponentIndex()
+        self._max_capacity_out: Dict[Address, TokenAmount] = {}
+        self._max_capacity_in: Dict[Address, TokenAmount] = {}
+        self._total_capacity_out: Dict[Address, TokenAmount] = {}
+
+        # Estimated closeness centrality for `suggest_partner`, calculated by
+        # `update_centrality`
+        self.centrality: Optional[Dict[Address, float]] = None
+
     def __repr__(self) -> str:
         return (
             f"<TokenNetwork address = {to_checksum_address(self.address)} "
             f"num_channels = {len(self.channel_id_to_addresses)}>"
         )
 
+    def _topology_changed(self) -> None:
+        self.version += 1
+        self.topology_version += 1
+
+    def pop_routing_changes(self) -> RoutingChanges:
+        """Returns the channels and addresses which changed since the last call
+
+        The changes are recorded from the first call on, so that token networks
+        which are never asked for their changes don't collect them.
+        """
+        changes = self._routing_changes or RoutingChanges()
+        self._routing_changes = RoutingChanges()
+        return changes
+
+    def _channel_changed(self, channel_id: ChannelID) -> None:
+        if self._routing_changes is not None:
+            self._routing_changes.channels.add(channel_id)
+
+    def _reachability_changed(self, address: Address, reachability: AddressReachability) -> None:
+        """Drops the cached routes which are affected by the reachability change
+
+        Routes which don't start, end or pass through `address` stay valid
+        when it goes offline. A node which comes online can only be part of
+        new routes between other nodes if it has at least two online partners.
+        """
+        self.version += 1
+        if self._routing_changes is not None:
+            self._routing_changes.addresses.add(address)
+        online_partners = sum(
+            1 for view in self.get_outgoing_views(address) if self._is_online(view.participant2)
+        )
+        if reachability == AddressReachability.REACHABLE and online_partners >= 2:
+            self.topology_version += 1
+        else:
+            for key in list(self._route_cache_keys.get(address, ())):
+                self._uncache_paths(key)
+
     def handle_channel_opened_event(
         self,
         channel_identifier: ChannelID,
@@ -285,6 +420,14 @@ class TokenNetwork:
                 channel_view.participant2,
             )
         self.G.add_edge(channel_view.participant1, channel_view.participant2, view=channel_view)
+        self.components.add_channel(channel_view.participant1, channel_view.participant2)
+        self._invalidate_capacities(channel_view.participant1, channel_view.participant2)
+        self._topology_changed()
+        self._channel_changed(channel_view.channel_id)
+        if self._is_online(channel_view.participant1) and self._is_online(
+            channel_view.participant2
+        ):
+            self._add_online_edge(channel_view.participant1, channel_view.participant2)
 
     def handle_channel_removed_event(self, channel_identifier: ChannelID) -> None:
         """Remove a channel from the token network."""
@@ -294,6 +437,83 @@ class TokenNetwork:
 
         self.G.remove_edge(participant1, participant2)
         self.G.remove_edge(participant2, participant1)
+        self._remove_online_edges(participant1, participant2)
+        self.components.remove_channel(participant1, participant2, self._channel_partners)
+        self._invalidate_capacities(participant1, participant2)
+        self._topology_changed()
+        self._channel_changed(channel_identifier)
+
+    def update_channel(self, channel: Channel) -> None:
+        """Adds `channel` or copies its state into the known channel with the same id
+
+        Used by the routing workers to apply the changes published by the PFS.
+        """
+        if channel.channel_id not in self.channel_id_to_addresses:
+            for cv in channel.views:
+                self.add_channel_view(cv)
+            return
+
+        known_channel = self.G[channel.participant1][channel.participant2]["view"].channel
+        for channel_field in fields(Channel):
+            setattr(known_channel, channel_field.name, getattr(channel, channel_field.name))
+        self._invalidate_capacities(channel.participant1, channel.participant2)
+        self.version += 1
+
+    def track_reachability(self, reachability_state: AddressReachabilityProtocol) -> None:
+        """Incrementally maintain the online part of the graph for `reachability_state`
+
+        All reachability changes of `reachability_state` must be passed to
+        `handle_reachability_change` afterwards. Path requests for this
+        reachability state then start from the maintained graph instead of
+        pruning the whole graph.
+        """
+        self._tracked_reachability_state = weakref.ref(reachability_state)
+        self.online_graph = prune_graph(graph=self.G, reachability_state=reachability_state)
+        self._topology_changed()
+
+    def is_tracking(self, reachability_state: AddressReachabilityProtocol) -> bool:
+        return (
+            self._tracked_reachability_state is not None
+            and self._tracked_reachability_state() is reachability_state
+        )
+
+    def _is_online(self, address: Address) -> bool:
+        """Returns whether `address` is reachable in the tracked reachability state"""
+        if self._tracked_reachability_state is None:
+            return False
+        reachability_state = self._tracked_reachability_state()
+        return (
+            reachability_state is not None
+            and reachability_state.get_address_reachability(address)
+            == AddressReachability.REACHABLE
+        )
+
+    def _add_online_edge(self, participant1: Address, participant2: Address) -> None:
+        self.online_graph.add_edge(
+            participant1, participant2, view=self.G[participant1][participant2]["view"]
+        )
+
+    def _remove_online_edges(self, participant1: Address, participant2: Address) -> None:
+        if self.online_graph.has_edge(participant1, participant2):
+            self.online_graph.remove_edge(participant1, participant2)
+        if self.online_graph.has_edge(participant2, participant1):
+            self.online_graph.remove_edge(participant2, participant1)
+
+    def handle_reachability_change(
+        self, address: Address, reachability: AddressReachability
+    ) -> None:
+        """Updates the online graph after the tracked reachability of `address` changed"""
+        if self._tracked_reachability_state is None or address not in self.G:
+            return
+
+        if reachability == AddressReachability.REACHABLE:
+            for partner in self.G.successors(address):
+                if self._is_online(partner):
+                    self._add_online_edge(address, partner)
+                    self._add_online_edge(partner, address)
+        elif address in self.online_graph:
+            self.online_graph.remove_node(address)
+        self._reachability_changed(address, reachability)
 
     def get_channel_views_for_partner(
         self, updating_participant: Address, other_participant: Address
@@ -304,6 +524,67 @@ class TokenNetwork:
 
         return channel_view_to_partner, channel_view_from_partner
 
+    def get_outgoing_views(self, node: Address) -> List[ChannelView]:
+        """Returns the channel views of all channels `node` can send through"""
+        return [view for _, _, view in self.G.out_edges(node, data="view")]
+
+    def get_incoming_views(self, node: Address) -> List[ChannelView]:
+        """Returns the channel views of all channels `node` can receive through"""
+        return [view for _, _, view in self.G.in_edges(node, data="view")]
+
+    def _channel_partners(self, node: Address) -> Iterable[Address]:
+        return (view.participant2 for view in self.get_outgoing_views(node))
+
+    def has_route(self, source: Address, target: Address) -> bool:
+        """Checks if `target` can be reached from `source`, ignoring capacities and reachability"""
+        return self.components.connected(source, target)
+
+    def _invalidate_capacities(self, participant1: Address, participant2: Address) -> None:
+        for participant in (participant1, participant2):
+            self._max_capacity_out.pop(participant, None)
+            self._max_capacity_in.pop(participant, None)
+            self._total_capacity_out.pop(participant, None)
+
+    def max_capacity_out(self, node: Address) -> Optional[TokenAmount]:
+        """Highest capacity of the channels `node` can send through, `None` without channels"""
+        if node in self._max_capacity_out:
+            return self._max_capacity_out[node]
+
+        max_capacity = max((view.capacity for view in self.get_outgoing_views(node)), default=None)
+        if max_capacity is not None:
+            self._max_capacity_out[node] = max_capacity
+        return max_capacity
+
+    def total_capacity_out(self, node: Address) -> TokenAmount:
+        """Sum of the capacities of the channels `node` can send through"""
+        if node not in self._total_capacity_out:
+            self._total_capacity_out[node] = TokenAmount(
+                sum(view.capacity for view in self.get_outgoing_views(node))
+            )
+        return self._total_capacity_out[node]
+
+    def max_capacity_in(self, node: Address) -> Optional[TokenAmount]:
+        """Highest capacity of the channels `node` can receive through, `None` without channels"""
+        if node in self._max_capacity_in:
+            return self._max_capacity_in[node]
+
+        max_capacity = max((view.capacity for view in self.get_incoming_views(node)), default=None)
+        if max_capacity is not None:
+            self._max_capacity_in[node] = max_capacity
+        return max_capacity
+
+    def update_centrality(self, yield_func: Optional[Callable[[], None]] = None) -> None:
+        """Estimates the closeness centrality of all nodes, see `approximate_closeness_centrality`
+
+        `yield_func` is called regularly during the calculation.
+        """
+        with opentracing.tracer.start_span("find_centrality"):
+            self.centrality = approximate_closeness_centrality(
+                channels=list(self.channel_id_to_addresses.values()),
+                samples=CENTRALITY_SAMPLES,
+                yield_func=yield_func,
+            )
+
     def handle_channel_balance_update_message(
         self,
         message: PFSCapacityUpdate,
@@ -324,6 +605,9 @@ class TokenNetwork:
             nonce=message.other_nonce,
             capacity=min(message.other_capacity, updating_capacity_partner),
         )
+        self._invalidate_capacities(message.updating_participant, message.other_participant)
+        self.version += 1
+        self._channel_changed(channel_view_to_partner.channel_id)
         log.debug(
             "Setting capacity",
             updating_participant=message.updating_capacity,
@@ -348,38 +632,43 @@ class TokenNetwork:
         )
         fee_schedule = FeeSchedule.from_raiden(message.fee_schedule, timestamp=message.timestamp)
         channel_view_to_partner.set_fee_schedule(fee_schedule)
+        self.version += 1
+        self._channel_changed(channel_id)
         return channel_view_from_partner.channel
 
     @staticmethod
-    def edge_weight(
-        visited: Dict[ChannelID, float],
+    def edge_weight_terms(
         view: ChannelView,
         view_from_partner: ChannelView,
         amount: PaymentAmount,
         fee_penalty: float,
-    ) -> float:
-        diversity_weight = visited.get(view.channel_id, 0)
+    ) -> Optional[Tuple[float, float]]:
+        """Returns the parts of the edge weight which don't depend on previous routes
+
+        The result is a tuple of `(fee_weight, no_refund_weight)` or ``None`` if
+        the fees can't be calculated for this edge.
+        """
+        # The channel can't be used for this amount, no matter what the fees are
+        if view.capacity < amount:
+            return None
+
         # Fees for initiator and target are included here. This promotes routes
         # that are nice to the initiator's and target's capacities, but it's
         # inconsistent with the estimated total fee.
 
-        # Enable fee apping for both fee schedules
-        schedule_in = copy(view.fee_schedule_receiver)
-        schedule_in.cap_fees = True
-        schedule_out = copy(view.fee_schedule_sender)
-        schedule_out.cap_fees = True
-
-        amount_with_fees = get_amount_with_fees(
+        amount_with_fees = calculate_amount_with_fees(
             amount_without_fees=PaymentWithFeeAmount(amount),
             balance_in=Balance(view.capacity),
             balance_out=Balance(view.capacity),
-            schedule_in=schedule_in,
-            schedule_out=schedule_out,
+            schedule_in=view.fee_schedule_receiver,
+            schedule_out=view.fee_schedule_sender,
             receivable_amount=view.capacity,
+            # Enable fee capping for both fee schedules
+            cap_fees=True,
         )
 
         if amount_with_fees is None:
-            return float("inf")
+            return None
 
         fee = FeeAmount(amount_with_fees - amount)
         fee_weight = fee / 1e18 * fee_penalty
@@ -387,36 +676,73 @@ class TokenNetwork:
         no_refund_weight = 0
         if view_from_partner.capacity < int(float(amount) * 1.1):
             no_refund_weight = 1
+        return fee_weight, no_refund_weight
+
+    @staticmethod
+    def combine_edge_weight(
+        diversity_weight: float, weight_terms: Optional[Tuple[float, float]]
+    ) -> float:
+        if weight_terms is None:
+            return float("inf")
+
+        fee_weight, no_refund_weight = weight_terms
         return 1 + diversity_weight + fee_weight + no_refund_weight
 
-    def _get_single_path(  # pylint: disable=too-many-arguments, too-many-locals
+    @staticmethod
+    def edge_weight(
+        visited: Dict[ChannelID, float],
+        view: ChannelView,
+        view_from_partner: ChannelView,
+        amount: PaymentAmount,
+        fee_penalty: float,
+    ) -> float:
+        return TokenNetwork.combine_edge_weight(
+            diversity_weight=visited.get(view.channel_id, 0),
+            weight_terms=TokenNetwork.edge_weight_terms(
+                view=view,
+                view_from_partner=view_from_partner,
+                amount=amount,
+                fee_penalty=fee_penalty,
+            ),
+        )
+
+    def _get_edge_weight_terms(
+        self, graph: DiGraph, value: PaymentAmount, fee_penalty: float
+    ) -> Dict[Tuple[Address, Address], Optional[Tuple[float, float]]]:
+        """Calculates the request specific weight terms for all edges of `graph`
+
+        This is the expensive part of the edge weights (it includes the fee
+        calculation), so it is only done once per path request. The diversity
+        penalty is added on top of it for the channels used by found paths.
+        """
+        with opentracing.tracer.start_span("calculate_weight_terms"):
+            return {
+                (node1, node2): self.edge_weight_terms(
+                    view=view,
+                    view_from_partner=graph[node2][node1]["view"],
+                    amount=value,
+                    fee_penalty=fee_penalty,
+                )
+                for node1, node2, view in graph.edges(data="view")
+            }
+
+    def _get_single_path(  # pylint: disable=too-many-arguments
         self,
         graph: DiGraph,
         source: Address,
         target: Address,
         value: PaymentAmount,
         reachability_state: AddressReachabilityProtocol,
-        visited: Dict[ChannelID, float],
+        weights: Dict[Tuple[Address, Address], float],
         disallowed_paths: List[List[Address]],
-        fee_penalty: float,
     ) -> Optional[Path]:
-        with opentracing.tracer.start_span("update_weights"):
-            # update edge weights
-            for node1, node2 in graph.edges():
-                edge = graph[node1][node2]
-                backwards_edge = graph[node2][node1]
-                edge["weight"] = self.edge_weight(
-                    visited=visited,
-                    view=edge["view"],
-                    view_from_partner=backwards_edge["view"],
-                    amount=value,
-                    fee_penalty=fee_penalty,
-                )
-
         with opentracing.tracer.start_span("find_paths"):
             # find next path
             all_paths: Iterable[List[Address]] = nx.shortest_simple_paths(
-                G=graph, source=source, target=target, weight="weight"
+                G=graph,
+                source=source,
+                target=target,
+                weight=lambda node1, node2, _: weights[node1, node2],
             )
         with opentracing.tracer.start_span("deduplicate_paths"):
             try:
@@ -454,18 +780,23 @@ class TokenNetwork:
             ):
                 return "Target not online"
 
-            if not any(self.G.edges(source)):
+            max_capacity_out = self.max_capacity_out(source)
+            if max_capacity_out is None:
                 return "No channel from source"
-            if not any(self.G.edges(target)):
+            max_capacity_in = self.max_capacity_in(target)
+            if max_capacity_in is None:
                 return "No channel to target"
 
-            source_capacities = [
-                view.capacity for _, _, view in self.G.out_edges(source, data="view")
-            ]
-            if max(source_capacities) < value:
+            if max_capacity_out < value:
+                source_views = self.get_outgoing_views(source)
+                source_capacities = [view.capacity for view in source_views]
                 debug_capacities = [
-                    (to_checksum_address(a), to_checksum_address(b), view.capacity)
-                    for a, b, view in self.G.out_edges(source, data="view")
+                    (
+                        to_checksum_address(view.participant1),
+                        to_checksum_address(view.participant2),
+                        view.capacity,
+                    )
+                    for view in source_views
                 ]
                 log.debug("Insufficient capacities", capacities=debug_capacities)
                 message = (
@@ -474,23 +805,19 @@ class TokenNetwork:
                     f" {value})"
                 )
                 return message
-            target_capacities = [
-                view.capacity for _, _, view in self.G.in_edges(target, data="view")
-            ]
-            if max(target_capacities) < value:
+            if max_capacity_in < value:
+                target_capacities = [view.capacity for view in self.get_incoming_views(target)]
                 return "Target does not have a channel with sufficient capacity (%s < %s)" % (
                     target_capacities,
                     value,
                 )
 
-            try:
-                next(nx.shortest_simple_paths(G=self.G, source=source, target=target))
-            except NetworkXNoPath:
+            if not self.has_route(source=source, target=target):
                 return "No route from source to target"
 
             return None
 
-    def get_paths(  # pylint: disable=too-many-arguments, too-many-locals
+    def get_paths(  # pylint: disable=too-many-arguments
         self,
         source: Address,
         target: Address,
@@ -499,16 +826,16 @@ class TokenNetwork:
         reachability_state: AddressReachabilityProtocol,
         diversity_penalty: float = DIVERSITY_PEN_DEFAULT,
         fee_penalty: float = FEE_PEN_DEFAULT,
+        search_cache: Optional[SearchCache] = None,
     ) -> List[Path]:
         """Find best routes according to given preferences
 
         value: Amount of transferred tokens. Used for capacity checks
         diversity_penalty: One previously used channel is as bad as X more hops
         fee_penalty: One RDN in fees is as bad as X more hops
+        search_cache: Shares work between requests with the same penalties,
+            while the token network doesn't change. See `get_paths_batch`.
         """
-        visited: Dict[ChannelID, float] = defaultdict(lambda: 0)
-        paths: List[Path] = []
-
         log.debug(
             "Finding paths for payment",
             source=source,
@@ -519,22 +846,186 @@ class TokenNetwork:
             fee_penalty=fee_penalty,
         )
 
-        # TODO: improve the pruning
-        # Currently we make a snapshot of the currently reachable nodes, so the searched graph
-        # becomes smaller
-        pruned_graph = prune_graph(graph=self.G, reachability_state=reachability_state)
+        # Only the tracked reachability state reports its changes, so routes
+        # for other reachability states can't be cached.
+        use_cache = self.is_tracking(reachability_state)
+        cache_key = (source, target, value, max_paths, diversity_penalty, fee_penalty)
+        cached_paths = (
+            self._get_cached_paths(cache_key, value, reachability_state) if use_cache else None
+        )
+        if cached_paths is not None:
+            metrics.get_metrics_for_label(
+                metrics.ROUTE_CACHE_REQUESTS, metrics.CacheResult.HIT
+            ).inc()
+            log.debug("Returning cached paths for payment", paths=cached_paths)
+            return cached_paths
+
+        paths = self._find_paths(
+            source=source,
+            target=target,
+            value=value,
+            max_paths=max_paths,
+            reachability_state=reachability_state,
+            diversity_penalty=diversity_penalty,
+            fee_penalty=fee_penalty,
+            search_cache=search_cache,
+        )
+        if use_cache:
+            metrics.get_metrics_for_label(
+                metrics.ROUTE_CACHE_REQUESTS, metrics.CacheResult.MISS
+            ).inc()
+            self._cache_paths(cache_key, paths)
+
+        log.info(
+            "Returning paths for payment",
+            source=source,
+            target=target,
+            value=value,
+            max_paths=max_paths,
+            diversity_penalty=diversity_penalty,
+            fee_penalty=fee_penalty,
+            paths=paths,
+        )
+        return paths
+
+    def get_paths_batch(
+        self,
+        queries: Sequence[PathQuery],
+        reachability_state: AddressReachabilityProtocol,
+        diversity_penalty: float = DIVERSITY_PEN_DEFAULT,
+        fee_penalty: float = FEE_PEN_DEFAULT,
+    ) -> List[List[Path]]:
+        """Find routes for many path requests, returned in the order of `queries`
+
+        The pruned graph and the weight terms for each amount are only
+        calculated once for the whole batch.
+        """
+        search_cache: SearchCache = {}
+        with opentracing.tracer.start_span("get_paths_batch"):
+            return [
+                self.get_paths(
+                    source=query.source,
+                    target=query.target,
+                    value=query.value,
+                    max_paths=query.max_paths,
+                    reachability_state=reachability_state,
+                    diversity_penalty=diversity_penalty,
+                    fee_penalty=fee_penalty,
+                    search_cache=search_cache,
+                )
+                for query in queries
+            ]
+
+    def _get_cached_paths(
+        self,
+        key: RouteCacheKey,
+        value: PaymentAmount,
+        reachability_state: AddressReachabilityProtocol,
+    ) -> Optional[List[Path]]:
+        """Returns the cached paths for `key`, if they are still up to date and valid
+
+        The paths are created again from the cached nodes, so that the fees,
+        capacities and address metadata are checked for the current state.
+        """
+        entry = self._route_cache.get(key)
+        if entry is None:
+            return None
+
+        topology_version, cached_at, nodes_of_paths = entry
+        if (
+            topology_version != self.topology_version
+            or time.monotonic() - cached_at > ROUTE_CACHE_MAX_AGE.total_seconds()
+        ):
+            self._uncache_paths(key)
+            return None
+
+        paths = [Path(self.G, nodes, value, reachability_state) for nodes in nodes_of_paths]
+        if not all(path.is_valid for path in paths):
+            self._uncache_paths(key)
+            return None
+
+        self._route_cache.move_to_end(key)
+        return paths
+
+    def _cache_paths(self, key: RouteCacheKey, paths: List[Path]) -> None:
+        if key in self._route_cache:
+            self._uncache_paths(key)
+        self._route_cache[key] = (
+            self.topology_version,
+            time.monotonic(),
+            [path.nodes for path in paths],
+        )
+        source, target = key[0], key[1]
+        for node in {source, target}.union(*(path.nodes for path in paths)):
+            self._route_cache_keys[node].add(key)
+        while len(self._route_cache) > ROUTE_CACHE_SIZE:
+            self._uncache_paths(next(iter(self._route_cache)))
+
+    def _uncache_paths(self, key: RouteCacheKey) -> None:
+        _, _, nodes_of_paths = self._route_cache.pop(key)
+        for node in {key[0], key[1]}.union(*nodes_of_paths):
+            keys = self._route_cache_keys[node]
+            keys.discard(key)
+            if not keys:
+                del self._route_cache_keys[node]
+
+    def _find_paths(  # pylint: disable=too-many-arguments, too-many-locals
+        self,
+        source: Address,
+        target: Address,
+        value: PaymentAmount,
+        max_paths: int,
+        reachability_state: AddressReachabilityProtocol,
+        diversity_penalty: float,
+        fee_penalty: float,
+        search_cache: Optional[SearchCache] = None,
+    ) -> List[Path]:
+        visited: Dict[ChannelID, float] = defaultdict(lambda: 0)
+        paths: List[Path] = []
+
+        # Only search the channels between reachable nodes. For the tracked
+        # reachability state this graph is kept up to date incrementally.
+        if self.is_tracking(reachability_state):
+            pruned_graph = self.online_graph
+        else:
+            pruned_graph = cached(
+                search_cache,
+                "pruned_graph",
+                lambda: prune_graph(graph=self.G, reachability_state=reachability_state),
+            )
+
+        # The fee dependent part of the weights is only calculated once. Between
+        # iterations, only the diversity penalty of the used channels changes.
+        weight_terms = cached(
+            search_cache,
+            ("weight_terms", value),
+            lambda: self._get_edge_weight_terms(
+                graph=pruned_graph, value=value, fee_penalty=fee_penalty
+            ),
+        )
+        weights = {
+            edge: self.combine_edge_weight(diversity_weight=0, weight_terms=terms)
+            for edge, terms in weight_terms.items()
+        }
+
+        # Channels without enough capacity or without a valid fee calculation
+        # can't be part of a valid path. Hiding them from the search keeps Yen's
+        # algorithm from enumerating lots of paths which would be rejected later.
+        search_graph = nx.subgraph_view(
+            pruned_graph,
+            filter_edge=lambda node1, node2: weight_terms[(node1, node2)] is not None,
+        )
 
         while len(paths) < max_paths:
             try:
                 path = self._get_single_path(
-                    graph=pruned_graph,
+                    graph=search_graph,
                     source=source,
                     target=target,
                     value=value,
                     reachability_state=reachability_state,
-                    visited=visited,
+                    weights=weights,
                     disallowed_paths=[p.nodes for p in paths],
-                    fee_penalty=fee_penalty,
                 )
             except (NetworkXNoPath, NodeNotFound):
                 log.info(
@@ -553,31 +1044,29 @@ class TokenNetwork:
                 break
             paths.append(path)
 
-            # update visited penalty dict
-            for edge in path.edge_attrs:
-                channel_id = edge["view"].channel_id
+            # update visited penalty dict and the weights of the affected edges
+            for node1, node2 in window(path.nodes):
+                channel_id = self.G[node1][node2]["view"].channel_id
                 visited[channel_id] += diversity_penalty
+                for edge in ((node1, node2), (node2, node1)):
+                    weights[edge] = self.combine_edge_weight(
+                        diversity_weight=visited[channel_id], weight_terms=weight_terms[edge]
+                    )
 
-        log.info(
-            "Returning paths for payment",
-            source=source,
-            target=target,
-            value=value,
-            max_paths=max_paths,
-            diversity_penalty=diversity_penalty,
-            fee_penalty=fee_penalty,
-            paths=paths,
-        )
         return paths
 
     def suggest_partner(
         self, reachability_state: AddressReachabilityProtocol, limit: int = 5
     ) -> List[Dict[str, Any]]:
-        """Suggest good partners for Raiden nodes joining the token network"""
+        """Suggest good partners for Raiden nodes joining the token network
 
-        with opentracing.tracer.start_span("find_centrality"):
-            # centrality
-            centrality_of_node = nx.algorithms.centrality.closeness_centrality(self.G)
+        The centrality is taken from the last `update_centrality` call, which
+        is done regularly in the background by the pathfinding service.
+        """
+        if self.centrality is None:
+            self.update_centrality()
+        assert self.centrality is not None
+        centrality_of_node = self.centrality
 
         # uptime, only include online nodes
         uptime_of_node = {}
@@ -588,22 +1077,194 @@ class TokenNetwork:
                 uptime_of_node[node] = (now - node_reach_state.time).total_seconds()
 
         # capacity
-        capacity_of_node = {}
-        for node in uptime_of_node:
-            channel_views = [
-                channel_data["view"] for _, _, channel_data in self.G.edges(node, data=True)
-            ]
-            capacity_of_node[node] = sum(cv.capacity for cv in channel_views)
+        capacity_of_node = {node: self.total_capacity_out(node) for node in uptime_of_node}
 
-        # sort by overall score
+        # sort by overall score, nodes which joined after the last centrality
+        # update are not scored yet
         suggestions = [
             dict(
                 address=to_checksum_address(node),
-                score=centrality_of_node[node] * uptime * capacity_of_node[node],
-                centrality=centrality_of_node[node],
+                score=centrality_of_node.get(node, 0.0) * uptime * capacity_of_node[node],
+                centrality=centrality_of_node.get(node, 0.0),
                 uptime=uptime,
                 capacity=capacity_of_node[node],
             )
             for node, uptime in uptime_of_node.items()
         ]
         return sorted(suggestions, key=lambda n: -n["score"])[:limit]
+
+
+class CompactTokenNetwork(TokenNetwork):
+    """TokenNetwork which keeps its channel graph in a `CompactGraph`
+
+    The topology is stored in flat arrays with integer node ids, which lets
+    the path search work on arrays instead of building a pruned copy of the
+    graph for every request. Each edge still references its `ChannelView`, so
+    the memory usage is not substantially lower than with networkx.
+    """
+
+    def __init__(self, token_network_address: TokenNetworkAddress, settle_timeout: Timestamp):
+        super().__init__(token_network_address, settle_timeout)
+        self.G = CompactGraph()
+        # Reachability flag for each node id of the tracked reachability state
+        self._online_nodes = bytearray()
+
+    def get_outgoing_views(self, node: Address) -> List[ChannelView]:
+        return self.G.out_views(node)
+
+    def get_incoming_views(self, node: Address) -> List[ChannelView]:
+        return self.G.in_views(node)
+
+    def track_reachability(self, reachability_state: AddressReachabilityProtocol) -> None:
+        self._tracked_reachability_state = weakref.ref(reachability_state)
+        self._online_nodes = bytearray()
+        self._topology_changed()
+
+    def handle_reachability_change(
+        self, address: Address, reachability: AddressReachability
+    ) -> None:
+        node_id = self.G.index_of.get(address)
+        if node_id is None:
+            return
+
+        if node_id < len(self._online_nodes):
+            self._online_nodes[node_id] = reachability == AddressReachability.REACHABLE
+        self._reachability_changed(address, reachability)
+
+    def _add_online_edge(self, participant1: Address, participant2: Address) -> None:
+        """Reachability is tracked per node, so there is nothing to do for edges"""
+
+    def _remove_online_edges(self, participant1: Address, participant2: Address) -> None:
+        """Reachability is tracked per node, so there is nothing to do for edges"""
+
+    def _get_online_nodes(self, reachability_state: AddressReachabilityProtocol) -> bytearray:
+        """Returns a flag for each node id, which is set if the node is reachable"""
+        if self.is_tracking(reachability_state):
+            # Only the nodes added since the last request have to be looked up
+            for address in self.G.addresses[len(self._online_nodes) :]:
+                self._online_nodes.append(self._is_online(address))
+            return self._online_nodes
+
+        with opentracing.tracer.start_span("prune_graph"):
+            return bytearray(
+                reachability_state.get_address_reachability(address)
+                == AddressReachability.REACHABLE
+                for address in self.G.addresses
+            )
+
+    def _get_slot_weight_terms(
+        self, online_nodes: bytearray, value: PaymentAmount, fee_penalty: float
+    ) -> Tuple[List[Optional[Tuple[float, float]]], bytearray]:
+        """Calculates the weight terms for all edges between online nodes, indexed by edge slot
+
+        Also returns a flag for each edge slot, which is set if the edge can be
+        used for the payment.
+        """
+        graph = self.G
+        weight_terms: List[Optional[Tuple[float, float]]] = [None] * graph.number_of_slots
+        usable_edges = bytearray(graph.number_of_slots)
+        with opentracing.tracer.start_span("calculate_weight_terms"):
+            for slot in graph.live_slots():
+                if online_nodes[graph.edge_source[slot]] and online_nodes[graph.edge_target[slot]]:
+                    weight_terms[slot] = self.edge_weight_terms(
+                        view=graph.views[slot],
+                        view_from_partner=graph.views[graph.edge_reverse[slot]],
+                        amount=value,
+                        fee_penalty=fee_penalty,
+                    )
+                    usable_edges[slot] = weight_terms[slot] is not None
+        return weight_terms, usable_edges
+
+    def _find_paths(  # pylint: disable=too-many-arguments, too-many-locals
+        self,
+        source: Address,
+        target: Address,
+        value: PaymentAmount,
+        max_paths: int,
+        reachability_state: AddressReachabilityProtocol,
+        diversity_penalty: float,
+        fee_penalty: float,
+        search_cache: Optional[SearchCache] = None,
+    ) -> List[Path]:
+        graph = self.G
+        visited: Dict[ChannelID, float] = defaultdict(lambda: 0)
+        paths: List[Path] = []
+
+        online_nodes = cached(
+            search_cache, "online_nodes", lambda: self._get_online_nodes(reachability_state)
+        )
+        source_id = graph.index_of.get(source)
+        target_id = graph.index_of.get(target)
+        if (
+            source_id is None
+            or target_id is None
+            or not online_nodes[source_id]
+            or not online_nodes[target_id]
+        ):
+            log.info(
+                "Found no path for payment in pruned graph",
+                source=source,
+                target=target,
+                value=value,
+                max_paths=max_paths,
+                diversity_penalty=diversity_penalty,
+                fee_penalty=fee_penalty,
+                reachabilities=reachability_state,
+            )
+            return []
+
+        # Edges without weight terms are not usable, see `TokenNetwork._find_paths`
+        weight_terms, usable_edges = cached(
+            search_cache,
+            ("weight_terms", value),
+            lambda: self._get_slot_weight_terms(
+                online_nodes=online_nodes, value=value, fee_penalty=fee_penalty
+            ),
+        )
+        weights = array(
+            "d",
+            (
+                self.combine_edge_weight(diversity_weight=0, weight_terms=terms)
+                for terms in weight_terms
+            ),
+        )
+
+        while len(paths) < max_paths:
+            with opentracing.tracer.start_span("find_paths"):
+                all_paths = graph.shortest_simple_paths(
+                    source=source_id, target=target_id, weights=weights, usable_edges=usable_edges
+                )
+            with opentracing.tracer.start_span("deduplicate_paths"):
+                disallowed_paths = [p.nodes for p in paths]
+                path = next(
+                    (
+                        p
+                        for p in (
+                            Path(
+                                self.G,
+                                [graph.addresses[node_id] for node_id in node_ids],
+                                value,
+                                reachability_state,
+                            )
+                            for node_ids in all_paths
+                        )
+                        if p.is_valid and p.nodes not in disallowed_paths
+                    ),
+                    None,
+                )
+
+            if path is None:
+                break
+            paths.append(path)
+
+            # update visited penalty dict and the weights of the affected edges
+            for node1, node2 in window(path.nodes):
+                slot = graph.edge_slot(node1, node2)
+                channel_id = graph.views[slot].channel_id
+                visited[channel_id] += diversity_penalty
+                for edge_slot in (slot, graph.edge_reverse[slot]):
+                    weights[edge_slot] = self.combine_edge_weight(
+                        diversity_weight=visited[channel_id], weight_terms=weight_terms[edge_slot]
+                    )
+
+        return paths
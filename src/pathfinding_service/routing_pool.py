@@ -0,0 +1,518 @@
+"""Path finding in worker processes
+
+The routing relevant state of a token network (channels with their capacities
+and fee schedules, reachability of the participants) is published as an
+immutable snapshot into shared memory. Afterwards, only the changed channels
+and addresses are published as deltas, until they become too large compared
+with the full snapshot. Path requests are answered by a pool of worker
+processes which load the latest snapshot, apply the deltas and keep the
+restored token network for the next request, so that expensive requests
+neither block the gevent loop nor are limited to a single core.
+"""
+import io
+import multiprocessing
+import pickle
+import time
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from functools import partial
+from multiprocessing.shared_memory import SharedMemory
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+import gevent
+import structlog
+from gevent.event import AsyncResult
+from gevent.lock import Semaphore
+from raiden_common.network.transport.matrix import UserPresence
+from raiden_common.network.transport.matrix.utils import AddressReachability
+from raiden_common.utils.typing import (
+    Address,
+    FeeAmount,
+    PeerCapabilities,
+    Timestamp,
+    TokenNetworkAddress,
+)
+
+from pathfinding_service.constants import (
+    ROUTING_SNAPSHOT_MAX_AGE,
+    ROUTING_SNAPSHOT_MAX_DELTA_RATIO,
+    ROUTING_SNAPSHOT_MAX_DELTAS,
+)
+from pathfinding_service.model.channel import Channel
+from pathfinding_service.model.token_network import Path, PathQuery, RoutingChanges, TokenNetwork
+from pathfinding_service.typing import AddressReachabilityProtocol
+from raiden_contracts.utils.type_aliases import ChannelID
+
+log = structlog.get_logger(__name__)
+T = TypeVar("T")
+
+# Number of channels which are pickled between two yields to the gevent loop
+# when publishing a full snapshot
+CHANNELS_PER_CHUNK = 1000
+
+# Name, size and version of a published snapshot or delta in shared memory
+SegmentInfo = Tuple[str, int, int]
+
+
+@dataclass
+class DisplayNames:
+    """Stands in for the `DisplayNameCache` of the matrix user manager"""
+
+    userid_to_displayname: Dict[str, str]
+
+
+class ReachabilitySnapshot:
+    """Copy of the reachability information used for routing in a token network"""
+
+    def __init__(
+        self, reachability_state: AddressReachabilityProtocol, addresses: Iterable[Address]
+    ):
+        # pylint: disable=protected-access
+        displaynames = reachability_state._displayname_cache.userid_to_displayname  # type: ignore
+        self._reachabilities: Dict[Address, AddressReachability] = {}
+        self._userids: Dict[Address, Set[str]] = {}
+        self._capabilities: Dict[Address, PeerCapabilities] = {}
+        self._presences: Dict[str, UserPresence] = {}
+        self._displayname_cache = DisplayNames(userid_to_displayname={})
+
+        for address in addresses:
+            user_ids = set(reachability_state.get_userids_for_address(address))
+            self._reachabilities[address] = reachability_state.get_address_reachability(address)
+            self._userids[address] = user_ids
+            self._capabilities[address] = reachability_state.get_address_capabilities(address)
+            for user_id in user_ids:
+                self._presences[user_id] = reachability_state.get_userid_presence(user_id)
+                if user_id in displaynames:
+                    self._displayname_cache.userid_to_displayname[user_id] = displaynames[user_id]
+
+    def get_address_reachability(self, address: Address) -> AddressReachability:
+        return self._reachabilities.get(address, AddressReachability.UNKNOWN)
+
+    def get_userid_presence(self, user_id: str) -> UserPresence:
+        return self._presences.get(user_id, UserPresence.UNKNOWN)
+
+    def get_userids_for_address(self, address: Address) -> Set[str]:
+        return self._userids.get(address, set())
+
+    def get_address_capabilities(self, address: Address) -> PeerCapabilities:
+        return self._capabilities[address]
+
+    @property
+    def addresses(self) -> Iterable[Address]:
+        return self._reachabilities.keys()
+
+    def update(self, other: "ReachabilitySnapshot") -> None:
+        """Takes over the information about the addresses in `other`"""
+        self._reachabilities.update(other._reachabilities)
+        self._userids.update(other._userids)
+        self._capabilities.update(other._capabilities)
+        self._presences.update(other._presences)
+        self._displayname_cache.userid_to_displayname.update(
+            other._displayname_cache.userid_to_displayname
+        )
+
+
+@dataclass(frozen=True)
+class RoutingSnapshot:
+    token_network_class: Type[TokenNetwork]
+    token_network_address: TokenNetworkAddress
+    settle_timeout: Timestamp
+    channels: List[Channel]
+    reachability_state: ReachabilitySnapshot
+
+    @classmethod
+    def from_token_network(
+        cls, token_network: TokenNetwork, reachability_state: AddressReachabilityProtocol
+    ) -> "RoutingSnapshot":
+        channels = [
+            token_network.G[participant1][participant2]["view"].channel
+            for participant1, participant2 in token_network.channel_id_to_addresses.values()
+        ]
+        addresses = {
+            address
+            for participants in token_network.channel_id_to_addresses.values()
+            for address in participants
+        }
+        return cls(
+            token_network_class=type(token_network),
+            token_network_address=token_network.address,
+            settle_timeout=token_network.settle_timeout,
+            channels=channels,
+            reachability_state=ReachabilitySnapshot(reachability_state, addresses),
+        )
+
+    def to_token_network(self) -> TokenNetwork:
+        token_network = self.token_network_class(self.token_network_address, self.settle_timeout)
+        for channel in self.channels:
+            for cv in channel.views:
+                token_network.add_channel_view(cv)
+        token_network.track_reachability(self.reachability_state)
+        return token_network
+
+
+@dataclass(frozen=True)
+class RoutingDelta:
+    """Changes of a token network since the previously published version"""
+
+    channels: List[Channel]
+    removed_channel_ids: List[ChannelID]
+    # Contains the changed addresses and the participants of the changed channels
+    reachability_state: ReachabilitySnapshot
+
+    @classmethod
+    def from_changes(
+        cls,
+        token_network: TokenNetwork,
+        reachability_state: AddressReachabilityProtocol,
+        changes: RoutingChanges,
+    ) -> "RoutingDelta":
+        channels = []
+        removed_channel_ids = []
+        addresses = set(changes.addresses)
+        for channel_id in changes.channels:
+            participants = token_network.channel_id_to_addresses.get(channel_id)
+            if participants is None:
+                removed_channel_ids.append(channel_id)
+                continue
+            participant1, participant2 = participants
+            channels.append(token_network.G[participant1][participant2]["view"].channel)
+            addresses.update(participants)
+        return cls(
+            channels=channels,
+            removed_channel_ids=removed_channel_ids,
+            reachability_state=ReachabilitySnapshot(reachability_state, addresses),
+        )
+
+    def apply(self, snapshot: RoutingSnapshot, token_network: TokenNetwork) -> None:
+        """Applies the changes to `token_network`, which was restored from `snapshot`"""
+        previous_reachabilities = {
+            address: snapshot.reachability_state.get_address_reachability(address)
+            for address in self.reachability_state.addresses
+        }
+        snapshot.reachability_state.update(self.reachability_state)
+
+        for channel_id in self.removed_channel_ids:
+            # Channels can be opened and removed between two deltas
+            if channel_id in token_network.channel_id_to_addresses:
+                token_network.handle_channel_removed_event(channel_id)
+        for channel in self.channels:
+            token_network.update_channel(channel)
+
+        for address, previous_reachability in previous_reachabilities.items():
+            reachability = snapshot.reachability_state.get_address_reachability(address)
+            if reachability != previous_reachability:
+                token_network.handle_reachability_change(address, reachability)
+
+
+@dataclass(frozen=True)
+class PathResult:
+    """Result of a path search in a worker process
+
+    Provides the parts of the `Path` interface which are used by the API.
+    """
+
+    nodes: List[Address]
+    estimated_fee: FeeAmount
+    path_dict: dict
+
+    @classmethod
+    def from_path(cls, path: Path) -> "PathResult":
+        return cls(nodes=path.nodes, estimated_fee=path.estimated_fee, path_dict=path.to_dict())
+
+    def to_dict(self) -> dict:
+        return self.path_dict
+
+
+@dataclass
+class SharedSegment:
+    shared_memory: SharedMemory
+    size: int
+    version: int
+
+    @property
+    def info(self) -> SegmentInfo:
+        return self.shared_memory.name, self.size, self.version
+
+
+@dataclass
+class PublishedSnapshot:
+    """A full snapshot, followed by the deltas which have been published after it"""
+
+    segments: List[SharedSegment]
+    published_at: float
+    pending_requests: int = 0
+    superseded: bool = False
+
+    @property
+    def version(self) -> int:
+        return self.segments[-1].version
+
+    def needs_rebase(self) -> bool:
+        """Whether a new full snapshot should be published instead of another delta"""
+        delta_size = sum(segment.size for segment in self.segments[1:])
+        return (
+            len(self.segments) > ROUTING_SNAPSHOT_MAX_DELTAS
+            or delta_size > self.segments[0].size * ROUTING_SNAPSHOT_MAX_DELTA_RATIO
+            or time.monotonic() - self.published_at > ROUTING_SNAPSHOT_MAX_AGE.total_seconds()
+        )
+
+
+def _write_segment(objects: Iterable[Any], version: int) -> SharedSegment:
+    """Pickles `objects` one after another into a new shared memory segment"""
+    stream = io.BytesIO()
+    pickler = pickle.Pickler(stream, protocol=pickle.HIGHEST_PROTOCOL)
+    for obj in objects:
+        pickler.dump(obj)
+    data = stream.getvalue()
+    shared_memory = SharedMemory(create=True, size=len(data))
+    shared_memory.buf[: len(data)] = data
+    return SharedSegment(shared_memory=shared_memory, size=len(data), version=version)
+
+
+def _read_segment(name: str, size: int) -> List[Any]:
+    """Returns the objects written by `_write_segment`"""
+    shared_memory = SharedMemory(name=name)
+    try:
+        unpickler = pickle.Unpickler(io.BytesIO(shared_memory.buf[:size]))
+    finally:
+        shared_memory.close()
+
+    objects = []
+    while True:
+        try:
+            objects.append(unpickler.load())
+        except EOFError:
+            return objects
+
+
+def _chunk_snapshot(snapshot: RoutingSnapshot) -> Iterator[Any]:
+    """Splits the channels of `snapshot` into chunks, yielding to the gevent loop in between
+
+    Changes to the channels while the chunks are pickled are recorded by the
+    token network and are part of the next delta.
+    """
+    yield replace(snapshot, channels=[])
+    for start in range(0, len(snapshot.channels), CHANNELS_PER_CHUNK):
+        gevent.idle()
+        yield snapshot.channels[start : start + CHANNELS_PER_CHUNK]
+
+
+# The latest loaded version of each token network, together with the snapshot
+# it was restored from. Only used inside of the worker processes.
+_loaded_snapshots: Dict[TokenNetworkAddress, Tuple[int, RoutingSnapshot, TokenNetwork]] = {}
+
+
+def _load_snapshot(
+    token_network_address: TokenNetworkAddress, segments: List[SegmentInfo]
+) -> Tuple[RoutingSnapshot, TokenNetwork]:
+    """Returns the token network for the last of `segments`
+
+    The full snapshot in the first segment is only loaded if the worker didn't
+    load one of the segments before. Otherwise only the missing deltas are
+    applied.
+    """
+    versions = [version for _name, _size, version in segments]
+    loaded = _loaded_snapshots.get(token_network_address)
+    if loaded is None or loaded[0] not in versions:
+        name, size, version = segments[0]
+        snapshot, *chunks = _read_segment(name, size)
+        for chunk in chunks:
+            snapshot.channels.extend(chunk)
+        loaded = (version, snapshot, snapshot.to_token_network())
+
+    loaded_version, snapshot, token_network = loaded
+    for name, size, version in segments[versions.index(loaded_version) + 1 :]:
+        (delta,) = _read_segment(name, size)
+        delta.apply(snapshot, token_network)
+        loaded_version = version
+
+    _loaded_snapshots[token_network_address] = (loaded_version, snapshot, token_network)
+    return snapshot, token_network
+
+
+def find_paths_in_snapshot(
+    token_network_address: TokenNetworkAddress,
+    segments: List[SegmentInfo],
+    path_request: Dict[str, Any],
+) -> List[PathResult]:
+    """Runs `TokenNetwork.get_paths` on a snapshot, called inside the worker processes"""
+    snapshot, token_network = _load_snapshot(token_network_address, segments)
+    paths = token_network.get_paths(reachability_state=snapshot.reachability_state, **path_request)
+    return [PathResult.from_path(path) for path in paths]
+
+
+def find_paths_batch_in_snapshot(
+    token_network_address: TokenNetworkAddress,
+    segments: List[SegmentInfo],
+    queries: Sequence[PathQuery],
+    penalties: Dict[str, float],
+) -> List[List[PathResult]]:
+    """Runs `TokenNetwork.get_paths_batch` on a snapshot, called inside the worker processes"""
+    snapshot, token_network = _load_snapshot(token_network_address, segments)
+    results = token_network.get_paths_batch(
+        queries=queries, reachability_state=snapshot.reachability_state, **penalties
+    )
+    return [[PathResult.from_path(path) for path in paths] for paths in results]
+
+
+def _set_async_result(result: AsyncResult, future: Future) -> None:
+    """Passes the outcome of `future` to `result`, called in the thread of the executor"""
+    if future.cancelled():
+        result.set_exception(CancelledError())
+    elif future.exception() is not None:
+        result.set_exception(future.exception())
+    else:
+        result.set(future.result())
+
+
+class RoutingPool:
+    """Answers path requests in a pool of worker processes
+
+    Snapshots and deltas are published by `publish_snapshots`, which the PFS
+    calls every `ROUTING_SNAPSHOT_INTERVAL` from a background greenlet.
+    Requests use the latest published version and only publish a snapshot
+    themselves for token networks which have not been published, yet.
+    """
+
+    def __init__(self, max_workers: int):
+        # Forking a process with a running gevent hub is not safe
+        self._executor = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self._snapshots: Dict[TokenNetworkAddress, PublishedSnapshot] = {}
+        # Publishing a full snapshot yields to other greenlets
+        self._publish_lock = Semaphore()
+
+    def publish_snapshots(
+        self,
+        token_networks: Iterable[TokenNetwork],
+        reachability_state: AddressReachabilityProtocol,
+    ) -> None:
+        """Publishes the changes of all token networks which have changed"""
+        for token_network in token_networks:
+            snapshot = self._snapshots.get(token_network.address)
+            if snapshot is None or snapshot.version != token_network.version:
+                with self._publish_lock:
+                    self._publish(token_network, reachability_state)
+                gevent.idle()  # Allow answering requests in between token networks
+
+    def _publish(
+        self, token_network: TokenNetwork, reachability_state: AddressReachabilityProtocol
+    ) -> PublishedSnapshot:
+        version = token_network.version
+        changes = token_network.pop_routing_changes()
+        snapshot = self._snapshots.get(token_network.address)
+        if snapshot is not None and not snapshot.needs_rebase():
+            delta = RoutingDelta.from_changes(token_network, reachability_state, changes)
+            segment = _write_segment([delta], version)
+            snapshot.segments.append(segment)
+            log.debug(
+                "Published routing delta",
+                token_network_address=token_network.address,
+                version=version,
+                size=segment.size,
+                channels=len(delta.channels),
+            )
+            return snapshot
+
+        segment = _write_segment(
+            _chunk_snapshot(RoutingSnapshot.from_token_network(token_network, reachability_state)),
+            version,
+        )
+        snapshot = PublishedSnapshot(segments=[segment], published_at=time.monotonic())
+        log.debug(
+            "Published routing snapshot",
+            token_network_address=token_network.address,
+            version=version,
+            size=segment.size,
+        )
+
+        previous = self._snapshots.get(token_network.address)
+        self._snapshots[token_network.address] = snapshot
+        if previous is not None:
+            previous.superseded = True
+            self._release_if_unused(previous)
+        return snapshot
+
+    @staticmethod
+    def _release_if_unused(snapshot: PublishedSnapshot) -> None:
+        if snapshot.superseded and snapshot.pending_requests == 0:
+            for segment in snapshot.segments:
+                segment.shared_memory.close()
+                segment.shared_memory.unlink()
+
+    def get_paths(
+        self,
+        token_network: TokenNetwork,
+        reachability_state: AddressReachabilityProtocol,
+        **path_request: Any,
+    ) -> List[PathResult]:
+        """Like `TokenNetwork.get_paths`, but computed in a worker process
+
+        Only blocks the calling greenlet while waiting for the result.
+        """
+        return self._run_in_worker(
+            token_network, reachability_state, find_paths_in_snapshot, path_request
+        )
+
+    def get_paths_batch(
+        self,
+        token_network: TokenNetwork,
+        reachability_state: AddressReachabilityProtocol,
+        queries: Sequence[PathQuery],
+        **penalties: float,
+    ) -> List[List[PathResult]]:
+        """Like `TokenNetwork.get_paths_batch`, but computed in a single worker process"""
+        return self._run_in_worker(
+            token_network, reachability_state, find_paths_batch_in_snapshot, queries, penalties
+        )
+
+    def _run_in_worker(
+        self,
+        token_network: TokenNetwork,
+        reachability_state: AddressReachabilityProtocol,
+        func: Callable[..., T],
+        *args: Any,
+    ) -> T:
+        """Calls `func` with the latest snapshot of `token_network` and `args` in a worker"""
+        snapshot = self._snapshots.get(token_network.address)
+        if snapshot is None:
+            with self._publish_lock:
+                snapshot = self._snapshots.get(token_network.address)
+                if snapshot is None:
+                    snapshot = self._publish(token_network, reachability_state)
+        snapshot.pending_requests += 1
+        try:
+            future = self._executor.submit(
+                func,
+                token_network.address,
+                [segment.info for segment in snapshot.segments],
+                *args,
+            )
+            # `AsyncResult` can be set from other threads, so waiting for the
+            # result doesn't need a thread of the hub's threadpool
+            result: AsyncResult = AsyncResult()
+            future.add_done_callback(partial(_set_async_result, result))
+            return result.get()
+        finally:
+            snapshot.pending_requests -= 1
+            self._release_if_unused(snapshot)
+
+    def stop(self) -> None:
+        self._executor.shutdown()
+        for snapshot in self._snapshots.values():
+            snapshot.superseded = True
+            self._release_if_unused(snapshot)
+        self._snapshots.clear()
@@ -0,0 +1,20 @@
+-- Tables and indexes which have been added after the initial schema. These
+-- statements run whenever the db is opened, so they must be idempotent.
+
+-- Finds the messages of a channel when its ChannelOpened event is confirmed
+CREATE INDEX IF NOT EXISTS waiting_message_channel
+    ON waiting_message(token_network_address, channel_id, added_at);
+
+-- Messages for channels which are never opened expire
+CREATE INDEX IF NOT EXISTS waiting_message_added_at
+    ON waiting_message(added_at);
+
+-- Claim transactions sent by claim_fees, so that an interrupted run can wait
+-- for them instead of claiming the IOUs again
+CREATE TABLE IF NOT EXISTS iou_claim (
+    sender                  CHAR(42) NOT NULL,
+    claimable_until         HEX_INT NOT NULL,
+    tx_hash                 CHAR(66) NOT NULL,
+    nonce                   INT NOT NULL,
+    PRIMARY KEY (sender, claimable_until)
+);
@@ -2,7 +2,8 @@ import collections
 import sys
 import time
 from dataclasses import asdict
-from typing import Dict, Iterator, List, Optional, Union
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Type, Union
 
 import gevent
 import sentry_sdk
@@ -12,23 +13,48 @@ from gevent import Timeout
 from raiden_common.constants import UINT256_MAX, DeviceIDs
 from raiden_common.messages.abstract import Message
 from raiden_common.messages.path_finding_service import PFSCapacityUpdate, PFSFeeUpdate
-from raiden_common.utils.typing import BlockNumber, BlockTimeout, TokenNetworkAddress
+from raiden_common.network.transport.matrix.utils import AddressReachability
+from raiden_common.utils.typing import (
+    Address,
+    BlockNumber,
+    BlockTimeout,
+    ChannelID,
+    FeeAmount,
+    Nonce,
+    TokenAmount,
+    TokenNetworkAddress,
+)
 from web3 import Web3
 from web3.contract import Contract
 
 from pathfinding_service import metrics
-from pathfinding_service.database import PFSDatabase
+from pathfinding_service.constants import (
+    CENTRALITY_UPDATE_INTERVAL,
+    CHANNEL_FLUSH_INTERVAL,
+    CHANNEL_FLUSH_MAX_CHANNELS,
+    FEEDBACK_FLUSH_MAX_ROUTES,
+    GRAPH_SNAPSHOT_INTERVAL,
+    MAX_WAITING_MESSAGES_PER_CHANNEL,
+    ROUTING_SNAPSHOT_INTERVAL,
+    WAITING_MESSAGE_PRUNE_INTERVAL,
+    WAITING_MESSAGE_TTL,
+)
+from pathfinding_service.database import CapacityUpdateKey, PFSDatabase
 from pathfinding_service.exceptions import (
     InvalidCapacityUpdate,
     InvalidFeeUpdate,
     InvalidGlobalMessage,
 )
-from pathfinding_service.model import IOU, TokenNetwork
+from pathfinding_service.graph_snapshot import read_graph_snapshot, write_graph_snapshot
+from pathfinding_service.iou_sessions import IOUSessions
+from pathfinding_service.model import IOU, CompactTokenNetwork, TokenNetwork
 from pathfinding_service.model.channel import Channel
+from pathfinding_service.model.feedback import FeedbackToken
+from pathfinding_service.routing_pool import RoutingPool
 from pathfinding_service.typing import DeferableMessage
 from raiden_contracts.constants import CONTRACT_TOKEN_NETWORK_REGISTRY, CONTRACT_USER_DEPOSIT
 from raiden_contracts.utils.type_aliases import ChainID, PrivateKey
-from raiden_libs.blockchain import get_blockchain_events_adaptive
+from raiden_libs.blockchain import UDCBalanceCache, get_blockchain_events_adaptive
 from raiden_libs.constants import MATRIX_START_TIMEOUT
 from raiden_libs.events import (
     Event,
@@ -36,14 +62,26 @@ from raiden_libs.events import (
     ReceiveChannelOpenedEvent,
     ReceiveChannelSettledEvent,
     ReceiveTokenNetworkCreatedEvent,
+    ReceiveUserDepositBalanceChangedEvent,
     UpdatedHeadBlockEvent,
 )
 from raiden_libs.matrix import MatrixListener
+from raiden_libs.message_queue import CoalesceKey, OverflowPolicy
 from raiden_libs.states import BlockchainState
 from raiden_libs.utils import private_key_to_address
 
 log = structlog.get_logger(__name__)
 
+# Blockchain events used by `PathfindingService.handle_event`, logs of other
+# contract events are not fetched
+HANDLED_BLOCKCHAIN_EVENTS = (
+    ReceiveTokenNetworkCreatedEvent,
+    ReceiveChannelOpenedEvent,
+    ReceiveChannelClosedEvent,
+    ReceiveChannelSettledEvent,
+    ReceiveUserDepositBalanceChangedEvent,
+)
+
 
 class DeferMessage(Exception):
     """Stop processing the message and handle it when the channel has been opened"""
@@ -55,6 +93,21 @@ class DeferMessage(Exception):
         self.deferred_message = deferred_message
 
 
+def update_coalesce_key(message: Message) -> Optional[CoalesceKey]:
+    """Queued updates are superseded by newer ones for the same channel participant"""
+    if isinstance(message, (PFSCapacityUpdate, PFSFeeUpdate)):
+        key = (
+            type(message),
+            message.canonical_identifier.token_network_address,
+            message.canonical_identifier.channel_identifier,
+            message.updating_participant,
+        )
+        if isinstance(message, PFSCapacityUpdate):
+            return CoalesceKey(key=key, order=message.updating_nonce)
+        return CoalesceKey(key=key, order=message.timestamp)
+    return None
+
+
 class PathfindingService(gevent.Greenlet):
     # pylint: disable=too-many-instance-attributes
     def __init__(  # pylint: disable=too-many-arguments
@@ -68,6 +121,12 @@ class PathfindingService(gevent.Greenlet):
         poll_interval: float,
         matrix_servers: Optional[List[str]] = None,
         enable_tracing: bool = False,
+        compact_graph: bool = False,
+        routing_workers: int = 0,
+        graph_snapshot_file: Optional[str] = None,
+        deserialization_workers: int = 0,
+        message_queue_size: int = 0,
+        message_overflow_policy: OverflowPolicy = OverflowPolicy.COALESCE,
     ):
         super().__init__()
 
@@ -81,6 +140,11 @@ class PathfindingService(gevent.Greenlet):
         self._poll_interval = poll_interval
         self._is_running = gevent.event.Event()
         self._enable_tracing = enable_tracing
+        self.token_network_class: Type[TokenNetwork] = (
+            CompactTokenNetwork if compact_graph else TokenNetwork
+        )
+        self.routing_pool = RoutingPool(routing_workers) if routing_workers else None
+        self.graph_snapshot_file = graph_snapshot_file
 
         log.info("PFS payment address", address=self.address)
 
@@ -95,23 +159,51 @@ class PathfindingService(gevent.Greenlet):
             enable_tracing=enable_tracing,
         )
 
+        self.iou_sessions = IOUSessions(self.database)
+
         self.blockchain_state = BlockchainState(
             latest_committed_block=self.database.get_latest_committed_block(),
             token_network_registry_address=to_canonical_address(self.registry_address),
             chain_id=self.chain_id,
+            user_deposit_contract_address=to_canonical_address(self.user_deposit_contract.address),
         )
+        self.udc_balances = UDCBalanceCache(self.user_deposit_contract)
 
         self.matrix_listener = MatrixListener(
             private_key=private_key,
             chain_id=self.chain_id,
             device_id=DeviceIDs.PFS,
             message_received_callback=self.handle_message,
+            message_batch_received_callback=self.handle_messages,
+            deserialization_workers=deserialization_workers,
+            message_queue_size=message_queue_size,
+            overflow_policy=message_overflow_policy,
+            coalesce_key=update_coalesce_key,
             servers=matrix_servers,
             enable_tracing=enable_tracing,
+            address_reachability_changed_callback=self.handle_reachability_change,
         )
 
         self.token_networks = self._load_token_networks()
         self.updated = gevent.event.Event()  # set whenever blocks are processed
+        self.centrality_updater: Optional[gevent.Greenlet] = None
+        # Channels changed by messages which have not been written to the db, yet
+        self._dirty_channels: Dict[Tuple[TokenNetworkAddress, ChannelID], Channel] = {}
+        # Mirror of the capacity updates in the db, avoids db reads for each message
+        self.capacity_updates = self.database.get_capacity_updates()
+        self._dirty_capacity_updates: Set[CapacityUpdateKey] = set()
+        # Latest `updating_nonce` of the accepted capacity updates, see `_is_superseded`
+        self._capacity_update_nonces: Dict[CapacityUpdateKey, Nonce] = {}
+        # Deferred messages which have not been written to the db, yet
+        self._waiting_messages: Dict[
+            Tuple[TokenNetworkAddress, ChannelID], List[Tuple[datetime, DeferableMessage]]
+        ] = {}
+        self._waiting_messages_pruned_at = 0.0
+        # Routes of feedback tokens which have not been written to the db, yet
+        self._pending_feedback: List[Tuple[FeedbackToken, List[Address], FeeAmount]] = []
+        self.channel_flusher: Optional[gevent.Greenlet] = None
+        self.snapshot_publisher: Optional[gevent.Greenlet] = None
+        self.graph_snapshot_writer: Optional[gevent.Greenlet] = None
         self.startup_finished = gevent.event.AsyncResult()
 
         self._init_metrics()
@@ -134,11 +226,30 @@ class PathfindingService(gevent.Greenlet):
         return self.database.get_ious(claimed=True)
 
     def _load_token_networks(self) -> Dict[TokenNetworkAddress, TokenNetwork]:
-        network_for_address = {n.address: n for n in self.database.get_token_networks()}
-        for channel in self.database.get_channels():
+        network_for_address = {
+            n.address: n
+            for n in self.database.get_token_networks(token_network_class=self.token_network_class)
+        }
+        known_channels = (
+            read_graph_snapshot(
+                self.graph_snapshot_file,
+                chain_id=self.chain_id,
+                token_network_registry_address=to_canonical_address(self.registry_address),
+            )
+            if self.graph_snapshot_file
+            else {}
+        )
+        for row in self.database.get_channel_rows():
+            # Only channels which changed after the snapshot have to be deserialized
+            channel = known_channels.get(tuple(row))
+            if channel is None:
+                channel = self.database.channel_from_row(row)
             for cv in channel.views:
                 network_for_address[cv.token_network_address].add_channel_view(cv)
 
+        for token_network in network_for_address.values():
+            token_network.track_reachability(self.matrix_listener.user_manager)
+
         return network_for_address
 
     def _run(self) -> None:  # pylint: disable=method-hidden
@@ -154,6 +265,12 @@ class PathfindingService(gevent.Greenlet):
         except Timeout:
             raise Exception("MatrixListener did not start in time.")
         self.startup_finished.set()
+        self.centrality_updater = gevent.spawn(self._update_centralities)
+        self.channel_flusher = gevent.spawn(self._flush_channels_regularly)
+        if self.routing_pool:
+            self.snapshot_publisher = gevent.spawn(self._publish_routing_snapshots)
+        if self.graph_snapshot_file:
+            self.graph_snapshot_writer = gevent.spawn(self._write_graph_snapshots_regularly)
 
         log.info(
             "Listening to token network registry",
@@ -165,6 +282,15 @@ class PathfindingService(gevent.Greenlet):
                 BlockNumber(self.web3.eth.block_number - self.required_confirmations)
             )
 
+            if (
+                time.monotonic() - self._waiting_messages_pruned_at
+                > WAITING_MESSAGE_PRUNE_INTERVAL.total_seconds()
+            ):
+                self.prune_waiting_messages()
+
+            # IOUs are claimed by a separate process
+            self.iou_sessions.refresh_claimed()
+
             # Let tests waiting for this event know that we're done with processing
             self.updated.set()
             self.updated.clear()
@@ -188,6 +314,7 @@ class PathfindingService(gevent.Greenlet):
             blockchain_state=self.blockchain_state,
             token_network_addresses=list(self.token_networks.keys()),
             latest_confirmed_block=latest_confirmed_block,
+            handled_event_types=HANDLED_BLOCKCHAIN_EVENTS,
         )
 
         if events is None:
@@ -207,10 +334,132 @@ class PathfindingService(gevent.Greenlet):
                 event_counts=collections.Counter(e.__class__.__name__ for e in events),
             )
 
+    def _update_centralities(self) -> None:
+        """Regularly updates the centralities used by `TokenNetwork.suggest_partner`"""
+        while not self._is_running.is_set():
+            for token_network in list(self.token_networks.values()):
+                token_network.update_centrality(yield_func=gevent.idle)
+            self._is_running.wait(CENTRALITY_UPDATE_INTERVAL.total_seconds())
+
+    def _flush_channels_regularly(self) -> None:
+        while not self._is_running.is_set():
+            self.flush_channels()
+            self._is_running.wait(CHANNEL_FLUSH_INTERVAL.total_seconds())
+
+    def _write_graph_snapshots_regularly(self) -> None:
+        while not self._is_running.wait(GRAPH_SNAPSHOT_INTERVAL.total_seconds()):
+            self.write_graph_snapshot(yield_func=gevent.idle)
+
+    def _publish_routing_snapshots(self) -> None:
+        """Regularly publishes the changed token networks to the routing workers"""
+        assert self.routing_pool
+        while not self._is_running.is_set():
+            self.routing_pool.publish_snapshots(
+                list(self.token_networks.values()), self.matrix_listener.user_manager
+            )
+            self._is_running.wait(ROUTING_SNAPSHOT_INTERVAL.total_seconds())
+
+    def flush_channels(self) -> None:
+        """Writes the channels and capacity updates changed by messages to the db
+
+        Capacity and fee updates (including the deferred ones) are only kept in
+        memory until the next flush, so the updates received during the last
+        `CHANNEL_FLUSH_INTERVAL` are lost if the PFS crashes. This is
+        acceptable, because the nodes send new updates whenever their channels
+        change. Buffered feedback tokens are written as well, see
+        `store_feedback_token`.
+        """
+        # The buffers are only cleared after a successful write, so that failed
+        # writes are retried on the next flush
+        if self._dirty_capacity_updates:
+            self.database.upsert_capacity_updates(
+                {key: self.capacity_updates[key] for key in self._dirty_capacity_updates}
+            )
+            self._dirty_capacity_updates.clear()
+
+        if self._dirty_channels:
+            self.database.upsert_channels(list(self._dirty_channels.values()))
+            self._dirty_channels.clear()
+
+        self.flush_feedback()
+
+        if self._waiting_messages:
+            waiting_messages = [
+                waiting_message
+                for channel_messages in self._waiting_messages.values()
+                for waiting_message in channel_messages
+            ]
+            self.database.insert_waiting_messages(
+                waiting_messages, max_per_channel=MAX_WAITING_MESSAGES_PER_CHANNEL
+            )
+            self._waiting_messages.clear()
+
+    def store_feedback_token(
+        self, token: FeedbackToken, routes: List[Tuple[List[Address], FeeAmount]]
+    ) -> None:
+        """Buffers the routes of a feedback token until the next flush
+
+        This keeps the db writes out of the path requests. Readers of the
+        feedback table must call `flush_feedback` first.
+        """
+        self._pending_feedback.extend((token, route, fee) for route, fee in routes)
+        if len(self._pending_feedback) >= FEEDBACK_FLUSH_MAX_ROUTES:
+            self.flush_feedback()
+
+    def flush_feedback(self) -> None:
+        if self._pending_feedback:
+            self.database.prepare_feedbacks(self._pending_feedback)
+            self._pending_feedback = []
+
+    def prune_waiting_messages(self) -> None:
+        """Deletes deferred messages for channels which have not been opened in time"""
+        deleted = self.database.delete_expired_waiting_messages(
+            added_before=datetime.utcnow() - WAITING_MESSAGE_TTL
+        )
+        if deleted:
+            log.info("Deleted expired deferred messages", num_messages=deleted)
+        self._waiting_messages_pruned_at = time.monotonic()
+
     def stop(self) -> None:
         self.matrix_listener.kill()
         self._is_running.set()
         self.matrix_listener.join()
+        if self.centrality_updater:
+            self.centrality_updater.kill()
+        if self.channel_flusher:
+            self.channel_flusher.kill()
+        if self.snapshot_publisher:
+            self.snapshot_publisher.kill()
+        if self.graph_snapshot_writer:
+            self.graph_snapshot_writer.kill()
+        self.flush_channels()
+        if self.routing_pool:
+            self.routing_pool.stop()
+        if self.graph_snapshot_file:
+            self.write_graph_snapshot()
+
+    def write_graph_snapshot(self, yield_func: Optional[Callable[[], None]] = None) -> None:
+        """Writes the channel graphs to `graph_snapshot_file` to speed up the next start
+
+        `yield_func` is called between the token networks.
+        """
+        assert self.graph_snapshot_file
+
+        def yield_and_flush() -> None:
+            if yield_func is not None:
+                yield_func()
+            # The snapshot pairs the in memory channels with their db rows
+            self.flush_channels()
+
+        write_graph_snapshot(
+            self.graph_snapshot_file,
+            database=self.database,
+            token_networks=list(self.token_networks.values()),
+            chain_id=self.chain_id,
+            token_network_registry_address=to_canonical_address(self.registry_address),
+            latest_committed_block=self.blockchain_state.latest_committed_block,
+            yield_func=yield_and_flush,
+        )
 
     def follows_token_network(self, token_network_address: TokenNetworkAddress) -> bool:
         """Checks if a token network is followed by the pathfinding service."""
@@ -232,10 +481,13 @@ class PathfindingService(gevent.Greenlet):
                     self.handle_channel_opened(event)
                 elif isinstance(event, (ReceiveChannelClosedEvent, ReceiveChannelSettledEvent)):
                     self.handle_channel_removed(event)
+                elif isinstance(event, ReceiveUserDepositBalanceChangedEvent):
+                    self.udc_balances.invalidate(event.owner, event.block_number)
                 elif isinstance(event, UpdatedHeadBlockEvent):
                     # TODO: Store blockhash here as well
                     self.blockchain_state.latest_committed_block = event.head_block_number
                     self.database.update_lastest_committed_block(event.head_block_number)
+                    self.udc_balances.set_events_handled_until(event.head_block_number)
                 else:
                     log.debug("Unhandled event", evt=event)
 
@@ -245,7 +497,9 @@ class PathfindingService(gevent.Greenlet):
         if not self.follows_token_network(network_address):
             log.info("Found new token network", event_=event)
 
-            self.token_networks[network_address] = TokenNetwork(network_address, settle_timeout)
+            token_network = self.token_network_class(network_address, settle_timeout)
+            token_network.track_reachability(self.matrix_listener.user_manager)
+            self.token_networks[network_address] = token_network
             self.database.upsert_token_network(network_address, settle_timeout)
 
     def handle_channel_opened(self, event: ReceiveChannelOpenedEvent) -> None:
@@ -263,10 +517,16 @@ class PathfindingService(gevent.Greenlet):
         self.database.upsert_channel(channel)
 
         # Handle messages for this channel which where received before ChannelOpened
-        with self.database.conn:
-            for message in self.database.pop_waiting_messages(
-                token_network_address=token_network.address, channel_id=event.channel_identifier
-            ):
+        recent_messages = self._waiting_messages.pop(
+            (token_network.address, event.channel_identifier), []
+        )
+        with self.database.transaction():
+            stored_messages = self.database.pop_waiting_messages(
+                token_network_address=token_network.address,
+                channel_id=event.channel_identifier,
+                added_after=datetime.utcnow() - WAITING_MESSAGE_TTL,
+            )
+            for message in stored_messages + [recent for _, recent in recent_messages]:
                 log.debug("Processing deferred message", message=message)
                 self.handle_message(message)
 
@@ -281,6 +541,8 @@ class PathfindingService(gevent.Greenlet):
         event_name = "ChannelSettled" if is_settled_event else "ChannelClosed"
         log.info(f"Received {event_name} event", event_=event)
 
+        # Don't recreate the channel in the db with pending updates
+        self._dirty_channels.pop((event.token_network_address, event.channel_identifier), None)
         channel_deleted = self.database.delete_channel(
             event.token_network_address, event.channel_identifier
         )
@@ -298,7 +560,61 @@ class PathfindingService(gevent.Greenlet):
             )
             metrics.get_metrics_for_label(metrics.ERRORS_LOGGED, metrics.ErrorCategory.STATE).inc()
 
-    def handle_message(self, message: Message) -> None:
+    def handle_reachability_change(
+        self, address: Address, reachability: AddressReachability
+    ) -> None:
+        for token_network in self.token_networks.values():
+            token_network.handle_reachability_change(address, reachability)
+
+    def handle_messages(self, messages: List[Message]) -> None:
+        """Handles all messages received in a single matrix sync
+
+        Only the newest capacity and fee update of each channel participant
+        is applied. Older updates are only tried when all newer ones turn out
+        to be invalid, so that a forged update can't hide a valid one.
+
+        Messages deferred until their channel is opened and the changed
+        channels are buffered and written with the next `flush_channels`, so
+        that repeated updates to a channel within the batch result in a single
+        write.
+        """
+        updates: Dict[tuple, List[Tuple[Any, int, DeferableMessage]]] = collections.defaultdict(
+            list
+        )
+        for index, message in enumerate(messages):
+            if isinstance(message, (PFSCapacityUpdate, PFSFeeUpdate)):
+                canonical_identifier = message.canonical_identifier
+                key = (
+                    type(message),
+                    canonical_identifier.token_network_address,
+                    canonical_identifier.channel_identifier,
+                    message.updating_participant,
+                )
+                age = (
+                    message.updating_nonce
+                    if isinstance(message, PFSCapacityUpdate)
+                    else message.timestamp
+                )
+                updates[key].append((age, index, message))
+            else:
+                self.handle_message(message)
+
+        for candidates in updates.values():
+            # Newest first, later messages win if the age is the same
+            for _, _, update in sorted(candidates, key=lambda c: c[:2], reverse=True):
+                if self.handle_message(update):
+                    break
+
+    def handle_message(self, message: Message) -> bool:
+        """Handles a single message
+
+        Returns `False` if the message was invalid.
+        """
+        if isinstance(message, (PFSCapacityUpdate, PFSFeeUpdate)):
+            if self._is_superseded(message):
+                log.debug("Dropping superseded update", message=message)
+                return True
+
         with sentry_sdk.configure_scope() as scope:
             scope.set_extra("message", message)
             try:
@@ -309,15 +625,56 @@ class PathfindingService(gevent.Greenlet):
                         changed_channel = self.on_fee_update(message)
                     else:
                         log.debug("Ignoring message", unknown_message=message)
-                        return
+                        return True
 
                     if changed_channel:
-                        self.database.upsert_channel(changed_channel)
+                        self._mark_channel_dirty(changed_channel)
 
             except DeferMessage as ex:
                 self.defer_message_until_channel_is_open(ex.deferred_message)
             except InvalidGlobalMessage as ex:
                 log.info(str(ex), **asdict(message))
+                return False
+        return True
+
+    def _is_superseded(self, message: DeferableMessage) -> bool:
+        """Checks if a newer update of the same participant has already been applied
+
+        This only uses the in memory state, so that outdated updates are dropped
+        before recovering their signature. Messages which can't be checked
+        without further validation are never considered superseded.
+        """
+        canonical_identifier = message.canonical_identifier
+        token_network = self.get_token_network(canonical_identifier.token_network_address)
+        if token_network is None:
+            return False
+
+        if isinstance(message, PFSCapacityUpdate):
+            # The nonce stored in the channel view can also be set by the partner's
+            # update, so only the nonces sent by the participant itself are used.
+            latest_nonce = self._capacity_update_nonces.get(
+                (
+                    TokenNetworkAddress(canonical_identifier.token_network_address),
+                    canonical_identifier.channel_identifier,
+                    message.updating_participant,
+                )
+            )
+            return latest_nonce is not None and message.updating_nonce < latest_nonce
+
+        participants = token_network.channel_id_to_addresses.get(
+            canonical_identifier.channel_identifier
+        )
+        if participants is None or message.updating_participant not in participants:
+            return False
+        other_participant = (set(participants) - {message.updating_participant}).pop()
+        view = token_network.G[message.updating_participant][other_participant]["view"]
+        return message.timestamp <= view.fee_schedule_sender.timestamp
+
+    def _mark_channel_dirty(self, channel: Channel) -> None:
+        # Repeated updates to the same channel are coalesced into a single write
+        self._dirty_channels[(channel.token_network_address, channel.channel_id)] = channel
+        if len(self._dirty_channels) >= CHANNEL_FLUSH_MAX_CHANNELS:
+            self.flush_channels()
 
     def defer_message_until_channel_is_open(self, message: DeferableMessage) -> None:
         log.debug(
@@ -325,7 +682,16 @@ class PathfindingService(gevent.Greenlet):
             channel_id=message.canonical_identifier.channel_identifier,
             message=message,
         )
-        self.database.insert_waiting_message(message)
+        channel_messages = self._waiting_messages.setdefault(
+            (
+                TokenNetworkAddress(message.canonical_identifier.token_network_address),
+                message.canonical_identifier.channel_identifier,
+            ),
+            [],
+        )
+        channel_messages.append((datetime.utcnow(), message))
+        # Older messages are likely to be superseded by the newer ones
+        del channel_messages[:-MAX_WAITING_MESSAGES_PER_CHANNEL]
 
     def _validate_pfs_fee_update(self, message: PFSFeeUpdate) -> TokenNetwork:
         # check if chain_id matches
@@ -406,14 +772,19 @@ class PathfindingService(gevent.Greenlet):
     def on_capacity_update(self, message: PFSCapacityUpdate) -> Channel:
         token_network = self._validate_pfs_capacity_update(message)
         log.debug("Received Capacity Update", message=message)
-        self.database.upsert_capacity_update(message)
 
-        updating_capacity_partner, other_capacity_partner = self.database.get_capacity_updates(
-            updating_participant=message.other_participant,
-            token_network_address=TokenNetworkAddress(
-                message.canonical_identifier.token_network_address
-            ),
-            channel_id=message.canonical_identifier.channel_identifier,
+        token_network_address = TokenNetworkAddress(
+            message.canonical_identifier.token_network_address
+        )
+        channel_id = message.canonical_identifier.channel_identifier
+        key = (token_network_address, channel_id, message.updating_participant)
+        self.capacity_updates[key] = (message.updating_capacity, message.other_capacity)
+        self._dirty_capacity_updates.add(key)
+        self._capacity_update_nonces[key] = message.updating_nonce
+
+        updating_capacity_partner, other_capacity_partner = self.capacity_updates.get(
+            (token_network_address, channel_id, message.other_participant),
+            (TokenAmount(0), TokenAmount(0)),
         )
         return token_network.handle_channel_balance_update_message(
             message=message,
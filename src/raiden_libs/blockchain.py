@@ -1,6 +1,8 @@
 import time
-from typing import Dict, List, Optional
+from collections import OrderedDict
+from typing import Callable, Collection, Dict, Iterable, List, Optional, Set, Tuple, Type
 
+import gevent
 import structlog
 from eth_abi.codec import ABICodec
 from eth_utils import decode_hex, encode_hex, to_canonical_address
@@ -24,6 +26,8 @@ from raiden_contracts.constants import (
     CONTRACT_MONITORING_SERVICE,
     CONTRACT_TOKEN_NETWORK,
     CONTRACT_TOKEN_NETWORK_REGISTRY,
+    CONTRACT_USER_DEPOSIT,
+    EVENT_TOKEN_NETWORK_CREATED,
     ChannelEvent,
     MonitoringServiceEvent,
 )
@@ -38,6 +42,7 @@ from raiden_libs.events import (
     ReceiveMonitoringRewardClaimedEvent,
     ReceiveNonClosingBalanceProofUpdatedEvent,
     ReceiveTokenNetworkCreatedEvent,
+    ReceiveUserDepositBalanceChangedEvent,
     UpdatedHeadBlockEvent,
 )
 from raiden_libs.states import BlockchainState
@@ -50,6 +55,7 @@ def create_event_topic_to_abi_dict() -> Dict[bytes, ABIEvent]:
         CONTRACT_TOKEN_NETWORK_REGISTRY,
         CONTRACT_TOKEN_NETWORK,
         CONTRACT_MONITORING_SERVICE,
+        CONTRACT_USER_DEPOSIT,
     ]
 
     event_abis = {}
@@ -65,6 +71,29 @@ def create_event_topic_to_abi_dict() -> Dict[bytes, ABIEvent]:
 
 EVENT_TOPIC_TO_ABI = create_event_topic_to_abi_dict()
 
+# Creates an `Event` from a decoded log entry of a specific contract type
+EventParser = Callable[[dict], Optional[Event]]
+
+# Argument holding the affected account for each UserDeposit event
+USER_DEPOSIT_EVENT_OWNER_ARGS = {
+    "NewDeposit": "beneficiary",
+    "BalanceReduced": "owner",
+    "WithdrawPlanned": "withdrawer",
+    "Withdrawn": "withdrawer",
+}
+
+# Contract events from which each `Event` type is created
+EVENT_TYPE_TO_EVENT_NAMES: Dict[Type[Event], List[str]] = {
+    ReceiveTokenNetworkCreatedEvent: [EVENT_TOKEN_NETWORK_CREATED],
+    ReceiveChannelOpenedEvent: [ChannelEvent.OPENED],
+    ReceiveChannelClosedEvent: [ChannelEvent.CLOSED],
+    ReceiveNonClosingBalanceProofUpdatedEvent: [ChannelEvent.BALANCE_PROOF_UPDATED],
+    ReceiveChannelSettledEvent: [ChannelEvent.SETTLED],
+    ReceiveMonitoringNewBalanceProofEvent: [MonitoringServiceEvent.NEW_BALANCE_PROOF_RECEIVED],
+    ReceiveMonitoringRewardClaimedEvent: [MonitoringServiceEvent.REWARD_CLAIMED],
+    ReceiveUserDepositBalanceChangedEvent: list(USER_DEPOSIT_EVENT_OWNER_ARGS),
+}
+
 
 def get_web3_provider_info(web3: Web3) -> str:
     """Returns information about the provider
@@ -90,8 +119,27 @@ def decode_event(abi_codec: ABICodec, log_entry: LogReceipt) -> Dict:
     return get_event_data(abi_codec=abi_codec, event_abi=event_abi, log_entry=log_entry)
 
 
+def get_event_topics(event_types: Iterable[Type[Event]]) -> List[str]:
+    """Returns the topics of the contract events from which `event_types` are created
+
+    Event types which are not created from contract events are ignored.
+    """
+    event_names: Set[str] = set()
+    for event_type in event_types:
+        event_names.update(EVENT_TYPE_TO_EVENT_NAMES.get(event_type, []))
+    return sorted(
+        encode_hex(topic)
+        for topic, event_abi in EVENT_TOPIC_TO_ABI.items()
+        if event_abi["name"] in event_names
+    )
+
+
 def query_blockchain_events(
-    web3: Web3, contract_addresses: List[Address], from_block: BlockNumber, to_block: BlockNumber
+    web3: Web3,
+    contract_addresses: List[Address],
+    from_block: BlockNumber,
+    to_block: BlockNumber,
+    topics: Optional[List[str]] = None,
 ) -> List[Dict]:
     """Returns events emmitted by a contract for a given event name, within a certain range.
 
@@ -100,6 +148,8 @@ def query_blockchain_events(
         contract_addresses: The address(es) of the contract(s) to be filtered
         from_block: The block to start search events
         to_block: The block to stop searching for events
+        topics: If given, only events with one of these topics as first topic
+            (the event signature) are returned
 
     Returns:
         All matching events
@@ -111,6 +161,8 @@ def query_blockchain_events(
     filter_params = FilterParams(
         {"fromBlock": from_block, "toBlock": to_block, "address": contract_addresses}
     )
+    if topics is not None:
+        filter_params["topics"] = [topics]
 
     events = web3.eth.get_logs(filter_params)
 
@@ -154,13 +206,102 @@ def parse_token_network_event(event: dict) -> Optional[Event]:
     return None
 
 
+def parse_token_network_registry_event(event: dict) -> Optional[Event]:
+    if event["event"] != EVENT_TOKEN_NETWORK_CREATED:
+        return None
+
+    return ReceiveTokenNetworkCreatedEvent(
+        token_network_address=TokenNetworkAddress(
+            to_canonical_address(event["args"]["token_network_address"])
+        ),
+        token_address=TokenAddress(to_canonical_address(event["args"]["token_address"])),
+        settle_timeout=event["args"]["settle_timeout"],
+        block_number=event["blockNumber"],
+    )
+
+
+def parse_monitoring_event(event: dict) -> Optional[Event]:
+    event_name = event["event"]
+    block_number = event["blockNumber"]
+
+    if event_name == MonitoringServiceEvent.NEW_BALANCE_PROOF_RECEIVED:
+        return ReceiveMonitoringNewBalanceProofEvent(
+            token_network_address=TokenNetworkAddress(
+                to_canonical_address(event["args"]["token_network_address"])
+            ),
+            channel_identifier=event["args"]["channel_identifier"],
+            reward_amount=event["args"]["reward_amount"],
+            nonce=event["args"]["nonce"],
+            ms_address=to_canonical_address(event["args"]["ms_address"]),
+            raiden_node_address=to_canonical_address(event["args"]["raiden_node_address"]),
+            block_number=block_number,
+        )
+    if event_name == MonitoringServiceEvent.REWARD_CLAIMED:
+        return ReceiveMonitoringRewardClaimedEvent(
+            ms_address=to_canonical_address(event["args"]["ms_address"]),
+            amount=event["args"]["amount"],
+            reward_identifier=encode_hex(event["args"]["reward_identifier"]),
+            block_number=block_number,
+        )
+
+    return None
+
+
+def parse_user_deposit_event(event: dict) -> Optional[Event]:
+    owner_arg = USER_DEPOSIT_EVENT_OWNER_ARGS.get(event["event"])
+    if owner_arg is None:
+        return None
+
+    return ReceiveUserDepositBalanceChangedEvent(
+        owner=to_canonical_address(event["args"][owner_arg]),
+        block_number=event["blockNumber"],
+    )
+
+
+def query_blockchain_events_concurrently(
+    web3: Web3,
+    queries: List[List[Address]],
+    from_block: BlockNumber,
+    to_block: BlockNumber,
+    topics: Optional[List[str]] = None,
+) -> List[List[Dict]]:
+    """Runs a `query_blockchain_events` for each list of contract addresses
+
+    The queries are run in separate greenlets, so that the latency of the
+    ethereum node is not paid once per query. Errors are raised as for
+    sequential queries.
+    """
+    greenlets = [
+        gevent.spawn(
+            query_blockchain_events,
+            web3=web3,
+            contract_addresses=contract_addresses,
+            from_block=from_block,
+            to_block=to_block,
+            topics=topics,
+        )
+        for contract_addresses in queries
+    ]
+    try:
+        return [greenlet.get() for greenlet in greenlets]
+    finally:
+        gevent.killall(greenlets)
+
+
 def get_blockchain_events(
     web3: Web3,
     token_network_addresses: List[TokenNetworkAddress],
     chain_state: BlockchainState,
     from_block: BlockNumber,
     to_block: BlockNumber,
+    handled_event_types: Optional[Collection[Type[Event]]] = None,
 ) -> List[Event]:
+    """Returns the events of all relevant contracts, ordered by block and log index
+
+    New token networks are appended to `token_network_addresses`. If
+    `handled_event_types` is given, only the logs for these event types are
+    fetched from the ethereum node.
+    """
     # Check if the current block was already processed
     if from_block > to_block:
         return []
@@ -173,53 +314,62 @@ def get_blockchain_events(
         num_blocks=to_block - from_block + 1,
     )
 
-    # first check for new token networks and add to state
-    registry_events = query_blockchain_events(
-        web3=web3,
-        contract_addresses=[chain_state.token_network_registry_address],
-        from_block=from_block,
-        to_block=to_block,
-    )
+    topics = None
+    if handled_event_types is not None:
+        # Token networks must be tracked to query their events
+        topics = get_event_topics({ReceiveTokenNetworkCreatedEvent, *handled_event_types})
 
-    events: List[Event] = []
-    for event_dict in registry_events:
-        token_network_address = TokenNetworkAddress(
-            to_canonical_address(event_dict["args"]["token_network_address"])
+    # The monitoring and user deposit contracts are only queried if their
+    # addresses are set in `chain_state`
+    parsers_and_addresses: List[Tuple[EventParser, List[Address]]] = [
+        (parse_token_network_registry_event, [chain_state.token_network_registry_address]),
+        (parse_token_network_event, list(token_network_addresses)),  # type: ignore
+    ]
+    if chain_state.monitor_contract_address is not None:
+        parsers_and_addresses.append(
+            (parse_monitoring_event, [chain_state.monitor_contract_address])
         )
-        events.append(
-            ReceiveTokenNetworkCreatedEvent(
-                token_network_address=token_network_address,
-                token_address=TokenAddress(
-                    to_canonical_address(event_dict["args"]["token_address"])
-                ),
-                settle_timeout=event_dict["args"]["settle_timeout"],
-                block_number=event_dict["blockNumber"],
-            )
+    if chain_state.user_deposit_contract_address is not None:
+        parsers_and_addresses.append(
+            (parse_user_deposit_event, [chain_state.user_deposit_contract_address])
         )
-        token_network_addresses.append(token_network_address)
 
-    # then check all token networks
-    network_events = query_blockchain_events(
+    # All queries are independent of each other
+    results = query_blockchain_events_concurrently(
         web3=web3,
-        contract_addresses=token_network_addresses,  # type: ignore
+        queries=[addresses for _, addresses in parsers_and_addresses],
         from_block=from_block,
         to_block=to_block,
+        topics=topics,
     )
+    parsed_events: List[Tuple[Dict, Optional[Event]]] = [
+        (event_dict, parser(event_dict))
+        for (parser, _), event_dicts in zip(parsers_and_addresses, results)
+        for event_dict in event_dicts
+    ]
 
-    for event_dict in network_events:
-        event = parse_token_network_event(event_dict)
-        if event:
-            events.append(event)
+    # Token networks created within the range have not been queried, yet
+    new_token_networks = [
+        event for _, event in parsed_events if isinstance(event, ReceiveTokenNetworkCreatedEvent)
+    ]
+    if new_token_networks:
+        new_token_network_addresses = [event.token_network_address for event in new_token_networks]
+        token_network_addresses.extend(new_token_network_addresses)
+        new_network_events = query_blockchain_events(
+            web3=web3,
+            contract_addresses=new_token_network_addresses,  # type: ignore
+            from_block=min(event.block_number for event in new_token_networks),
+            to_block=to_block,
+            topics=topics,
+        )
+        parsed_events.extend(
+            (event_dict, parse_token_network_event(event_dict))
+            for event_dict in new_network_events
+        )
 
-    # get events from monitoring service contract, this only queries the chain
-    # if the monitor contract address is set in chain_state
-    monitoring_events = get_monitoring_blockchain_events(
-        web3=web3,
-        monitor_contract_address=chain_state.monitor_contract_address,
-        from_block=from_block,
-        to_block=to_block,
-    )
-    events.extend(monitoring_events)
+    # Handle the events in the order in which they have been emitted
+    parsed_events.sort(key=lambda item: (item[0]["blockNumber"], item[0]["logIndex"]))
+    events = [event for _, event in parsed_events if event is not None]
 
     # commit new block number
     events.append(UpdatedHeadBlockEvent(head_block_number=to_block))
@@ -227,54 +377,6 @@ def get_blockchain_events(
     return events
 
 
-def get_monitoring_blockchain_events(
-    web3: Web3,
-    monitor_contract_address: Optional[Address],
-    from_block: BlockNumber,
-    to_block: BlockNumber,
-) -> List[Event]:
-    if monitor_contract_address is None:
-        return []
-
-    monitoring_service_events = query_blockchain_events(
-        web3=web3,
-        contract_addresses=[monitor_contract_address],
-        from_block=from_block,
-        to_block=to_block,
-    )
-
-    events: List[Event] = []
-    for event in monitoring_service_events:
-        event_name = event["event"]
-        block_number = event["blockNumber"]
-
-        if event_name == MonitoringServiceEvent.NEW_BALANCE_PROOF_RECEIVED:
-            events.append(
-                ReceiveMonitoringNewBalanceProofEvent(
-                    token_network_address=TokenNetworkAddress(
-                        to_canonical_address(event["args"]["token_network_address"])
-                    ),
-                    channel_identifier=event["args"]["channel_identifier"],
-                    reward_amount=event["args"]["reward_amount"],
-                    nonce=event["args"]["nonce"],
-                    ms_address=to_canonical_address(event["args"]["ms_address"]),
-                    raiden_node_address=to_canonical_address(event["args"]["raiden_node_address"]),
-                    block_number=block_number,
-                )
-            )
-        elif event_name == MonitoringServiceEvent.REWARD_CLAIMED:
-            events.append(
-                ReceiveMonitoringRewardClaimedEvent(
-                    ms_address=to_canonical_address(event["args"]["ms_address"]),
-                    amount=event["args"]["amount"],
-                    reward_identifier=encode_hex(event["args"]["reward_identifier"]),
-                    block_number=block_number,
-                )
-            )
-
-    return events
-
-
 def get_pessimistic_udc_balance(
     udc: Contract, address: Address, from_block: BlockNumber, to_block: BlockNumber
 ) -> TokenAmount:
@@ -291,11 +393,60 @@ def get_pessimistic_udc_balance(
     )
 
 
+class UDCBalanceCache:
+    """Caches the results of `get_pessimistic_udc_balance` by address and block
+
+    A cached balance is always reused for the same `to_block`. The effective
+    balance only changes with the events of the UserDeposit contract, so a
+    cached balance is also reused for later blocks, if the events up to that
+    block have been handled by calling `invalidate` for each event and
+    `set_events_handled_until` afterwards. The reused balance is never higher
+    than the effective balance at the later block.
+    """
+
+    def __init__(self, udc: Contract, max_size: int = 10_000):
+        self.udc = udc
+        self.max_size = max_size
+        self._balances: "OrderedDict[Address, Tuple[BlockNumber, TokenAmount]]" = OrderedDict()
+        self._latest_event_block = BlockNumber(0)
+        self._events_handled_until = BlockNumber(0)
+
+    def get_pessimistic_balance(
+        self, address: Address, from_block: BlockNumber, to_block: BlockNumber
+    ) -> TokenAmount:
+        cached = self._balances.get(address)
+        if cached is not None:
+            cached_block, balance = cached
+            if cached_block == to_block or cached_block < to_block <= self._events_handled_until:
+                self._balances.move_to_end(address)
+                return balance
+
+        balance = get_pessimistic_udc_balance(
+            udc=self.udc, address=address, from_block=from_block, to_block=to_block
+        )
+        # Events after `to_block` might have been handled while querying the
+        # balance, so it can only be cached if it includes all known events.
+        if to_block >= self._latest_event_block:
+            self._balances[address] = (to_block, balance)
+            self._balances.move_to_end(address)
+            if len(self._balances) > self.max_size:
+                self._balances.popitem(last=False)
+        return balance
+
+    def invalidate(self, address: Address, block_number: BlockNumber) -> None:
+        self._balances.pop(address, None)
+        self._latest_event_block = max(self._latest_event_block, block_number)
+
+    def set_events_handled_until(self, block_number: BlockNumber) -> None:
+        self._events_handled_until = block_number
+
+
 def get_blockchain_events_adaptive(
     web3: Web3,
     blockchain_state: BlockchainState,
     token_network_addresses: List[TokenNetworkAddress],
     latest_confirmed_block: BlockNumber,
+    handled_event_types: Optional[Collection[Type[Event]]] = None,
 ) -> Optional[List[Event]]:
     """
     Queries new events from the blockchain.
@@ -310,6 +461,7 @@ def get_blockchain_events_adaptive(
             is created as well and it is recommended to use that instead and to not reuse
             this list.
         latest_confirmed_block: The latest block to query to
+        handled_event_types: If given, only events of these types are queried
 
     Returns:
         A list of events if successful, otherwise ``None``
@@ -330,6 +482,7 @@ def get_blockchain_events_adaptive(
             chain_state=blockchain_state,
             from_block=from_block,
             to_block=to_block,
+            handled_event_types=handled_event_types,
         )
         after_query = time.monotonic()
 
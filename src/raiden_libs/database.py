@@ -84,6 +84,22 @@ class BaseDatabase:
         with closing(self.conn.cursor()) as cursor:
             yield cursor
 
+    @contextmanager
+    def transaction(self) -> Generator[None, None, None]:
+        """Executes all statements inside the block in a single transaction
+
+        Based on savepoints, so transactions can be nested.
+        """
+        with self._cursor() as cursor:
+            cursor.execute("SAVEPOINT tx")
+            try:
+                yield
+            except BaseException:
+                cursor.execute("ROLLBACK TO tx")
+                raise
+            finally:
+                cursor.execute("RELEASE tx")
+
     def _setup(
         self,
         chain_id: ChainID,
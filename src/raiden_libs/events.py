@@ -76,6 +76,14 @@ class ReceiveMonitoringRewardClaimedEvent(Event):
     block_number: BlockNumber
 
 
+@dataclass(frozen=True)
+class ReceiveUserDepositBalanceChangedEvent(Event):
+    """Any UserDeposit event which changes the effective balance of `owner`"""
+
+    owner: Address
+    block_number: BlockNumber
+
+
 @dataclass(frozen=True)
 class UpdatedHeadBlockEvent(Event):
     """Event triggered after updating the head block and all events."""
@@ -1,7 +1,11 @@
+import multiprocessing
 import os
-import sys
-from datetime import datetime, timedelta
-from typing import Callable, Dict, Iterable, List, Optional, Set
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
 from urllib.parse import urlparse
 
 import gevent
@@ -16,6 +20,7 @@ from raiden_common.exceptions import SerializationError, TransportError
 from raiden_common.messages.abstract import Message, SignedMessage
 from raiden_common.network.transport.matrix.client import GMatrixClient, MatrixMessage
 from raiden_common.network.transport.matrix.utils import (
+    AddressReachability,
     DisplayNameCache,
     login,
     make_client,
@@ -37,57 +42,156 @@ from raiden_common.utils.typing import Address
 
 from monitoring_service.constants import (
     MATRIX_RATE_LIMIT_ALLOWED_BYTES,
+    MATRIX_RATE_LIMIT_MAX_SENDERS,
+    MATRIX_RATE_LIMIT_MESSAGE_TYPE_BUDGETS,
     MATRIX_RATE_LIMIT_RESET_INTERVAL,
+    MATRIX_UNKNOWN_MESSAGE_TYPE,
 )
 from raiden_contracts.utils.type_aliases import ChainID, PrivateKey
+from raiden_libs import metrics
+from raiden_libs.message_queue import CoalesceKeyFunc, MessageQueue, OverflowPolicy
 from raiden_libs.tracing import matrix_client_enable_requests_tracing
-from raiden_libs.user_address import MultiClientUserAddressManager
+from raiden_libs.user_address import MultiClientUserAddressManager, noop_reachability
 from raiden_libs.utils import to_checksum_address
 
 log = structlog.get_logger(__name__)
 
 
+# Budget that every sender has for all message types together
+SENDER_BUDGET = "sender"
+
+_MESSAGE_TYPE_RE = re.compile(r'"_type"\s*:\s*"(?:[\w.]*\.)?(\w+)"')
+
+
+def peek_message_type(line: str) -> str:
+    """Returns the class name of a serialized message without decoding the JSON
+
+    The serializer adds the type of an object after all its fields, so the
+    last type in the line belongs to the message itself and not to one of its
+    nested objects.
+    """
+    index = line.rfind('"_type"')
+    match = _MESSAGE_TYPE_RE.match(line, index) if index != -1 else None
+    return match.group(1) if match else MATRIX_UNKNOWN_MESSAGE_TYPE
+
+
+class TokenBucket:
+    """Holds up to `capacity` tokens and refills `capacity` tokens per `refill_interval`"""
+
+    __slots__ = ("capacity", "refill_rate", "tokens", "updated_at")
+
+    def __init__(self, capacity: int, refill_interval: timedelta, now: float):
+        self.capacity = capacity
+        self.refill_rate = capacity / refill_interval.total_seconds()
+        self.tokens = float(capacity)
+        self.updated_at = now
+
+    def refill(self, now: float) -> None:
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+        self.updated_at = now
+
+
 class RateLimiter:
-    """Primitive bucket based rate limiter
+    """Token bucket based rate limiter
 
     Counts bytes for each sender. `check_and_count` will return false when the
-    `allowed_bytes` are exceeded during a single `reset_interval`.
+    sender's bucket does not contain enough tokens. The bucket holds up to
+    `allowed_bytes` and is refilled continuously, so that `allowed_bytes` are
+    allowed per `reset_interval` on average. In contrast to resetting all
+    counts at once, this doesn't allow bursts of twice the allowed bytes around
+    the reset.
+
+    `message_type_budgets` additionally limits the bytes per message type
+    (class name, see `peek_message_type`) of each sender, with the same
+    refill interval. Only the `max_senders` most recently seen senders are
+    tracked. A forgotten sender starts with full buckets again.
     """
 
-    def __init__(self, allowed_bytes: int, reset_interval: timedelta):
+    def __init__(
+        self,
+        allowed_bytes: int,
+        reset_interval: timedelta,
+        max_senders: int = MATRIX_RATE_LIMIT_MAX_SENDERS,
+        message_type_budgets: Optional[Dict[str, int]] = None,
+    ):
         self.allowed_bytes = allowed_bytes
         self.reset_interval = reset_interval
-        self.next_reset = datetime.utcnow() + reset_interval
-        self.bytes_processed_for: Dict[Address, int] = {}
+        self.max_senders = max_senders
+        self.message_type_budgets = message_type_budgets or {}
+        # Buckets by sender and budget name, ordered from least to most recently used
+        self._buckets: "OrderedDict[Address, Dict[str, TokenBucket]]" = OrderedDict()
+
+    def _get_bucket(self, sender_buckets: Dict[str, TokenBucket], budget: str) -> TokenBucket:
+        bucket = sender_buckets.get(budget)
+        if bucket is None:
+            capacity = (
+                self.allowed_bytes
+                if budget == SENDER_BUDGET
+                else self.message_type_budgets[budget]
+            )
+            bucket = TokenBucket(capacity, self.reset_interval, now=time.monotonic())
+            sender_buckets[budget] = bucket
+        return bucket
+
+    def check_and_count(
+        self, sender: Address, added_bytes: int, message_type: Optional[str] = None
+    ) -> bool:
+        sender_buckets = self._buckets.get(sender)
+        if sender_buckets is None:
+            sender_buckets = self._buckets[sender] = {}
+            if len(self._buckets) > self.max_senders:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(sender)
+
+        budgets = [SENDER_BUDGET]
+        if message_type is not None and message_type in self.message_type_budgets:
+            budgets.append(message_type)
+
+        now = time.monotonic()
+        buckets = []
+        for budget in budgets:
+            bucket = self._get_bucket(sender_buckets, budget)
+            bucket.refill(now)
+            if bucket.tokens < added_bytes:
+                metrics.MESSAGES_RATE_LIMITED_BYTES.labels(budget=budget).inc(added_bytes)
+                return False
+            buckets.append(bucket)
+
+        for bucket in buckets:
+            bucket.tokens -= added_bytes
+        return True
 
-    def reset_if_it_is_time(self) -> None:
-        if datetime.utcnow() >= self.next_reset:
-            self.bytes_processed_for = {}
-            self.next_reset = datetime.utcnow() + self.reset_interval
 
-    def check_and_count(self, sender: Address, added_bytes: int) -> bool:
-        new_total = self.bytes_processed_for.get(sender, 0) + added_bytes
-        if new_total > self.allowed_bytes:
-            return False
+def check_rate_limit(rate_limiter: RateLimiter, data: str, peer_address: Address) -> str:
+    """Returns the lines of `data` which are within the rate limits of `peer_address`
 
-        self.bytes_processed_for[sender] = new_total
-        return True
+    Each line contains a single message, so messages are throttled one by one.
+    The number of characters is used as size, to avoid encoding the data.
+    """
+    allowed_lines: List[str] = []
+    rate_limited = False
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        if rate_limiter.check_and_count(peer_address, len(line), peek_message_type(line)):
+            allowed_lines.append(line)
+        else:
+            rate_limited = True
 
+    if rate_limited:
+        log.warning("Sender is rate limited", sender=peer_address)
+    return "\n".join(allowed_lines)
 
-def deserialize_messages(
-    data: str, peer_address: Address, rate_limiter: Optional[RateLimiter] = None
-) -> List[SignedMessage]:
-    messages: List[SignedMessage] = []
 
-    if rate_limiter:
-        rate_limiter.reset_if_it_is_time()
-        # This size includes some bytes of overhead for python. But otherwise we
-        # would have to either count characters for decode the whole string before
-        # checking the rate limiting.
-        size = sys.getsizeof(data)
-        if not rate_limiter.check_and_count(peer_address, size):
-            log.warning("Sender is rate limited", sender=peer_address)
-            return []
+def parse_messages(data: str, peer_address: Address) -> List[SignedMessage]:
+    """Deserializes the messages in `data` and checks that they are signed by `peer_address`
+
+    Recovering the signers is CPU bound, so this is run in worker processes
+    if `MatrixListener` is started with `deserialization_workers`.
+    """
+    messages: List[SignedMessage] = []
 
     for line in data.splitlines():
         line = line.strip()
@@ -114,6 +218,15 @@ def deserialize_messages(
     return messages
 
 
+def deserialize_messages(
+    data: str, peer_address: Address, rate_limiter: Optional[RateLimiter] = None
+) -> List[SignedMessage]:
+    if rate_limiter:
+        data = check_rate_limit(rate_limiter, data, peer_address)
+
+    return parse_messages(data, peer_address)
+
+
 def matrix_http_retry_delay() -> Iterable[float]:
     return timeout_exponential_backoff(
         DEFAULT_TRANSPORT_RETRIES_BEFORE_BACKOFF,
@@ -124,20 +237,41 @@ def matrix_http_retry_delay() -> Iterable[float]:
 
 class MatrixListener(gevent.Greenlet):
     # pylint: disable=too-many-instance-attributes
-    def __init__(
+    def __init__(  # pylint: disable=too-many-arguments
         self,
         private_key: PrivateKey,
         chain_id: ChainID,
         device_id: DeviceIDs,
         message_received_callback: Callable[[Message], None],
         servers: Optional[List[str]] = None,
+        message_batch_received_callback: Optional[Callable[[List[Message]], None]] = None,
+        deserialization_workers: int = 0,
+        message_queue_size: int = 0,
+        overflow_policy: OverflowPolicy = OverflowPolicy.BLOCK,
+        coalesce_key: Optional[CoalesceKeyFunc] = None,
         enable_tracing: bool = False,
+        address_reachability_changed_callback: Callable[
+            [Address, AddressReachability], None
+        ] = noop_reachability,
     ) -> None:
         super().__init__()
 
         self.chain_id = chain_id
         self.device_id = device_id
         self.message_received_callback = message_received_callback
+        # Preferred over `message_received_callback` if given
+        self.message_batch_received_callback = message_batch_received_callback
+        # Without a queue, the callbacks are called directly by the sync worker
+        self._message_queue = (
+            MessageQueue(
+                handle_messages=self._deliver_messages,
+                max_size=message_queue_size,
+                overflow_policy=overflow_policy,
+                coalesce_key=coalesce_key,
+            )
+            if message_queue_size
+            else None
+        )
         self._displayname_cache = DisplayNameCache()
         self.startup_finished = AsyncResult()
         self._client_manager = ClientManager(
@@ -153,11 +287,25 @@ class MatrixListener(gevent.Greenlet):
         self.user_manager = MultiClientUserAddressManager(
             client=self._client,
             displayname_cache=self._displayname_cache,
+            address_reachability_changed_callback=address_reachability_changed_callback,
         )
 
         self._rate_limiter = RateLimiter(
             allowed_bytes=MATRIX_RATE_LIMIT_ALLOWED_BYTES,
             reset_interval=MATRIX_RATE_LIMIT_RESET_INTERVAL,
+            max_senders=MATRIX_RATE_LIMIT_MAX_SENDERS,
+            message_type_budgets=MATRIX_RATE_LIMIT_MESSAGE_TYPE_BUDGETS,
+        )
+
+        # Forking a process with a running gevent hub is not safe
+        self._deserialization_workers = deserialization_workers
+        self._deserialization_pool = (
+            ProcessPoolExecutor(
+                max_workers=deserialization_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            if deserialization_workers
+            else None
         )
 
     @property
@@ -178,27 +326,76 @@ class MatrixListener(gevent.Greenlet):
             self.startup_finished.set()
 
         startup_finished_greenlet = gevent.spawn(set_startup_finished)
+        queue_worker = None
+        if self._message_queue:
+            queue_worker = gevent.spawn(self._message_queue.run_worker)
+            # Errors in the handlers must not go unnoticed
+            queue_worker.link_exception(lambda g: self.kill(g.exception, block=False))
         try:
             assert self._client.sync_worker
             self._client.sync_worker.get()
         finally:
+            if queue_worker:
+                queue_worker.kill()
             self._client_manager.stop()
+            if self._deserialization_pool:
+                self._deserialization_pool.shutdown()
             gevent.joinall({startup_finished_greenlet}, raise_error=True, timeout=0)
 
     def _handle_matrix_sync(self, messages: List[MatrixMessage]) -> bool:
-        all_messages: List[Message] = []
-        for message in messages:
-            all_messages.extend(self._handle_message(message))
+        payloads = [self._get_payload(message) for message in messages]
+        messages_with_sender = self._deserialize_payloads(
+            [payload for payload in payloads if payload is not None]
+        )
 
-        log.debug("Incoming messages", messages=all_messages)
+        log.debug("Incoming messages", messages=[message for _, message in messages_with_sender])
 
-        for signed_message in all_messages:
-            self.message_received_callback(signed_message)
+        if self._message_queue:
+            self._message_queue.put(messages_with_sender)
+        else:
+            self._deliver_messages([message for _, message in messages_with_sender])
 
         return True
 
-    def _handle_message(self, message: MatrixMessage) -> List[SignedMessage]:
-        """Handle a single Matrix message.
+    def _deliver_messages(self, all_messages: List[Message]) -> None:
+        if self.message_batch_received_callback is not None:
+            if all_messages:
+                self.message_batch_received_callback(all_messages)
+        else:
+            for signed_message in all_messages:
+                self.message_received_callback(signed_message)
+
+    def _deserialize_payloads(
+        self, payloads: List[Tuple[str, Address]]
+    ) -> List[Tuple[Address, Message]]:
+        """Deserializes the payloads returned by `_get_payload`, keeping their order
+
+        Returns the messages together with their verified senders.
+        """
+        if self._deserialization_pool is None or len(payloads) < 2:
+            return [
+                (peer_address, message)
+                for data, peer_address in payloads
+                for message in parse_messages(data, peer_address)
+            ]
+
+        # Split the sync batch into a few chunks per worker, so that the
+        # inter process communication doesn't dominate for small messages
+        chunksize = max(1, len(payloads) // (self._deserialization_workers * 4))
+        datas, peer_addresses = zip(*payloads)
+        results = self._deserialization_pool.map(
+            parse_messages, datas, peer_addresses, chunksize=chunksize
+        )
+        # Only block the current greenlet while waiting for the results
+        messages_per_payload = gevent.get_hub().threadpool.apply(list, (results,))
+        return [
+            (peer_address, message)
+            for peer_address, messages in zip(peer_addresses, messages_per_payload)
+            for message in messages
+        ]
+
+    def _get_payload(self, message: MatrixMessage) -> Optional[Tuple[str, Address]]:
+        """Checks a single Matrix message and returns its body with the sender's address
 
         The matrix message is expected to be a NDJSON, and each entry should be
         a valid JSON encoded Raiden message.
@@ -208,7 +405,7 @@ class MatrixListener(gevent.Greenlet):
             and message["content"]["msgtype"] == MatrixMessageType.TEXT.value
         )
         if not is_valid_type:
-            return []
+            return None
 
         sender_id = message["sender"]
         self._displayname_cache.warm_users([User(self._client.api, sender_id)])
@@ -218,7 +415,7 @@ class MatrixListener(gevent.Greenlet):
             displayname = self._displayname_cache.userid_to_displayname[sender_id]
         except KeyError:
             log.exception("Could not warm display cache", peer_user=sender_id)
-            return []
+            return None
 
         peer_address = validate_user_id_signature(sender_id, displayname)
 
@@ -227,7 +424,7 @@ class MatrixListener(gevent.Greenlet):
                 "Message from invalid user displayName signature",
                 peer_user=sender_id,
             )
-            return []
+            return None
 
         data = message["content"]["body"]
         if not isinstance(data, str):
@@ -236,15 +433,13 @@ class MatrixListener(gevent.Greenlet):
                 peer_user=sender_id,
                 peer_address=to_checksum_address(peer_address),
             )
-            return []
+            return None
 
-        messages = deserialize_messages(
-            data=data, peer_address=peer_address, rate_limiter=self._rate_limiter
-        )
-        if not messages:
-            return []
+        data = check_rate_limit(self._rate_limiter, data, peer_address)
+        if not data:
+            return None
 
-        return messages
+        return data, peer_address
 
 
 class ClientManager:
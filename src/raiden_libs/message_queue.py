@@ -0,0 +1,157 @@
+"""Bounded queue between the `MatrixListener` and the message handlers
+
+Received messages are handled by dedicated worker greenlets, so that slow
+handlers don't stall the matrix sync. The size of the queue is limited and the
+`OverflowPolicy` decides what happens with messages which don't fit anymore.
+"""
+import time
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Callable, Deque, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+import gevent
+import structlog
+from gevent.event import Event
+from raiden_common.messages.abstract import Message
+from raiden_common.utils.typing import Address
+
+from raiden_libs import metrics
+
+log = structlog.get_logger(__name__)
+
+
+class CoalesceKey(NamedTuple):
+    key: Hashable
+    # Increases for newer messages with the same key, like a nonce or timestamp
+    order: Any
+
+
+# Returns the key used for coalescing or `None` if the message can't be coalesced
+CoalesceKeyFunc = Callable[[Message], Optional[CoalesceKey]]
+
+
+class OverflowPolicy(Enum):
+    # Wait until there is space in the queue, which pauses the matrix sync
+    BLOCK = "block"
+    # Drop the oldest message in the queue
+    DROP_OLDEST = "drop-oldest"
+    # Keep only the newest of the queued messages from the same sender and
+    # with the same coalesce key, drop the oldest message if this is not possible
+    COALESCE = "coalesce"
+
+
+@dataclass
+class QueueItem:
+    message: Message
+    enqueued_at: float
+    key: Optional[Hashable] = None
+    order: Any = None
+
+
+class MessageQueue:
+    """Queue of received messages which are handled in batches by worker greenlets"""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        handle_messages: Callable[[List[Message]], None],
+        max_size: int,
+        overflow_policy: OverflowPolicy,
+        coalesce_key: Optional[CoalesceKeyFunc] = None,
+        max_batch_size: int = 1000,
+    ):
+        assert max_size > 0
+        self.handle_messages = handle_messages
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.coalesce_key = coalesce_key
+        self.max_batch_size = max_batch_size
+
+        self._items: Deque[QueueItem] = deque()
+        self._items_by_key: Dict[Hashable, QueueItem] = {}
+        self._not_empty = Event()
+        self._not_full = Event()
+        self._not_full.set()
+
+        metrics.MESSAGE_QUEUE_SIZE.set_function(lambda: len(self._items))
+        metrics.MESSAGE_QUEUE_OLDEST_AGE.set_function(self.oldest_age)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def oldest_age(self) -> float:
+        """Seconds since the oldest queued message has been received"""
+        if not self._items:
+            return 0.0
+        return time.monotonic() - self._items[0].enqueued_at
+
+    def put(self, messages: List[Tuple[Address, Message]]) -> None:
+        """Adds messages together with their (already verified) senders
+
+        Only blocks if the queue is full and the `OverflowPolicy.BLOCK` is used.
+        """
+        for sender, message in messages:
+            key = order = None
+            if self.overflow_policy == OverflowPolicy.COALESCE and self.coalesce_key:
+                coalesce_key = self.coalesce_key(message)
+                if coalesce_key is not None:
+                    key = (sender, coalesce_key.key)
+                    order = coalesce_key.order
+
+            queued_item = self._items_by_key.get(key) if key is not None else None
+            if queued_item is not None:
+                # Messages can arrive out of order, so only newer ones replace
+                # the queued message. Keep the position in the queue, so that
+                # coalescing doesn't delay messages which are updated frequently.
+                if order > queued_item.order:
+                    queued_item.message = message
+                    queued_item.order = order
+                metrics.get_metrics_for_label(
+                    metrics.MESSAGES_DISCARDED, metrics.DiscardReason.COALESCED
+                ).inc()
+                continue
+
+            while len(self._items) >= self.max_size:
+                if self.overflow_policy == OverflowPolicy.BLOCK:
+                    self._not_full.clear()
+                    self._not_full.wait()
+                else:
+                    self._drop_oldest()
+
+            item = QueueItem(message=message, enqueued_at=time.monotonic(), key=key, order=order)
+            self._items.append(item)
+            if key is not None:
+                self._items_by_key[key] = item
+            self._not_empty.set()
+
+    def _drop_oldest(self) -> None:
+        item = self._items.popleft()
+        if item.key is not None:
+            del self._items_by_key[item.key]
+        log.warning("Message queue is full, dropping message", message=item.message)
+        metrics.get_metrics_for_label(
+            metrics.MESSAGES_DISCARDED, metrics.DiscardReason.DROPPED
+        ).inc()
+
+    def _take_batch(self) -> List[Message]:
+        batch: List[Message] = []
+        while self._items and len(batch) < self.max_batch_size:
+            item = self._items.popleft()
+            if item.key is not None:
+                del self._items_by_key[item.key]
+            batch.append(item.message)
+
+        if not self._items:
+            self._not_empty.clear()
+        self._not_full.set()
+        return batch
+
+    def run_worker(self) -> None:
+        """Handles queued messages until the greenlet is killed"""
+        while True:
+            self._not_empty.wait()
+            batch = self._take_batch()
+            if batch:
+                self.handle_messages(batch)
+                # Give the other greenlets a chance to run between batches
+                gevent.idle()
@@ -2,7 +2,7 @@ from contextlib import contextmanager
 from enum import Enum, unique
 from typing import Dict, Generator, Tuple, cast
 
-from prometheus_client import CollectorRegistry, Counter, Histogram, Metric
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, Metric
 from prometheus_client.context_managers import ExceptionCounter, Timer
 
 from raiden_common.messages.abstract import Message
@@ -74,6 +74,41 @@ MESSAGES_PROCESSING_TIME = Histogram(
 )
 
 
+MESSAGE_QUEUE_SIZE = Gauge(
+    "messages_queue_size",
+    "The number of received messages waiting to be handled",
+    registry=REGISTRY,
+)
+
+
+MESSAGE_QUEUE_OLDEST_AGE = Gauge(
+    "messages_queue_oldest_age_seconds",
+    "The time the oldest message in the queue has been waiting to be handled",
+    registry=REGISTRY,
+)
+
+
+class DiscardReason(MetricsEnum):
+    COALESCED = "coalesced"
+    DROPPED = "dropped"
+
+
+MESSAGES_DISCARDED = Counter(
+    "messages_queue_discarded_total",
+    "The number of queued messages which were replaced by newer ones or dropped",
+    labelnames=[DiscardReason.label_name()],
+    registry=REGISTRY,
+)
+
+
+MESSAGES_RATE_LIMITED_BYTES = Counter(
+    "messages_rate_limited_bytes_total",
+    "The number of received bytes which were dropped due to rate limiting",
+    labelnames=["budget"],
+    registry=REGISTRY,
+)
+
+
 @contextmanager
 def collect_event_metrics(event: Event) -> MetricsGenerator:
     event_type = event.__class__.__name__
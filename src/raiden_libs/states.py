@@ -13,4 +13,5 @@ class BlockchainState:
     token_network_registry_address: Address
     latest_committed_block: BlockNumber
     monitor_contract_address: Optional[Address] = None
+    user_deposit_contract_address: Optional[Address] = None
     current_event_filter_interval: BlockTimeout = DEFAULT_FILTER_INTERVAL
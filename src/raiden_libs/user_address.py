@@ -427,9 +427,17 @@ class MultiClientUserAddressManager(UserAddressManager):
         self,
         client: GMatrixClient,
         displayname_cache: DisplayNameCache,
+        address_reachability_changed_callback: Callable[
+            [Address, AddressReachability], None
+        ] = noop_reachability,
         _log_context: Optional[Dict[str, Any]] = None,
     ) -> None:
-        super().__init__(client, displayname_cache, noop_reachability, _log_context=_log_context)
+        super().__init__(
+            client,
+            displayname_cache,
+            address_reachability_changed_callback,
+            _log_context=_log_context,
+        )
         self.server_url_to_listener_id: Dict[str, UUID] = {}
 
     def start(self) -> None:
@@ -8,13 +8,14 @@ from typing import List
 
 import click
 import structlog
-from raiden_common.utils.cli import ChainChoiceType
+from raiden_common.utils.cli import ChainChoiceType, EnumChoiceType
 
 from monitoring_service.constants import MS_DISCLAIMER
 from monitoring_service.database import SharedDatabase
 from raiden_contracts.utils.type_aliases import PrivateKey
 from raiden_libs.cli import common_options, setup_sentry
 from raiden_libs.constants import CONFIRMATION_OF_UNDERSTANDING
+from raiden_libs.message_queue import OverflowPolicy
 from request_collector.server import RequestCollector
 
 log = structlog.get_logger(__name__)
@@ -50,9 +51,36 @@ log = structlog.get_logger(__name__)
     help="Bypass the experimental software disclaimer prompt",
     is_flag=True,
 )
+@click.option(
+    "--deserialization-workers",
+    default=0,
+    type=click.IntRange(min=0),
+    help="Number of worker processes used to deserialize incoming messages and recover "
+    "their signers. If 0, messages are deserialized in the main process.",
+)
+@click.option(
+    "--message-queue-size",
+    default=0,
+    type=click.IntRange(min=0),
+    help="Maximum number of received messages waiting to be handled. "
+    "If 0, messages are handled directly while syncing with the matrix server.",
+)
+@click.option(
+    "--message-overflow-policy",
+    default=OverflowPolicy.COALESCE.value,
+    show_default=True,
+    type=EnumChoiceType(OverflowPolicy),
+    help="How new messages are handled when the message queue is full.",
+)
 @common_options("raiden-monitoring-service")
 def main(
-    private_key: PrivateKey, state_db: str, matrix_server: List[str], accept_disclaimer: bool
+    private_key: PrivateKey,
+    state_db: str,
+    matrix_server: List[str],
+    accept_disclaimer: bool,
+    deserialization_workers: int,
+    message_queue_size: int,
+    message_overflow_policy: OverflowPolicy,
 ) -> int:
     """The request collector for the monitoring service."""
     log.info("Starting Raiden Monitoring Request Collector")
@@ -69,7 +97,12 @@ def main(
     database = SharedDatabase(state_db)
 
     service = RequestCollector(
-        private_key=private_key, state_db=database, matrix_servers=matrix_server
+        private_key=private_key,
+        state_db=database,
+        matrix_servers=matrix_server,
+        deserialization_workers=deserialization_workers,
+        message_queue_size=message_queue_size,
+        message_overflow_policy=message_overflow_policy,
     )
 
     service.start()
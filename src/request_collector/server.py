@@ -18,16 +18,33 @@ from monitoring_service.states import MonitorRequest
 from raiden_contracts.utils.type_aliases import PrivateKey
 from raiden_libs.constants import MATRIX_START_TIMEOUT
 from raiden_libs.matrix import MatrixListener
+from raiden_libs.message_queue import CoalesceKey, OverflowPolicy
 
 log = structlog.get_logger(__name__)
 
 
+def monitor_request_coalesce_key(message: Message) -> Optional[CoalesceKey]:
+    """Queued monitoring requests are superseded by newer ones for the same channel"""
+    if isinstance(message, RequestMonitoring):
+        return CoalesceKey(
+            key=(
+                message.balance_proof.token_network_address,
+                message.balance_proof.channel_identifier,
+            ),
+            order=message.balance_proof.nonce,
+        )
+    return None
+
+
 class RequestCollector(gevent.Greenlet):
     def __init__(
         self,
         private_key: PrivateKey,
         state_db: SharedDatabase,
         matrix_servers: Optional[List[str]] = None,
+        deserialization_workers: int = 0,
+        message_queue_size: int = 0,
+        message_overflow_policy: OverflowPolicy = OverflowPolicy.COALESCE,
     ):
         super().__init__()
 
@@ -41,6 +58,11 @@ class RequestCollector(gevent.Greenlet):
             chain_id=self.chain_id,
             device_id=DeviceIDs.MS,
             message_received_callback=self.handle_message,
+            message_batch_received_callback=self.handle_messages,
+            deserialization_workers=deserialization_workers,
+            message_queue_size=message_queue_size,
+            overflow_policy=message_overflow_policy,
+            coalesce_key=monitor_request_coalesce_key,
             servers=matrix_servers,
         )
 
@@ -59,6 +81,12 @@ class RequestCollector(gevent.Greenlet):
         self.matrix_listener.stop()
         self.matrix_listener.get()
 
+    def handle_messages(self, messages: List[Message]) -> None:
+        """Handles all messages received in a single matrix sync in one transaction"""
+        with self.state_db.transaction():
+            for message in messages:
+                self.handle_message(message)
+
     def handle_message(self, message: Message) -> None:
         with configure_scope() as scope:
             scope.set_extra("message", message)
@@ -54,6 +54,7 @@ def mockchain(monkeypatch):
         blockchain_state: BlockchainState,
         token_network_addresses: List[TokenNetworkAddress],
         latest_confirmed_block: BlockNumber,
+        handled_event_types=None,
     ):  # pylint: disable=unused-argument
         blocks = state["block_events"][
             blockchain_state.latest_committed_block : latest_confirmed_block + 1
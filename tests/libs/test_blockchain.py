@@ -1,21 +1,29 @@
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 import eth_tester
 import pytest
-from eth_utils import to_canonical_address
-from raiden_common.utils.typing import Address, BlockNumber, ChainID
+from eth_utils import to_canonical_address, to_checksum_address
+from raiden_common.utils.typing import Address, BlockNumber, ChainID, TokenNetworkAddress
 from requests.exceptions import ReadTimeout
 from web3 import Web3
 from web3.contract import Contract
 
 from monitoring_service.constants import DEFAULT_FILTER_INTERVAL
-from raiden_contracts.constants import EVENT_TOKEN_NETWORK_CREATED
+from raiden_contracts.constants import EVENT_TOKEN_NETWORK_CREATED, ChannelEvent
 from raiden_libs.blockchain import (
+    UDCBalanceCache,
     get_blockchain_events,
     get_blockchain_events_adaptive,
+    get_event_topics,
     get_pessimistic_udc_balance,
     query_blockchain_events,
 )
+from raiden_libs.events import (
+    ReceiveChannelOpenedEvent,
+    ReceiveTokenNetworkCreatedEvent,
+    ReceiveUserDepositBalanceChangedEvent,
+    UpdatedHeadBlockEvent,
+)
 from raiden_libs.states import BlockchainState
 
 
@@ -31,6 +39,23 @@ def create_tnr_contract_events_query(web3: Web3, contract_address: Address):
     return query_callback
 
 
+@pytest.mark.usefixtures("token_network")
+def test_query_blockchain_events_with_topics(web3: Web3, token_network_registry_contract):
+    def query(topics):
+        return query_blockchain_events(
+            web3=web3,
+            contract_addresses=[token_network_registry_contract.address],
+            from_block=BlockNumber(0),
+            to_block=web3.eth.block_number,
+            topics=topics,
+        )
+
+    all_events = query(topics=None)
+    assert len(all_events) == 1
+    assert query(topics=get_event_topics([ReceiveTokenNetworkCreatedEvent])) == all_events
+    assert query(topics=get_event_topics([ReceiveChannelOpenedEvent])) == []
+
+
 @pytest.mark.usefixtures("token_network")
 def test_limit_inclusivity_in_query_blockchain_events(
     web3: Web3, wait_for_blocks, token_network_registry_contract
@@ -125,6 +150,42 @@ def test_get_pessimistic_udc_balance(user_deposit_contract, web3, deposit_to_udc
         deposit(0, 7)
 
 
+def test_udc_balance_cache():
+    udc = Mock()
+    effective_balance = udc.functions.effectiveBalance.return_value.call
+    effective_balance.return_value = 10
+    cache = UDCBalanceCache(udc)
+    address = Address(bytes([1] * 20))
+
+    def balance(to_block):
+        return cache.get_pessimistic_balance(address, BlockNumber(to_block - 5), to_block)
+
+    assert balance(10) == 10
+    assert effective_balance.call_count == 2
+    assert balance(10) == 10
+    assert effective_balance.call_count == 2
+
+    # Later blocks can only use the cache after the events have been handled
+    assert balance(11) == 10
+    assert effective_balance.call_count == 4
+    effective_balance.return_value = 20
+    cache.set_events_handled_until(BlockNumber(20))
+    assert balance(20) == 10
+    assert effective_balance.call_count == 4
+
+    # UserDeposit events invalidate the cached balance
+    cache.invalidate(address, BlockNumber(20))
+    assert balance(20) == 20
+    assert effective_balance.call_count == 6
+
+    # Balances from before the latest event are not cached
+    cache.invalidate(Address(bytes([2] * 20)), BlockNumber(30))
+    cache.invalidate(address, BlockNumber(30))
+    balance(25)
+    balance(25)
+    assert effective_balance.call_count == 10
+
+
 def test_get_blockchain_events_returns_early_for_invalid_interval(
     web3: Web3, token_network_registry_contract: Contract
 ):
@@ -145,6 +206,76 @@ def test_get_blockchain_events_returns_early_for_invalid_interval(
     assert len(events) == 0
 
 
+def test_get_blockchain_events_merges_concurrent_queries():
+    registry = Address(bytes([1] * 20))
+    known_token_network = TokenNetworkAddress(bytes([2] * 20))
+    new_token_network = TokenNetworkAddress(bytes([3] * 20))
+    user_deposit = Address(bytes([4] * 20))
+    participant = to_checksum_address(bytes([5] * 20))
+
+    def channel_opened(token_network_address, block_number, log_index):
+        return dict(
+            event=ChannelEvent.OPENED,
+            address=to_checksum_address(token_network_address),
+            blockNumber=block_number,
+            logIndex=log_index,
+            args=dict(channel_identifier=1, participant1=participant, participant2=participant),
+        )
+
+    events_by_address = {
+        registry: [
+            dict(
+                event=EVENT_TOKEN_NETWORK_CREATED,
+                blockNumber=2,
+                logIndex=0,
+                args=dict(
+                    token_network_address=to_checksum_address(new_token_network),
+                    token_address=participant,
+                    settle_timeout=100,
+                ),
+            )
+        ],
+        known_token_network: [channel_opened(known_token_network, 3, 1)],
+        new_token_network: [channel_opened(new_token_network, 3, 0)],
+        user_deposit: [
+            dict(event="NewDeposit", blockNumber=1, logIndex=0, args=dict(beneficiary=participant))
+        ],
+    }
+
+    def query(contract_addresses, **_kwargs):
+        return [event for address in contract_addresses for event in events_by_address[address]]
+
+    token_network_addresses = [known_token_network]
+    with patch("raiden_libs.blockchain.query_blockchain_events", side_effect=query):
+        events = get_blockchain_events(
+            web3=Mock(),
+            token_network_addresses=token_network_addresses,
+            chain_state=BlockchainState(
+                chain_id=ChainID(1),
+                token_network_registry_address=registry,
+                latest_committed_block=BlockNumber(0),
+                user_deposit_contract_address=user_deposit,
+            ),
+            from_block=BlockNumber(1),
+            to_block=BlockNumber(3),
+        )
+
+    # Events of the new token network are included and all events are
+    # ordered by block number and log index
+    assert [type(event) for event in events] == [
+        ReceiveUserDepositBalanceChangedEvent,
+        ReceiveTokenNetworkCreatedEvent,
+        ReceiveChannelOpenedEvent,
+        ReceiveChannelOpenedEvent,
+        UpdatedHeadBlockEvent,
+    ]
+    assert [event.token_network_address for event in events[2:4]] == [  # type: ignore
+        new_token_network,
+        known_token_network,
+    ]
+    assert token_network_addresses == [known_token_network, new_token_network]
+
+
 def test_get_blockchain_events_adaptive_reduces_block_interval_after_timeout(
     web3: Web3, token_network_registry_contract: Contract
 ):
@@ -2,7 +2,6 @@
 import itertools
 import json
 import sys
-import time
 from datetime import datetime, timedelta, timezone
 from unittest import mock
 from unittest.mock import Mock, patch
@@ -28,6 +27,7 @@ from raiden_common.utils.typing import (
     TokenNetworkAddress,
 )
 
+from monitoring_service.constants import MATRIX_UNKNOWN_MESSAGE_TYPE
 from monitoring_service.states import HashedBalanceProof
 from raiden_contracts.tests.utils import LOCKSROOT_OF_NO_LOCKS, deepcopy
 from raiden_libs.matrix import (
@@ -36,6 +36,7 @@ from raiden_libs.matrix import (
     RateLimiter,
     deserialize_messages,
     matrix_http_retry_delay,
+    peek_message_type,
 )
 from raiden_libs.user_address import MultiClientUserAddressManager
 from tests.constants import TEST_CHAIN_ID
@@ -175,17 +176,48 @@ def test_deserialize_messages_that_is_too_big(request_monitoring_message, capsys
 
 
 def test_rate_limiter():
-    limiter = RateLimiter(allowed_bytes=100, reset_interval=timedelta(seconds=0.1))
+    limiter = RateLimiter(allowed_bytes=100, reset_interval=timedelta(seconds=10))
     sender = Address(b"1" * 20)
-    for _ in range(50):
-        assert limiter.check_and_count(sender=sender, added_bytes=2)
+    with patch("raiden_libs.matrix.time") as time_mock:
+        time_mock.monotonic.return_value = 0
+        for _ in range(50):
+            assert limiter.check_and_count(sender=sender, added_bytes=2)
+        assert not limiter.check_and_count(sender=sender, added_bytes=2)
+
+        # The bucket is refilled continuously
+        time_mock.monotonic.return_value = 1
+        assert limiter.check_and_count(sender=sender, added_bytes=10)
+        assert not limiter.check_and_count(sender=sender, added_bytes=2)
+
+        # But never beyond the allowed bytes
+        time_mock.monotonic.return_value = 100
+        assert limiter.check_and_count(sender=sender, added_bytes=100)
+        assert not limiter.check_and_count(sender=sender, added_bytes=2)
+
+
+def test_rate_limiter_senders_and_message_types(request_monitoring_message):
+    limiter = RateLimiter(
+        allowed_bytes=100,
+        reset_interval=timedelta(seconds=10),
+        max_senders=2,
+        message_type_budgets={"RequestMonitoring": 10},
+    )
+    sender1, sender2, sender3 = [Address(bytes([i] * 20)) for i in range(1, 4)]
+
+    assert peek_message_type(MessageSerializer.serialize(request_monitoring_message)) == (
+        "RequestMonitoring"
+    )
+    assert peek_message_type("garbage") == MATRIX_UNKNOWN_MESSAGE_TYPE
 
-    assert not limiter.check_and_count(sender=sender, added_bytes=2)
-    limiter.reset_if_it_is_time()
-    assert not limiter.check_and_count(sender=sender, added_bytes=2)
-    time.sleep(0.1)
-    limiter.reset_if_it_is_time()
-    assert limiter.check_and_count(sender=sender, added_bytes=2)
+    assert limiter.check_and_count(sender1, 10, "RequestMonitoring")
+    assert not limiter.check_and_count(sender1, 10, "RequestMonitoring")
+    assert limiter.check_and_count(sender1, 10, "PFSCapacityUpdate")
+
+    # Only the most recently seen senders are tracked
+    assert limiter.check_and_count(sender2, 100)
+    assert limiter.check_and_count(sender3, 100)
+    assert list(limiter._buckets) == [sender2, sender3]  # pylint: disable=protected-access
+    assert limiter.check_and_count(sender1, 10, "RequestMonitoring")
 
 
 def test_matrix_listener_smoke_test(get_accounts, get_private_key):
@@ -209,6 +241,77 @@ def test_matrix_listener_smoke_test(get_accounts, get_private_key):
     assert listener.startup_finished.done()
 
 
+def test_matrix_listener_batch_callback(get_accounts, get_private_key):
+    (c1,) = get_accounts(1)
+    client_mock = Mock()
+    client_mock.api.base_url = "http://example.com"
+    client_mock.user_id = "1"
+    message_received_callback = Mock()
+    message_batch_received_callback = Mock()
+
+    with patch.multiple(
+        "raiden_libs.matrix",
+        make_client=Mock(return_value=client_mock),
+    ):
+        listener = MatrixListener(
+            private_key=get_private_key(c1),
+            chain_id=ChainID(TEST_CHAIN_ID),
+            device_id=DeviceIDs.PFS,
+            message_received_callback=message_received_callback,
+            message_batch_received_callback=message_batch_received_callback,
+        )
+
+    def deserialize_payloads(payloads):
+        # Each matrix message contains two raiden messages
+        return [payload for payload in payloads for _ in range(2)]
+
+    with patch.multiple(
+        listener,
+        _get_payload=Mock(side_effect=lambda m: m),
+        _deserialize_payloads=Mock(side_effect=deserialize_payloads),
+    ):
+        listener._handle_matrix_sync([1, 2])  # pylint: disable=protected-access
+        listener._handle_matrix_sync([])  # pylint: disable=protected-access
+
+    message_batch_received_callback.assert_called_once_with([1, 1, 2, 2])
+    message_received_callback.assert_not_called()
+
+
+def test_matrix_listener_deserialization_workers(
+    get_accounts, get_private_key, request_monitoring_message
+):
+    (c1,) = get_accounts(1)
+    client_mock = Mock()
+    client_mock.api.base_url = "http://example.com"
+    client_mock.user_id = "1"
+
+    with patch.multiple(
+        "raiden_libs.matrix",
+        make_client=Mock(return_value=client_mock),
+    ):
+        listener = MatrixListener(
+            private_key=get_private_key(c1),
+            chain_id=ChainID(TEST_CHAIN_ID),
+            device_id=DeviceIDs.PFS,
+            message_received_callback=lambda _: None,
+            deserialization_workers=2,
+        )
+
+    message = MessageSerializer.serialize(request_monitoring_message)
+    sender = request_monitoring_message.sender
+    payloads = [
+        (message, sender),
+        (message, INVALID_PEER_ADDRESS),
+        (message + "\n" + message, sender),
+    ]
+    try:
+        messages = listener._deserialize_payloads(payloads)  # pylint: disable=protected-access
+    finally:
+        listener._deserialization_pool.shutdown()  # pylint: disable=protected-access
+
+    assert messages == [(sender, request_monitoring_message)] * 3
+
+
 @pytest.mark.parametrize("server_index", [0, 1, 2, 3, 4])
 def test_filter_presences_by_client(presence_event, server_index):
 
@@ -0,0 +1,74 @@
+from typing import List
+from unittest.mock import Mock
+
+import gevent
+from raiden_common.utils.typing import Address
+
+from raiden_libs.message_queue import CoalesceKey, MessageQueue, OverflowPolicy
+
+SENDER1 = Address(bytes([1] * 20))
+SENDER2 = Address(bytes([2] * 20))
+
+
+def test_drop_oldest():
+    messages = [Mock() for _ in range(3)]
+    queue = MessageQueue(
+        handle_messages=Mock(), max_size=2, overflow_policy=OverflowPolicy.DROP_OLDEST
+    )
+    queue.put([(SENDER1, message) for message in messages])
+
+    assert len(queue) == 2
+    assert queue._take_batch() == messages[1:]  # pylint: disable=protected-access
+    assert queue.oldest_age() == 0
+
+
+def test_coalesce():
+    a1, b1, a3, a2, a4, x1 = [
+        Mock(key=key, nonce=nonce)
+        for key, nonce in (("a", 1), ("b", 1), ("a", 3), ("a", 2), ("a", 4), (None, 1))
+    ]
+    queue = MessageQueue(
+        handle_messages=Mock(),
+        max_size=3,
+        overflow_policy=OverflowPolicy.COALESCE,
+        coalesce_key=lambda message: (
+            CoalesceKey(key=message.key, order=message.nonce) if message.key else None
+        ),
+    )
+    queue.put(
+        [
+            (SENDER1, a1),
+            (SENDER1, b1),
+            (SENDER1, a3),  # replaces a1
+            (SENDER1, a2),  # older than a3, so it is discarded
+            (SENDER2, a4),  # different sender, so not coalesced
+            (SENDER1, x1),  # queue is full, drops the oldest message
+        ]
+    )
+
+    assert queue._take_batch() == [b1, a4, x1]  # pylint: disable=protected-access
+
+
+def test_block_and_worker():
+    messages = [Mock() for _ in range(5)]
+    handled: List[Mock] = []
+    queue = MessageQueue(
+        handle_messages=handled.extend, max_size=2, overflow_policy=OverflowPolicy.BLOCK
+    )
+
+    producer = gevent.spawn(queue.put, [(SENDER1, message) for message in messages])
+    gevent.sleep(0.01)
+    # Without a worker, the producer waits for space in the queue
+    assert not producer.ready()
+    assert len(queue) == 2
+    assert queue.oldest_age() > 0
+
+    worker = gevent.spawn(queue.run_worker)
+    try:
+        producer.get(timeout=1)
+        gevent.sleep(0.01)
+    finally:
+        worker.kill()
+
+    assert len(queue) == 0
+    assert handled == messages
@@ -389,6 +389,104 @@ def test_get_paths(api_url: str, addresses: List[Address], token_network_model:
         assert response.json()["error_code"] == exceptions.NoRouteFound.error_code
 
 
+@pytest.mark.usefixtures("api_sut")
+def test_get_paths_batch(
+    api_url: str, addresses: List[Address], token_network_model: TokenNetwork
+):
+    hex_addrs = [to_checksum_address(addr) for addr in addresses]
+    token_network_address = to_checksum_address(token_network_model.address)
+    url = api_url + f"/v1/{token_network_address}/paths/batch"
+
+    queries = [
+        {"from": hex_addrs[0], "to": hex_addrs[2], "value": 10},
+        {"from": hex_addrs[0], "to": hex_addrs[5], "value": 10},  # no connection
+        {"from": hex_addrs[0], "to": hex_addrs[3], "value": 10, "max_paths": 1},
+    ]
+    response = requests.post(url, json={"requests": queries})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert len(results) == len(queries)
+
+    # successful entries match the results of the single path endpoint
+    for query, result in zip(queries, results):
+        single_response = requests.post(api_url + f"/v1/{token_network_address}/paths", json=query)
+        if single_response.status_code == 200:
+            assert result["result"] == single_response.json()["result"]
+            assert "feedback_token" in result
+        else:
+            assert result["error_code"] == single_response.json()["error_code"]
+    assert results[1]["error_code"] == exceptions.NoRouteFound.error_code
+
+    response = requests.post(url, json={"requests": []})
+    assert response.status_code == 400
+    assert response.json()["error_code"] == exceptions.InvalidRequest.error_code
+
+
+def test_get_paths_batch_payment(
+    api_sut: PFSApi,
+    api_url: str,
+    addresses: List[Address],
+    token_network_model: TokenNetwork,
+    make_iou: Callable,
+):
+    """The service fee must be paid for each request in the batch"""
+    hex_addrs = [to_checksum_address(addr) for addr in addresses]
+    token_network_address = to_checksum_address(token_network_model.address)
+    url = api_url + f"/v1/{token_network_address}/paths/batch"
+    queries = [
+        {"from": hex_addrs[0], "to": hex_addrs[2], "value": 10},
+        {"from": hex_addrs[0], "to": hex_addrs[3], "value": 10},
+    ]
+
+    api_sut.service_fee = TokenAmount(100)
+    sender = PrivateKey(get_random_privkey())
+    claimable_until = Timestamp(get_posix_utc_time_now() + 1_234_567)
+
+    def make_iou_dict(amount: int) -> dict:
+        iou = make_iou(
+            sender,
+            api_sut.pathfinding_service.address,
+            one_to_n_address=api_sut.one_to_n_address,
+            amount=amount,
+            claimable_until=claimable_until,
+        )
+        return iou.Schema().dump(iou)
+
+    response = requests.post(url, json={"requests": queries, "iou": make_iou_dict(100)})
+    assert response.status_code == 400
+    assert response.json()["error_code"] == exceptions.InsufficientServicePayment.error_code
+
+    response = requests.post(url, json={"requests": queries, "iou": make_iou_dict(200)})
+    assert response.status_code == 200, response.json()
+
+
+@pytest.mark.usefixtures("api_sut_with_debug")
+def test_get_paths_batch_via_debug_endpoint(
+    api_url: str, addresses: List[Address], token_network_model: TokenNetwork
+):
+    # `last_failed_requests` is a module variable, so it might have entries
+    # from tests that ran earlier.
+    last_failed_requests.clear()
+    hex_addrs = [to_checksum_address(addr) for addr in addresses]
+    token_network_address = to_checksum_address(token_network_model.address)
+
+    queries = [
+        {"from": hex_addrs[0], "to": hex_addrs[2], "value": 10},
+        {"from": hex_addrs[0], "to": hex_addrs[5], "value": 10},  # no connection
+    ]
+    response = requests.post(
+        api_url + f"/v1/{token_network_address}/paths/batch", json={"requests": queries}
+    )
+    assert response.status_code == 200
+
+    # the failed request is returned by the debug endpoint
+    response = requests.get(
+        api_url + f"/v1/_debug/routes/{token_network_address}/{hex_addrs[0]}/{hex_addrs[5]}"
+    )
+    assert response.status_code == 200
+    assert response.json()["request_count"] == 1
+
+
 def test_payment_with_new_iou_rejected(  # pylint: disable=too-many-locals
     api_sut,
     api_url: str,
@@ -583,14 +681,14 @@ def test_get_iou(api_sut: PFSApi, api_url: str, token_network_model: TokenNetwor
     assert response.status_code == 404, response.json()
     assert response.json() == {"last_iou": None}
 
-    # Add IOU to database
+    # Add IOU to the sessions
     iou = make_iou(
         privkey, api_sut.pathfinding_service.address, one_to_n_address=api_sut.one_to_n_address
     )
     iou.claimed = False
-    api_sut.pathfinding_service.database.upsert_iou(iou)
+    api_sut.pathfinding_service.iou_sessions.store(iou)
 
-    # Is returned IOU the one save into the db?
+    # Is returned IOU the one saved in the sessions?
     response = requests.get(url, params=params)
     assert response.status_code == 200, response.json()
     iou_dict = IOU.Schema(exclude=["claimed"]).dump(iou)
@@ -673,6 +771,28 @@ def test_feedback(api_sut: PFSApi, api_url: str, token_network_model: TokenNetwo
     assert db_has_feedback_for(database, token, default_path)
 
 
+def test_feedback_for_buffered_token(
+    api_sut: PFSApi, api_url: str, addresses: List[Address], token_network_model: TokenNetwork
+):
+    hex_addrs = [to_checksum_address(addr) for addr in addresses]
+    url = api_url + "/v1/" + to_checksum_address(token_network_model.address)
+    response = requests.post(
+        url + "/paths", json={"from": hex_addrs[0], "to": hex_addrs[2], "value": 10}
+    )
+    assert response.status_code == 200
+    path = response.json()["result"][0]["path"]
+
+    # The feedback token is only written to the db on the next flush
+    assert api_sut.pathfinding_service.database.get_num_routes_feedback() == 0
+
+    response = requests.post(
+        url + "/feedback",
+        json={"token": response.json()["feedback_token"], "success": True, "path": path},
+    )
+    assert response.status_code == 200
+    assert api_sut.pathfinding_service.database.get_num_routes_feedback(only_successful=True) == 1
+
+
 def test_stats_endpoint(
     api_sut_with_debug: PFSApi, api_url: str, token_network_model: TokenNetwork
 ):
@@ -3,6 +3,8 @@ The tests in this module mock Capacity Updates and call on_capacity_update().
 
 The Capacity Updates show different correct and incorrect values to test all edge cases
 """
+from unittest.mock import patch
+
 import pytest
 from eth_utils import to_canonical_address
 from raiden_common.constants import EMPTY_SIGNATURE, UINT256_MAX
@@ -311,3 +313,56 @@ def test_pfs_min_calculation_with_capacity_updates(
     # The capacities should be calculated out of the minimum of the two capacity updates
     assert view_to_partner.capacity == 90
     assert view_from_partner.capacity == 110
+
+
+def test_pfs_drops_superseded_capacity_updates(
+    pathfinding_service_web3_mock: PathfindingService,
+):
+    service = pathfinding_service_web3_mock
+    token_network = setup_channel(service)
+    service.database.upsert_token_network(
+        token_network.address, DEFAULT_TOKEN_NETWORK_SETTLE_TIMEOUT
+    )
+    view_to_partner, _ = token_network.get_channel_views_for_partner(
+        updating_participant=PRIVATE_KEY_1_ADDRESS, other_participant=PRIVATE_KEY_2_ADDRESS
+    )
+    service.handle_message(
+        get_capacity_update_message(
+            updating_participant=PRIVATE_KEY_2_ADDRESS,
+            other_participant=PRIVATE_KEY_1_ADDRESS,
+            privkey_signer=PRIVATE_KEY_2,
+            updating_capacity=TA(1000),
+            other_capacity=TA(1000),
+        )
+    )
+
+    def capacity_update(nonce: int, privkey_signer: bytes = PRIVATE_KEY_1) -> PFSCapacityUpdate:
+        return get_capacity_update_message(
+            updating_participant=PRIVATE_KEY_1_ADDRESS,
+            other_participant=PRIVATE_KEY_2_ADDRESS,
+            privkey_signer=privkey_signer,
+            updating_nonce=Nonce(nonce),
+            updating_capacity=TA(nonce * 10),
+        )
+
+    # Only the newest valid update of a batch is processed
+    with patch.object(
+        service, "on_capacity_update", wraps=service.on_capacity_update
+    ) as on_capacity_update:
+        service.handle_messages(
+            [
+                capacity_update(2),
+                capacity_update(4, privkey_signer=PRIVATE_KEY_3),
+                capacity_update(3),
+                capacity_update(1),
+            ]
+        )
+    assert on_capacity_update.call_count == 2
+    assert view_to_partner.capacity == 30
+
+    # Updates older than the last processed one are dropped
+    service.handle_message(capacity_update(2))
+    assert view_to_partner.capacity == 30
+    service.handle_message(capacity_update(3))
+    service.handle_message(capacity_update(5))
+    assert view_to_partner.capacity == 50
@@ -1,15 +1,23 @@
-from typing import List
-from unittest.mock import MagicMock, Mock
+from typing import List, Tuple
+from unittest.mock import MagicMock, Mock, patch
 
 import pytest
 from click.testing import CliRunner
-from eth_utils import decode_hex, to_canonical_address
+from eth_utils import decode_hex, encode_hex, to_canonical_address
 from raiden_common.utils.signer import LocalSigner
 from raiden_common.utils.typing import ChainID, Signature, TokenAmount
 from web3 import Web3
+from web3.exceptions import TransactionNotFound
 
 from pathfinding_service import metrics
-from pathfinding_service.claim_fees import claim_ious, get_claimable_ious, main
+from pathfinding_service.claim_fees import (
+    RECEIPT_MISSING_MAX_POLLS,
+    claim_function,
+    claim_ious,
+    get_claimable_ious,
+    main,
+)
+from pathfinding_service.database import PFSDatabase
 from pathfinding_service.model import IOU
 from pathfinding_service.service import PathfindingService
 from tests.constants import TEST_CHAIN_ID
@@ -52,6 +60,7 @@ def test_metrics_iou(  # pylint: disable=too-many-locals
         one_to_n_contract=one_to_n_contract,
         web3=web3,
         database=pfs.database,
+        claimer=decode_hex(web3.eth.accounts[0]),
     )
     assert (skipped, failures) == (0, 0)
 
@@ -142,6 +151,7 @@ def test_claim_fees(  # pylint: disable=too-many-locals
         one_to_n_contract=one_to_n_contract,
         web3=web3,
         database=pfs.database,
+        claimer=decode_hex(web3.eth.accounts[0]),
     )
     assert (skipped, failures) == (2, 0)
 
@@ -161,6 +171,171 @@ def test_claim_fees(  # pylint: disable=too-many-locals
         assert is_settled == expected_claimed
 
 
+def test_claim_fees_resumes_pending_claims(
+    pathfinding_service_web3_mock: PathfindingService,
+    one_to_n_contract,
+    web3: Web3,
+    deposit_to_udc,
+    get_accounts,
+    get_private_key,
+):
+    pfs = pathfinding_service_web3_mock
+
+    account = [decode_hex(acc) for acc in get_accounts(1)][0]
+    local_signer = LocalSigner(private_key=get_private_key(account))
+    iou = IOU(
+        sender=account,
+        receiver=pfs.address,
+        amount=TokenAmount(100),
+        claimable_until=web3.eth.get_block("latest").timestamp + 100,  # type: ignore
+        signature=Signature(bytes([1] * 64)),
+        chain_id=ChainID(TEST_CHAIN_ID),
+        one_to_n_address=to_canonical_address(one_to_n_contract.address),
+        claimed=False,
+    )
+    iou.signature = Signature(local_signer.sign(iou.packed_data()))
+    pfs.database.upsert_iou(iou)
+    deposit_to_udc(iou.sender, 300)
+
+    # Claim transaction sent by an interrupted run
+    claimer = decode_hex(web3.eth.accounts[0])
+    nonce = web3.eth.get_transaction_count(web3.eth.accounts[0])
+    tx_hash = claim_function(one_to_n_contract, iou).transact({"nonce": nonce})
+    pfs.database.add_iou_claim(iou, tx_hash=encode_hex(tx_hash), nonce=nonce)
+
+    # The IOU is not claimed again, but the pending claim is confirmed
+    skipped, failures = claim_ious(
+        ious=[iou],
+        claim_cost_rdn=TokenAmount(100),
+        one_to_n_contract=one_to_n_contract,
+        web3=web3,
+        database=pfs.database,
+        claimer=claimer,
+    )
+    assert (skipped, failures) == (0, 0)
+
+    iou_in_db = pfs.database.get_iou(sender=iou.sender, claimable_until=iou.claimable_until)
+    assert iou_in_db and iou_in_db.claimed
+    assert pfs.database.get_iou_claims() == []
+
+
+def test_claim_fees_without_receipt(
+    pathfinding_service_web3_mock: PathfindingService,
+    one_to_n_contract,
+    web3: Web3,
+    deposit_to_udc,
+    get_accounts,
+    get_private_key,
+):
+    """Claims without receipt are checked on-chain before they are considered as failed"""
+    pfs = pathfinding_service_web3_mock
+
+    account = [decode_hex(acc) for acc in get_accounts(1)][0]
+    local_signer = LocalSigner(private_key=get_private_key(account))
+    iou = IOU(
+        sender=account,
+        receiver=pfs.address,
+        amount=TokenAmount(100),
+        claimable_until=web3.eth.get_block("latest").timestamp + 100,  # type: ignore
+        signature=Signature(bytes([1] * 64)),
+        chain_id=ChainID(TEST_CHAIN_ID),
+        one_to_n_address=to_canonical_address(one_to_n_contract.address),
+        claimed=False,
+    )
+    iou.signature = Signature(local_signer.sign(iou.packed_data()))
+    pfs.database.upsert_iou(iou)
+    deposit_to_udc(iou.sender, 300)
+    claimer = decode_hex(web3.eth.accounts[0])
+
+    def claim(ious: List[IOU]) -> Tuple[int, int]:
+        with patch("pathfinding_service.claim_fees.RECEIPT_POLL_MIN_INTERVAL", 0), patch(
+            "pathfinding_service.claim_fees.RECEIPT_POLL_MAX_INTERVAL", 0
+        ):
+            return claim_ious(
+                ious=ious,
+                claim_cost_rdn=TokenAmount(100),
+                one_to_n_contract=one_to_n_contract,
+                web3=web3,
+                database=pfs.database,
+                claimer=claimer,
+            )
+
+    # The nonce of a stored claim has been used by another transaction
+    nonce = web3.eth.get_transaction_count(web3.eth.accounts[0])
+    web3.eth.send_transaction(
+        {"from": web3.eth.accounts[0], "to": web3.eth.accounts[0], "value": 0, "nonce": nonce}
+    )
+    pfs.database.add_iou_claim(iou, tx_hash=encode_hex(bytes(32)), nonce=nonce)
+    with patch.object(
+        web3.eth, "get_transaction_receipt", wraps=web3.eth.get_transaction_receipt
+    ) as get_receipt:
+        assert claim([]) == (0, 1)
+    assert get_receipt.call_count == RECEIPT_MISSING_MAX_POLLS + 1
+    assert pfs.database.get_iou_claims() == []
+    iou_in_db = pfs.database.get_iou(sender=iou.sender, claimable_until=iou.claimable_until)
+    assert iou_in_db and not iou_in_db.claimed
+
+    # The RPC node doesn't know the receipt, but the session has been settled
+    with patch.object(web3.eth, "get_transaction_receipt", side_effect=TransactionNotFound):
+        assert claim([iou]) == (0, 0)
+    assert pfs.database.get_iou_claims() == []
+    iou_in_db = pfs.database.get_iou(sender=iou.sender, claimable_until=iou.claimable_until)
+    assert iou_in_db and iou_in_db.claimed
+
+
+def test_claim_fees_with_old_db(
+    tmpdir,
+    pathfinding_service_web3_mock: PathfindingService,
+    one_to_n_contract,
+    web3: Web3,
+    deposit_to_udc,
+    get_accounts,
+    get_private_key,
+):
+    """Dbs created before the `iou_claim` table existed get it when opened"""
+    pfs = pathfinding_service_web3_mock
+    filename = str(tmpdir / "pfs.db")
+
+    def open_db() -> PFSDatabase:
+        return PFSDatabase(
+            filename=filename, chain_id=TEST_CHAIN_ID, pfs_address=pfs.address, allow_create=True
+        )
+
+    database = open_db()
+    database.conn.execute("DROP TABLE iou_claim")
+    database.conn.close()
+    database = open_db()
+
+    account = [decode_hex(acc) for acc in get_accounts(1)][0]
+    local_signer = LocalSigner(private_key=get_private_key(account))
+    iou = IOU(
+        sender=account,
+        receiver=pfs.address,
+        amount=TokenAmount(100),
+        claimable_until=web3.eth.get_block("latest").timestamp + 100,  # type: ignore
+        signature=Signature(bytes([1] * 64)),
+        chain_id=ChainID(TEST_CHAIN_ID),
+        one_to_n_address=to_canonical_address(one_to_n_contract.address),
+        claimed=False,
+    )
+    iou.signature = Signature(local_signer.sign(iou.packed_data()))
+    database.upsert_iou(iou)
+    deposit_to_udc(iou.sender, 300)
+
+    skipped, failures = claim_ious(
+        ious=[iou],
+        claim_cost_rdn=TokenAmount(100),
+        one_to_n_contract=one_to_n_contract,
+        web3=web3,
+        database=database,
+        claimer=decode_hex(web3.eth.accounts[0]),
+    )
+    assert (skipped, failures) == (0, 0)
+
+    iou_in_db = database.get_iou(sender=iou.sender, claimable_until=iou.claimable_until)
+    assert iou_in_db and iou_in_db.claimed
+
+
 @pytest.fixture
 def mock_connect_to_blockchain(monkeypatch):
     web3_mock = Web3Mock()
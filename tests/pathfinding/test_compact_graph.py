@@ -0,0 +1,67 @@
+from typing import List
+
+from raiden_common.utils.typing import Address, ChannelID, TokenNetworkAddress
+
+from pathfinding_service.model.channel import Channel, ChannelView
+from pathfinding_service.model.compact_graph import NO_EDGE, CompactGraph
+
+
+def make_channel(channel_id: int, participant1: Address, participant2: Address) -> Channel:
+    return Channel(
+        token_network_address=TokenNetworkAddress(bytes([1] * 20)),
+        channel_id=ChannelID(channel_id),
+        participant1=participant1,
+        participant2=participant2,
+    )
+
+
+def add_channel(graph: CompactGraph, channel: Channel) -> List[ChannelView]:
+    views = channel.views
+    for view in views:
+        graph.add_edge(view.participant1, view.participant2, view=view)
+    return views
+
+
+def test_add_and_remove_edges(addresses):
+    graph = CompactGraph()
+    views = add_channel(graph, make_channel(1, addresses[0], addresses[1]))
+
+    assert graph.nodes == addresses[:2]
+    assert graph.number_of_edges() == 2
+    assert graph[addresses[0]][addresses[1]]["view"] is views[0]
+    assert graph[addresses[1]][addresses[0]]["view"] is views[1]
+    slot = graph.edge_slot(addresses[0], addresses[1])
+    assert graph.edge_reverse[slot] == graph.edge_slot(addresses[1], addresses[0])
+    assert graph.out_views(addresses[0]) == [views[0]]
+    assert graph.in_views(addresses[0]) == [views[1]]
+
+    graph.remove_edge(addresses[0], addresses[1])
+    graph.remove_edge(addresses[1], addresses[0])
+    assert graph.number_of_edges() == 0
+    assert graph.edge_slot(addresses[0], addresses[1]) == NO_EDGE
+    assert graph.out_views(addresses[0]) == []
+    # nodes are kept, like in networkx
+    assert graph.nodes == addresses[:2]
+
+    # the slots of removed edges are reused
+    add_channel(graph, make_channel(2, addresses[1], addresses[2]))
+    assert graph.number_of_slots == 2
+    assert graph.number_of_edges() == 2
+    assert graph.has_path(addresses[1], addresses[2])
+    assert not graph.has_path(addresses[0], addresses[2])
+
+
+def test_shortest_simple_paths(addresses):
+    graph = CompactGraph()
+    # 0 - 1 - 2 - 3 and a shortcut 1 - 3
+    for channel_id, (p1, p2) in enumerate([(0, 1), (1, 2), (2, 3), (1, 3)]):
+        add_channel(graph, make_channel(channel_id, addresses[p1], addresses[p2]))
+    weights = [1.0] * graph.number_of_slots
+    usable_edges = [1] * graph.number_of_slots
+
+    paths = list(graph.shortest_simple_paths(0, 3, weights, usable_edges))
+    assert paths == [[0, 1, 3], [0, 1, 2, 3]]
+
+    # unusable edges are skipped
+    usable_edges[graph.edge_slot_by_id(1, 2)] = 0
+    assert list(graph.shortest_simple_paths(0, 3, weights, usable_edges)) == [[0, 1, 3]]
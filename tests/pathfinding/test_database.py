@@ -1,8 +1,9 @@
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List
 from uuid import uuid4
 
+import pytest
 from raiden_common.constants import EMPTY_SIGNATURE
 from raiden_common.messages.path_finding_service import PFSCapacityUpdate, PFSFeeUpdate
 from raiden_common.tests.utils.factories import (
@@ -196,7 +197,7 @@ def test_waiting_messages(pathfinding_service_mock):
     capacity_update.sign(LocalSigner(participant1_privkey))
 
     for message in (fee_update, capacity_update):
-        database.insert_waiting_message(message)
+        database.insert_waiting_messages([(datetime.utcnow(), message)], max_per_channel=10)
 
         recovered_messages = list(
             database.pop_waiting_messages(
@@ -213,6 +214,23 @@ def test_waiting_messages(pathfinding_service_mock):
         )
         assert len(recovered_messages2) == 0
 
+    # Only the newest messages are kept per channel
+    now = datetime.utcnow()
+    database.insert_waiting_messages(
+        [(now - timedelta(hours=2), fee_update), (now - timedelta(hours=1), capacity_update)],
+        max_per_channel=1,
+    )
+    assert database.pop_waiting_messages(token_network_address, channel_id) == [capacity_update]
+
+    # Expired messages are not returned and can be deleted without a ChannelOpened
+    database.insert_waiting_messages([(now - timedelta(hours=2), fee_update)], max_per_channel=1)
+    assert database.delete_expired_waiting_messages(added_before=now - timedelta(hours=3)) == 0
+    assert not database.pop_waiting_messages(
+        token_network_address, channel_id, added_after=now - timedelta(hours=1)
+    )
+    database.insert_waiting_messages([(now - timedelta(hours=2), fee_update)], max_per_channel=1)
+    assert database.delete_expired_waiting_messages(added_before=now - timedelta(hours=1)) == 1
+
 
 def test_channels(pathfinding_service_mock):
     # Participants need to be ordered
@@ -291,3 +309,81 @@ def test_channel_constraints(pathfinding_service_mock):
         channel1.channel_id,
         channel2.channel_id,
     ]
+
+
+def test_capacity_updates(pathfinding_service_mock):
+    database = pathfinding_service_mock.database
+    assert database.get_capacity_updates() == {}
+
+    token_network_address = make_token_network_address()
+    participant1, participant2 = make_address(), make_address()
+    capacity_updates = {
+        (token_network_address, ChannelID(1), participant1): (TokenAmount(1), TokenAmount(2)),
+        (token_network_address, ChannelID(1), participant2): (TokenAmount(2), TokenAmount(1)),
+    }
+    database.upsert_capacity_updates(capacity_updates)
+    assert database.get_capacity_updates() == capacity_updates
+
+    # Newer updates replace the old ones
+    new_capacity_update = {
+        (token_network_address, ChannelID(1), participant1): (TokenAmount(5), TokenAmount(0))
+    }
+    database.upsert_capacity_updates(new_capacity_update)
+    assert database.get_capacity_updates() == {**capacity_updates, **new_capacity_update}
+
+
+def test_transaction(pathfinding_service_mock):
+    database = pathfinding_service_mock.database
+    token_network_address1 = make_token_network_address()
+    token_network_address2 = make_token_network_address()
+
+    def stored_token_networks() -> List[TokenNetworkAddress]:
+        return [
+            tn.address
+            for tn in database.get_token_networks()
+            if tn.address in (token_network_address1, token_network_address2)
+        ]
+
+    with database.transaction():
+        database.upsert_token_network(token_network_address1, DEFAULT_TOKEN_NETWORK_SETTLE_TIMEOUT)
+    assert stored_token_networks() == [token_network_address1]
+
+    # Nested transactions are rolled back together with the outer one
+    with pytest.raises(ValueError):
+        with database.transaction():
+            with database.transaction():
+                database.upsert_token_network(
+                    token_network_address2, DEFAULT_TOKEN_NETWORK_SETTLE_TIMEOUT
+                )
+            raise ValueError()
+    assert stored_token_networks() == [token_network_address1]
+
+
+def test_schema_upgrade(tmpdir):
+    """Dbs created before an index was added get the index when they are opened"""
+    filename = str(tmpdir / "pfs.db")
+    pfs_address = make_address()
+
+    def open_db() -> PFSDatabase:
+        return PFSDatabase(
+            filename=filename,
+            chain_id=TEST_CHAIN_ID,
+            pfs_address=pfs_address,
+            allow_create=True,
+        )
+
+    def get_indexes(database: PFSDatabase) -> List[str]:
+        rows = database.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='waiting_message'"
+        )
+        return sorted(row["name"] for row in rows)
+
+    expected_indexes = ["waiting_message_added_at", "waiting_message_channel"]
+    database = open_db()
+    assert get_indexes(database) == expected_indexes
+
+    database.conn.execute("DROP INDEX waiting_message_channel")
+    database.conn.execute("DROP INDEX waiting_message_added_at")
+    database.conn.close()
+
+    assert get_indexes(open_db()) == expected_indexes
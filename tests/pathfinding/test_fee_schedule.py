@@ -1,11 +1,12 @@
 import itertools
 from datetime import datetime
-from typing import List
+from typing import Any, Dict, List
 
 import pytest
 from raiden_common.constants import EMPTY_SIGNATURE
 from raiden_common.messages.path_finding_service import PFSFeeUpdate
 from raiden_common.network.transport.matrix.utils import AddressReachability
+from raiden_common.tests.utils.mediation_fees import get_amount_with_fees
 from raiden_common.transfer.identifiers import CanonicalIdentifier
 from raiden_common.transfer.mediated_transfer.mediation_fee import (
     FeeScheduleState as RaidenFeeSchedule,
@@ -23,6 +24,7 @@ from raiden_common.utils.typing import (
 )
 
 from pathfinding_service.model import ChannelView
+from pathfinding_service.model.fees import calculate_amount_with_fees
 from pathfinding_service.model.token_network import TokenNetwork
 from tests.constants import DEFAULT_TOKEN_NETWORK_SETTLE_TIMEOUT, TEST_CHAIN_ID
 from tests.pathfinding.utils import SimpleReachabilityContainer
@@ -416,3 +418,39 @@ def test_fee_estimate(flat_fee, prop_fee_cli, max_lin_imbalance_fee, target_amou
     tn.set_fee(2, 1, flat=flat_fee, proportional=prop_fee, imbalance_penalty=imbalance_fee)
     tn.set_fee(2, 3, flat=flat_fee, proportional=prop_fee, imbalance_penalty=imbalance_fee)
     assert tn.estimate_fee(1, 3, value=PA(target_amount)) == expected_fee
+
+
+@pytest.mark.parametrize("cap_fees", [True, False])
+def test_calculate_amount_with_fees_matches_raiden(cap_fees):
+    """The cached and shortcut fee calculation must give the same results as raiden's"""
+    schedules = [
+        RaidenFeeSchedule(cap_fees=cap_fees),
+        RaidenFeeSchedule(cap_fees=cap_fees, flat=FA(10)),
+        RaidenFeeSchedule(cap_fees=cap_fees, proportional=ProportionalFeeAmount(20_000)),
+        RaidenFeeSchedule(
+            cap_fees=cap_fees,
+            imbalance_penalty=[(TA(0), FA(100)), (TA(500), FA(0)), (TA(1000), FA(100))],
+        ),
+        RaidenFeeSchedule(cap_fees=cap_fees, imbalance_penalty=[(TA(0), FA(0)), (TA(100), FA(0))]),
+    ]
+    amounts = [1, 10, 99, 100, 101, 500, 999, 1000, 1001]
+    balances = [0, 1, 100, 1000]
+    for (
+        schedule_in,
+        schedule_out,
+        amount,
+        balance_in,
+        balance_out,
+        receivable,
+    ) in itertools.product(schedules, schedules, amounts, balances, balances, balances):
+        kwargs: Dict[str, Any] = dict(
+            amount_without_fees=amount,
+            balance_in=balance_in,
+            balance_out=balance_out,
+            schedule_in=schedule_in,
+            schedule_out=schedule_out,
+            receivable_amount=receivable,
+        )
+        # Twice, to compare both the calculated and the cached result
+        assert calculate_amount_with_fees(**kwargs) == get_amount_with_fees(**kwargs)
+        assert calculate_amount_with_fees(**kwargs) == get_amount_with_fees(**kwargs)
@@ -3,7 +3,9 @@ import time
 from copy import deepcopy
 from datetime import timedelta
 from typing import List
+from unittest.mock import patch
 
+import networkx as nx
 import pytest
 from eth_utils import to_canonical_address
 from raiden_common.network.transport.matrix import AddressReachability
@@ -17,11 +19,24 @@ from raiden_common.utils.typing import (
     TokenNetworkAddress,
 )
 
+from pathfinding_service import metrics
 from pathfinding_service.constants import DIVERSITY_PEN_DEFAULT
-from pathfinding_service.model import ChannelView, TokenNetwork
+from pathfinding_service.model import ChannelView, CompactTokenNetwork, TokenNetwork
+from pathfinding_service.model.centrality import approximate_closeness_centrality
 from pathfinding_service.model.channel import Channel
+from pathfinding_service.model.token_network import Path, PathQuery
 from raiden_libs.utils import to_checksum_address
+from tests.constants import DEFAULT_TOKEN_NETWORK_SETTLE_TIMEOUT
 from tests.pathfinding.utils import SimpleReachabilityContainer
+from tests.utils import save_metrics_state
+
+
+@pytest.fixture(params=[TokenNetwork, CompactTokenNetwork], ids=["networkx", "compact"])
+def token_network_model(request) -> TokenNetwork:
+    """Run the routing tests for both graph backends"""
+    return request.param(
+        TokenNetworkAddress(bytes([1] * 20)), DEFAULT_TOKEN_NETWORK_SETTLE_TIMEOUT
+    )
 
 
 def test_edge_weight(addresses):
@@ -180,6 +195,30 @@ def test_capacity_check(
     assert index_paths == [[4, 1, 2, 0]]
 
 
+@pytest.mark.usefixtures("populate_token_network_case_1")
+def test_insufficient_capacity_is_not_searched(
+    token_network_model: TokenNetwork,
+    reachability_state: SimpleReachabilityContainer,
+    addresses: List[Address],
+):
+    """Channels which can't carry the amount must not show up in candidate paths"""
+    value = PaymentAmount(50)
+    with patch("pathfinding_service.model.token_network.Path", wraps=Path) as path_mock:
+        paths = token_network_model.get_paths(
+            source=addresses[0],
+            target=addresses[4],
+            value=value,
+            max_paths=5,
+            reachability_state=reachability_state,
+        )
+
+    assert [addresses_to_indexes(p.nodes, addresses) for p in paths] == [[0, 1, 2, 3, 4]]
+    for call in path_mock.call_args_list:
+        candidate = call.args[1]
+        for node1, node2 in zip(candidate, candidate[1:]):
+            assert token_network_model.G[node1][node2]["view"].capacity >= value
+
+
 @pytest.mark.usefixtures("populate_token_network_case_1")
 def test_routing_result_order(
     token_network_model: TokenNetwork,
@@ -283,6 +322,187 @@ def test_diversity_penalty(
     ]
 
 
+@pytest.mark.usefixtures("populate_token_network_case_3")
+def test_edge_weight_terms_calculated_once_per_request(
+    token_network_model: TokenNetwork,
+    reachability_state: SimpleReachabilityContainer,
+    addresses: List[Address],
+):
+    """The fee dependent weights must not be recalculated for every found path"""
+    with patch.object(
+        TokenNetwork, "edge_weight_terms", side_effect=TokenNetwork.edge_weight_terms
+    ) as edge_weight_terms:
+        paths = get_paths(
+            token_network_model=token_network_model,
+            reachability_state=reachability_state,
+            addresses=addresses,
+            max_paths=5,
+        )
+
+    assert len(paths) == 5
+    assert edge_weight_terms.call_count == token_network_model.G.number_of_edges()
+
+
+@pytest.mark.usefixtures("populate_token_network_case_3")
+def test_get_paths_batch(
+    token_network_model: TokenNetwork,
+    reachability_state: SimpleReachabilityContainer,
+    addresses: List[Address],
+):
+    """Batched requests return the same paths, but share the weight terms per amount"""
+    queries = [
+        PathQuery(addresses[0], addresses[8], PaymentAmount(10), 5),
+        PathQuery(addresses[1], addresses[8], PaymentAmount(10), 2),
+        PathQuery(addresses[0], addresses[4], PaymentAmount(20), 3),
+    ]
+    expected = [
+        token_network_model.get_paths(
+            source=query.source,
+            target=query.target,
+            value=query.value,
+            max_paths=query.max_paths,
+            reachability_state=reachability_state,
+        )
+        for query in queries
+    ]
+
+    with patch.object(
+        TokenNetwork, "edge_weight_terms", side_effect=TokenNetwork.edge_weight_terms
+    ) as edge_weight_terms:
+        results = token_network_model.get_paths_batch(
+            queries=queries, reachability_state=reachability_state
+        )
+
+    assert [[p.nodes for p in paths] for paths in results] == [
+        [p.nodes for p in paths] for paths in expected
+    ]
+    # once for each distinct amount
+    assert edge_weight_terms.call_count == 2 * token_network_model.G.number_of_edges()
+
+
+@pytest.mark.usefixtures("populate_token_network_case_3")
+def test_tracked_reachability(
+    token_network_model: TokenNetwork,
+    reachability_state: SimpleReachabilityContainer,
+    addresses: List[Address],
+):
+    """Routing with the incrementally pruned graph must match pruning per request"""
+    token_network_model.track_reachability(reachability_state)
+    # Sees the same reachabilities, but is not tracked by the token network
+    untracked_state = SimpleReachabilityContainer(reachability_state.reachabilities)
+
+    def set_reachability(index: int, reachability: AddressReachability) -> None:
+        reachability_state.reachabilities[addresses[index]] = reachability
+        token_network_model.handle_reachability_change(addresses[index], reachability)
+
+    def get_tracked_paths() -> List:
+        paths = get_paths(token_network_model, reachability_state, addresses)
+        assert paths == get_paths(token_network_model, untracked_state, addresses)
+        return paths
+
+    assert len(get_tracked_paths()) == 5
+
+    set_reachability(7, AddressReachability.UNREACHABLE)
+    assert get_tracked_paths() == [[0, 1, 2, 3, 4, 8]]
+
+    set_reachability(7, AddressReachability.REACHABLE)
+    assert len(get_tracked_paths()) == 5
+
+    channel_id = next(
+        channel_id
+        for channel_id, participants in token_network_model.channel_id_to_addresses.items()
+        if set(participants) == {addresses[1], addresses[2]}
+    )
+    token_network_model.handle_channel_removed_event(channel_id)
+    assert all(1 not in path for path in get_tracked_paths())
+
+
+@pytest.mark.usefixtures("populate_token_network_case_3")
+def test_route_cache(
+    token_network_model: TokenNetwork,
+    reachability_state: SimpleReachabilityContainer,
+    addresses: List[Address],
+):
+    """Cached routes are only returned while the topology is unchanged and they are valid"""
+    token_network_model.track_reachability(reachability_state)
+    metrics_state = save_metrics_state(metrics.REGISTRY)
+    view = token_network_model.G[addresses[0]][addresses[7]]["view"]
+    capacity = view.capacity
+
+    with patch.object(
+        token_network_model, "_find_paths", wraps=token_network_model._find_paths
+    ) as find_paths:
+        paths = get_paths(token_network_model, reachability_state, addresses)
+        assert get_paths(token_network_model, reachability_state, addresses) == paths
+        assert find_paths.call_count == 1
+
+        # Different request parameters are cached separately
+        get_paths(token_network_model, reachability_state, addresses, max_paths=2)
+        assert find_paths.call_count == 2
+
+        # Capacity updates which keep the cached paths valid don't cause misses
+        for new_capacity in (capacity + 1, capacity):
+            view.update_capacity(capacity=TokenAmount(new_capacity))
+            token_network_model.version += 1
+            assert get_paths(token_network_model, reachability_state, addresses) == paths
+        assert find_paths.call_count == 2
+
+        # The address metadata is looked up again for cached paths
+        with patch.object(reachability_state, "get_address_capabilities", return_value="new"):
+            cached_paths = token_network_model.get_paths(
+                source=addresses[0],
+                target=addresses[8],
+                value=PaymentAmount(10),
+                max_paths=5,
+                reachability_state=reachability_state,
+            )
+        metadata = cached_paths[0].to_dict()["address_metadata"]
+        assert metadata[to_checksum_address(addresses[0])]["capabilities"] == "new"
+        assert find_paths.call_count == 2
+
+        # A cached path which became invalid causes a miss
+        view.update_capacity(capacity=TokenAmount(0))
+        assert [0, 7, 8] not in get_paths(token_network_model, reachability_state, addresses)
+        assert find_paths.call_count == 3
+        view.update_capacity(capacity=capacity)
+
+        # Old cache entries are not used
+        with patch(
+            "pathfinding_service.model.token_network.ROUTE_CACHE_MAX_AGE", timedelta(seconds=-1)
+        ):
+            get_paths(token_network_model, reachability_state, addresses)
+        assert find_paths.call_count == 4
+
+        # Nodes going offline only invalidate the cached routes through them
+        paths = get_paths(token_network_model, reachability_state, addresses, max_paths=2)
+        offline_node = addresses[
+            next(index for index in (5, 6, 9, 10) if all(index not in path for path in paths))
+        ]
+        reachability_state.reachabilities[offline_node] = AddressReachability.UNREACHABLE
+        token_network_model.handle_reachability_change(
+            offline_node, AddressReachability.UNREACHABLE
+        )
+        assert get_paths(token_network_model, reachability_state, addresses, max_paths=2) == paths
+        assert find_paths.call_count == 4
+
+        reachability_state.reachabilities[addresses[7]] = AddressReachability.UNREACHABLE
+        token_network_model.handle_reachability_change(
+            addresses[7], AddressReachability.UNREACHABLE
+        )
+        assert get_paths(token_network_model, reachability_state, addresses) == [
+            [0, 1, 2, 3, 4, 8]
+        ]
+        assert find_paths.call_count == 5
+
+    hits = metrics_state.get_delta(
+        "routing_cache_requests_total", labels=metrics.CacheResult.HIT.to_label_dict()
+    )
+    misses = metrics_state.get_delta(
+        "routing_cache_requests_total", labels=metrics.CacheResult.MISS.to_label_dict()
+    )
+    assert (hits, misses) == (6, 5)
+
+
 @pytest.mark.usefixtures("populate_token_network_case_3")
 def test_reachability_initiator(
     token_network_model: TokenNetwork,
@@ -451,6 +671,22 @@ def test_routing_benchmark(token_network_model: TokenNetwork):  # pylint: disabl
     print("Total runtime: ", end - start)
 
 
+@pytest.mark.usefixtures("populate_token_network_case_3")
+def test_approximate_closeness_centrality(token_network_model: TokenNetwork):
+    channels = list(token_network_model.channel_id_to_addresses.values())
+    expected = nx.closeness_centrality(nx.Graph(channels))
+
+    # exact when all nodes are used as pivots
+    assert approximate_closeness_centrality(channels, samples=len(expected)) == pytest.approx(
+        expected
+    )
+
+    estimate = approximate_closeness_centrality(channels, samples=3, rng=random.Random(42))
+    assert estimate.keys() == expected.keys()
+    for node, centrality in expected.items():
+        assert estimate[node] == pytest.approx(centrality, rel=0.5)
+
+
 @pytest.mark.usefixtures("populate_token_network_case_2")
 def test_suggest_partner(
     token_network_model: TokenNetwork,
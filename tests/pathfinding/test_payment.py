@@ -16,6 +16,23 @@ def test_save_and_load_iou(pathfinding_service_mock, make_iou):
     assert stored_iou == iou
 
 
+def test_store_claimed_iou(pathfinding_service_mock, make_iou):
+    """Claims since the last `refresh_claimed` are detected when storing an IOU"""
+    pfs = pathfinding_service_mock
+    privkey = get_random_privkey()
+    iou = make_iou(privkey, pfs.address, amount=1)
+    pfs.iou_sessions.store(iou)
+    pfs.database.conn.execute("UPDATE iou SET claimed=1")
+
+    iou = make_iou(privkey, pfs.address, amount=2)
+    with pytest.raises(exceptions.IOUAlreadyClaimed):
+        pfs.iou_sessions.store(iou)
+    assert pfs.iou_sessions.get_active(iou.sender) is None
+    assert pfs.iou_sessions.is_claimed(iou.sender, iou.claimable_until)
+    stored_iou = pfs.database.get_iou(iou.sender, iou.claimable_until)
+    assert stored_iou and stored_iou.amount == 1
+
+
 def test_process_payment_errors(
     pathfinding_service_web3_mock,
     web3,
@@ -107,6 +124,8 @@ def test_process_payment(
     iou = make_iou(privkey, pfs.address, amount=1)
     pfs.blockchain_state.latest_committed_block = web3.eth.block_number
     process_payment(iou, pfs, service_fee, one_to_n_address)
+    # Accepted IOUs are written to the db before the request is answered
+    assert pfs.database.get_iou(iou.sender, iou.claimable_until) == iou
 
     # The same payment can't be reused
     with pytest.raises(exceptions.InsufficientServicePayment):
@@ -138,5 +157,6 @@ def test_process_payment(
     # Complain if the IOU has been claimed
     iou = make_iou(privkey, pfs.address, amount=3)
     pfs.database.conn.execute("UPDATE iou SET claimed=1")
+    pfs.iou_sessions.refresh_claimed()
     with pytest.raises(exceptions.IOUAlreadyClaimed):
         process_payment(iou, pfs, service_fee, one_to_n_address)
@@ -0,0 +1,118 @@
+import pickle
+from typing import List
+from unittest.mock import patch
+
+import pytest
+from raiden_common.network.transport.matrix.utils import AddressReachability
+from raiden_common.utils.typing import Address, PaymentAmount
+
+from pathfinding_service.model import TokenNetwork
+from pathfinding_service.routing_pool import RoutingPool, RoutingSnapshot
+from tests.pathfinding.utils import SimpleReachabilityContainer
+
+
+@pytest.mark.usefixtures("populate_token_network_case_1")
+def test_routing_snapshot(
+    token_network_model: TokenNetwork,
+    reachability_state: SimpleReachabilityContainer,
+    addresses: List[Address],
+):
+    """A token network restored from a snapshot must return the same paths"""
+    snapshot = pickle.loads(
+        pickle.dumps(RoutingSnapshot.from_token_network(token_network_model, reachability_state))
+    )
+    restored = snapshot.to_token_network()
+
+    def get_paths(token_network: TokenNetwork, reachability) -> List[dict]:
+        paths = token_network.get_paths(
+            source=addresses[0],
+            target=addresses[3],
+            value=PaymentAmount(10),
+            max_paths=2,
+            reachability_state=reachability,
+        )
+        return [path.to_dict() for path in paths]
+
+    expected = get_paths(token_network_model, reachability_state)
+    assert len(expected) == 2
+    assert get_paths(restored, snapshot.reachability_state) == expected
+
+
+@pytest.mark.usefixtures("populate_token_network_case_1")
+def test_routing_pool(
+    token_network_model: TokenNetwork,
+    reachability_state: SimpleReachabilityContainer,
+    addresses: List[Address],
+):
+    path_request = dict(
+        source=addresses[0], target=addresses[3], value=PaymentAmount(10), max_paths=2
+    )
+    expected = token_network_model.get_paths(reachability_state=reachability_state, **path_request)
+
+    pool = RoutingPool(max_workers=1)
+    try:
+        paths = pool.get_paths(token_network_model, reachability_state, **path_request)
+        assert [p.to_dict() for p in paths] == [p.to_dict() for p in expected]
+        assert [p.nodes for p in paths] == [p.nodes for p in expected]
+        assert [p.estimated_fee for p in paths] == [p.estimated_fee for p in expected]
+    finally:
+        pool.stop()
+
+
+@pytest.mark.usefixtures("populate_token_network_case_1")
+def test_routing_pool_publishes_deltas(
+    token_network_model: TokenNetwork,
+    reachability_state: SimpleReachabilityContainer,
+    addresses: List[Address],
+):
+    """Workers must apply the published deltas to their restored token networks"""
+    # pylint: disable=protected-access
+    token_network_model.track_reachability(reachability_state)
+    path_request = dict(
+        source=addresses[0], target=addresses[3], value=PaymentAmount(10), max_paths=5
+    )
+
+    def check_paths() -> None:
+        expected = token_network_model.get_paths(
+            reachability_state=reachability_state, **path_request
+        )
+        paths = pool.get_paths(token_network_model, reachability_state, **path_request)
+        assert [p.to_dict() for p in paths] == [p.to_dict() for p in expected]
+
+    pool = RoutingPool(max_workers=1)
+    try:
+        check_paths()
+        snapshot = pool._snapshots[token_network_model.address]
+
+        # Unchanged token networks are not published again
+        pool.publish_snapshots([token_network_model], reachability_state)
+        assert len(snapshot.segments) == 1
+
+        # Only the changes are published
+        channel_id = next(
+            channel_id
+            for channel_id, participants in token_network_model.channel_id_to_addresses.items()
+            if set(participants) == {addresses[1], addresses[4]}
+        )
+        token_network_model.handle_channel_removed_event(channel_id)
+        reachability_state.reachabilities[addresses[2]] = AddressReachability.UNREACHABLE
+        token_network_model.handle_reachability_change(
+            addresses[2], AddressReachability.UNREACHABLE
+        )
+        pool.publish_snapshots([token_network_model], reachability_state)
+        assert pool._snapshots[token_network_model.address] is snapshot
+        assert len(snapshot.segments) == 2
+        check_paths()
+
+        # Too large deltas lead to a new full snapshot
+        reachability_state.reachabilities[addresses[2]] = AddressReachability.REACHABLE
+        token_network_model.handle_reachability_change(addresses[2], AddressReachability.REACHABLE)
+        with patch("pathfinding_service.routing_pool.ROUTING_SNAPSHOT_MAX_DELTA_RATIO", 0):
+            pool.publish_snapshots([token_network_model], reachability_state)
+        new_snapshot = pool._snapshots[token_network_model.address]
+        assert snapshot.superseded
+        assert len(new_snapshot.segments) == 1
+        assert new_snapshot.version == token_network_model.version
+        check_paths()
+    finally:
+        pool.stop()
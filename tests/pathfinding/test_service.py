@@ -1,5 +1,6 @@
 import dataclasses
 import os
+import sqlite3
 from datetime import datetime
 from typing import List
 from unittest.mock import Mock, patch
@@ -26,6 +27,9 @@ from raiden_common.utils.typing import (
 )
 
 from pathfinding_service import metrics
+from pathfinding_service.database import PFSDatabase
+from pathfinding_service.model import CompactTokenNetwork, TokenNetwork
+from pathfinding_service.model.feedback import FeedbackToken
 from pathfinding_service.model.token_network import PFSFeeUpdate
 from pathfinding_service.service import PathfindingService
 from raiden_contracts.constants import CONTRACT_TOKEN_NETWORK_REGISTRY, CONTRACT_USER_DEPOSIT
@@ -123,8 +127,10 @@ def test_prometheus_event_handling_raise_exception(pathfinding_service_mock_empt
         )
 
 
-def test_save_and_load_token_networks(pathfinding_service_mock_empty):
+@pytest.mark.parametrize("token_network_class", [TokenNetwork, CompactTokenNetwork])
+def test_save_and_load_token_networks(pathfinding_service_mock_empty, token_network_class):
     pfs = pathfinding_service_mock_empty
+    pfs.token_network_class = token_network_class
 
     token_address = TokenAddress(bytes([1] * 20))
     token_network_address = TokenNetworkAddress(bytes([2] * 20))
@@ -157,9 +163,73 @@ def test_save_and_load_token_networks(pathfinding_service_mock_empty):
     loaded = list(loaded_networks.values())[0]
     assert loaded.address == orig.address
     assert loaded.channel_id_to_addresses == orig.channel_id_to_addresses
+    assert isinstance(loaded, token_network_class)
+    assert loaded.is_tracking(pfs.matrix_listener.user_manager)
     assert loaded.G.nodes == orig.G.nodes
 
 
+def test_load_token_networks_from_graph_snapshot(pathfinding_service_mock_empty, tmpdir):
+    pfs = pathfinding_service_mock_empty
+    pfs.graph_snapshot_file = os.path.join(tmpdir, "graph.snapshot")
+
+    token_network_address = TokenNetworkAddress(bytes([2] * 20))
+    participants = [Address(bytes([i] * 20)) for i in range(3, 7)]
+    pfs.handle_event(
+        ReceiveTokenNetworkCreatedEvent(
+            token_address=TokenAddress(bytes([1] * 20)),
+            token_network_address=token_network_address,
+            settle_timeout=DEFAULT_TOKEN_NETWORK_SETTLE_TIMEOUT,
+            block_number=BlockNumber(1),
+        )
+    )
+
+    def open_channel(channel_id: int) -> None:
+        pfs.handle_event(
+            ReceiveChannelOpenedEvent(
+                token_network_address=token_network_address,
+                channel_identifier=ChannelID(channel_id),
+                participant1=participants[channel_id - 1],
+                participant2=participants[channel_id],
+                block_number=BlockNumber(2),
+            )
+        )
+
+    open_channel(1)
+    open_channel(2)
+    yield_func = Mock()
+    pfs.write_graph_snapshot(yield_func=yield_func)
+    # Other greenlets can run between the token networks
+    assert yield_func.call_count == len(pfs.token_networks)
+
+    # Change the db after the snapshot has been written
+    token_network = pfs.token_networks[token_network_address]
+    channel = token_network.G[participants[1]][participants[2]]["view"].channel
+    channel.capacity1 = TokenAmount(100)
+    pfs.database.upsert_channel(channel)
+    open_channel(3)
+
+    with patch.object(
+        PFSDatabase, "channel_from_row", wraps=PFSDatabase.channel_from_row
+    ) as channel_from_row:
+        loaded = pfs._load_token_networks()  # pylint: disable=protected-access
+
+    # Only the changed and the new channel have been deserialized
+    assert channel_from_row.call_count == 2
+    loaded_network = loaded[token_network_address]
+    assert loaded_network.channel_id_to_addresses == token_network.channel_id_to_addresses
+    loaded_channel = loaded_network.G[participants[1]][participants[2]]["view"].channel
+    assert loaded_channel.capacity1 == 100
+
+    # A snapshot for another registry is ignored
+    pfs.registry_address = bytes([10] * 20)
+    with patch.object(
+        PFSDatabase, "channel_from_row", wraps=PFSDatabase.channel_from_row
+    ) as channel_from_row:
+        loaded = pfs._load_token_networks()  # pylint: disable=protected-access
+    assert channel_from_row.call_count == 3
+    assert loaded[token_network_address].G.nodes == token_network.G.nodes
+
+
 @patch("pathfinding_service.service.MatrixListener", Mock)
 def test_crash(tmpdir, mockchain):  # pylint: disable=too-many-locals
     """Process blocks and compare results with/without crash
@@ -417,6 +487,101 @@ def test_update_fee(order, pathfinding_service_mock, token_network_model):
         assert getattr(cv.fee_schedule_sender, key) == getattr(fee_schedule, key)
 
 
+def test_channel_write_behind(pathfinding_service_mock, token_network_model):
+    pfs = pathfinding_service_mock
+    pfs.database.insert("token_network", dict(address=token_network_model.address))
+    setup_channel(pfs, token_network_model)
+
+    def send_fee_update(flat_fee: int) -> None:
+        fee_update = PFSFeeUpdate(
+            canonical_identifier=CanonicalIdentifier(
+                chain_identifier=ChainID(TEST_CHAIN_ID),
+                token_network_address=token_network_model.address,
+                channel_identifier=ChannelID(1),
+            ),
+            updating_participant=PARTICIPANT1,
+            fee_schedule=FeeScheduleState(flat=FeeAmount(flat_fee)),
+            timestamp=datetime.utcnow(),
+            signature=EMPTY_SIGNATURE,
+        )
+        fee_update.sign(LocalSigner(PARTICIPANT1_PRIVKEY))
+        pfs.handle_message(fee_update)
+
+    def stored_flat_fees() -> List[int]:
+        return [
+            channel.fee_schedule1.flat
+            if channel.participant1 == PARTICIPANT1
+            else channel.fee_schedule2.flat
+            for channel in pfs.database.get_channels()
+        ]
+
+    # Updates are only written on flush, repeated updates are coalesced
+    send_fee_update(1)
+    send_fee_update(2)
+    assert stored_flat_fees() == [0]
+    with patch.object(
+        pfs.database, "upsert_channels", wraps=pfs.database.upsert_channels
+    ) as upsert_channels:
+        pfs.flush_channels()
+        pfs.flush_channels()
+    upsert_channels.assert_called_once()
+    assert len(upsert_channels.call_args[0][0]) == 1
+    assert stored_flat_fees() == [2]
+
+    # Updates are kept for the next flush if the write fails
+    send_fee_update(3)
+    with patch.object(pfs.database, "upsert_channels", side_effect=sqlite3.OperationalError):
+        with pytest.raises(sqlite3.OperationalError):
+            pfs.flush_channels()
+    assert stored_flat_fees() == [2]
+    pfs.flush_channels()
+    assert stored_flat_fees() == [3]
+
+    # Pending updates must not recreate closed channels
+    send_fee_update(4)
+    pfs.handle_event(
+        ReceiveChannelClosedEvent(
+            token_network_address=token_network_model.address,
+            channel_identifier=ChannelID(1),
+            closing_participant=PARTICIPANT1,
+            block_number=BlockNumber(2),
+        )
+    )
+    pfs.flush_channels()
+    assert stored_flat_fees() == []
+
+
+def test_capacity_update_write_behind(pathfinding_service_mock, token_network_model):
+    pfs = pathfinding_service_mock
+    key = (token_network_model.address, ChannelID(1), PARTICIPANT1)
+    pfs.capacity_updates[key] = (TokenAmount(1), TokenAmount(2))
+    pfs._dirty_capacity_updates.add(key)  # pylint: disable=protected-access
+
+    # Updates are kept for the next flush if the write fails
+    with patch.object(
+        pfs.database, "upsert_capacity_updates", side_effect=sqlite3.OperationalError
+    ):
+        with pytest.raises(sqlite3.OperationalError):
+            pfs.flush_channels()
+    assert pfs.database.get_capacity_updates() == {}
+    pfs.flush_channels()
+    assert pfs.database.get_capacity_updates() == {key: (1, 2)}
+
+
+def test_feedback_write_behind(pathfinding_service_mock, token_network_model):
+    pfs = pathfinding_service_mock
+    route = [PARTICIPANT1, PARTICIPANT2]
+    pfs.store_feedback_token(FeedbackToken(token_network_model.address), [(route, FeeAmount(0))])
+
+    # Feedback tokens are kept for the next flush if the write fails
+    with patch.object(pfs.database, "prepare_feedbacks", side_effect=sqlite3.OperationalError):
+        with pytest.raises(sqlite3.OperationalError):
+            pfs.flush_feedback()
+    assert pfs.database.get_num_routes_feedback() == 0
+    pfs.flush_feedback()
+    assert pfs.database.get_num_routes_feedback() == 1
+
+
 def test_unhandled_message(pathfinding_service_mock, log):
     metrics_state = save_metrics_state(metrics.REGISTRY)
 
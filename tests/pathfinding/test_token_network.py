@@ -123,6 +123,13 @@ def test_path_without_capacity(token_network_model: TokenNetwork, addresses: Lis
 def test_check_path_request_errors(token_network_model, addresses):
     a = addresses  # pylint: disable=invalid-name
 
+    def set_capacity(participant1: Address, participant2: Address, capacity: int) -> None:
+        # Bypasses the capacity updates, so the capacity index must be told
+        token_network_model.G.edges[participant1, participant2]["view"].capacity = capacity
+        token_network_model._invalidate_capacities(  # pylint: disable=protected-access
+            participant1, participant2
+        )
+
     # Not online checks
     assert (
         token_network_model.check_path_request_errors(
@@ -164,12 +171,12 @@ def test_check_path_request_errors(token_network_model, addresses):
     assert token_network_model.check_path_request_errors(a[0], a[2], 100, reachability).startswith(
         "Source does not have a channel with sufficient capacity"
     )
-    token_network_model.G.edges[a[0], a[1]]["view"].capacity = 100
+    set_capacity(a[0], a[1], 100)
 
     assert token_network_model.check_path_request_errors(a[0], a[2], 100, reachability).startswith(
         "Target does not have a channel with sufficient capacity"
     )
-    token_network_model.G.edges[a[1], a[2]]["view"].capacity = 100
+    set_capacity(a[1], a[2], 100)
 
     # Must return `None` when no errors could be found
     assert token_network_model.check_path_request_errors(a[0], a[2], 100, reachability) is None
@@ -180,9 +187,45 @@ def test_check_path_request_errors(token_network_model, addresses):
         participant1=a[3],
         participant2=a[4],
     )
-    token_network_model.G.edges[a[3], a[4]]["view"].capacity = 100
+    set_capacity(a[3], a[4], 100)
     reachability.reachabilities[a[4]] = AddressReachability.REACHABLE
     assert (
         token_network_model.check_path_request_errors(a[0], a[4], 100, reachability)
         == "No route from source to target"
     )
+
+
+def test_has_route(token_network_model: TokenNetwork, addresses: List[Address]):
+    def open_channel(channel_id: int, participant1: Address, participant2: Address) -> None:
+        token_network_model.handle_channel_opened_event(
+            channel_identifier=ChannelID(channel_id),
+            participant1=participant1,
+            participant2=participant2,
+        )
+
+    open_channel(1, addresses[0], addresses[1])
+    open_channel(2, addresses[2], addresses[3])
+    assert token_network_model.has_route(addresses[1], addresses[0])
+    assert not token_network_model.has_route(addresses[0], addresses[3])
+    assert not token_network_model.has_route(addresses[0], addresses[4])
+
+    # connects both components
+    open_channel(3, addresses[1], addresses[2])
+    assert token_network_model.has_route(addresses[0], addresses[3])
+
+    # splits them again
+    token_network_model.handle_channel_removed_event(ChannelID(3))
+    assert not token_network_model.has_route(addresses[0], addresses[3])
+    assert token_network_model.has_route(addresses[3], addresses[2])
+
+    # a cycle keeps the nodes connected when one of its channels is removed
+    open_channel(4, addresses[1], addresses[2])
+    open_channel(5, addresses[3], addresses[0])
+    token_network_model.handle_channel_removed_event(ChannelID(4))
+    assert token_network_model.has_route(addresses[1], addresses[2])
+
+    # nodes without channels are not connected to anything
+    token_network_model.handle_channel_removed_event(ChannelID(1))
+    assert not token_network_model.has_route(addresses[1], addresses[0])
+    assert not token_network_model.has_route(addresses[1], addresses[1])
+    assert token_network_model.has_route(addresses[0], addresses[2])